@@ -1,6 +1,14 @@
+import os
 import h5py
+import random
+import numpy as np
+import torch
 from torch.utils import data
 
+from codec import read_raw
+
+inference_mode = getattr(torch, 'inference_mode', torch.no_grad)       # torch.inference_mode only exists from torch 1.9 on
+
 class HDF5Dataset(data.Dataset):
     def __init__(self, archive, type):
         self.archive = archive
@@ -9,7 +17,7 @@ class HDF5Dataset(data.Dataset):
     def __getitem__(self, index):
         with h5py.File(self.archive, 'r', libver='latest', swmr=True) as archive:
             datum = archive['x_' + str(self.phase)][index, :]
-            datum_raw = archive['x_raw_' + str(self.phase)][index, :]
+            datum_raw = read_raw(archive, 'x_raw_' + str(self.phase), index)            # decoded if stored as int16
             label = archive['y_' + str(self.phase)][index]
             return datum, label, datum_raw
 
@@ -17,3 +25,170 @@ class HDF5Dataset(data.Dataset):
         with h5py.File(self.archive, 'r', libver='latest', swmr=True) as archive:
             datum = archive['x_' + str(self.phase)]
             return len(datum)
+
+
+class VariableLengthDataset(data.Dataset):
+    '''
+    samples of different lengths (e.g. 1 day and 7 days) stored back to back in one flat array per type; sample i is
+    x[offsets[i]:offsets[i+1]], so one model can be trained on all horizons
+    '''
+    def __init__(self, archive, type):
+        self.archive = archive
+        self.phase = type
+        with h5py.File(self.archive, 'r', libver='latest', swmr=True) as archive:
+            self.offsets = archive['offsets_' + str(self.phase)][:]
+        self.lengths = self.offsets[1:] - self.offsets[:-1]
+
+    def __getitem__(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        with h5py.File(self.archive, 'r', libver='latest', swmr=True) as archive:
+            datum = archive['x_' + str(self.phase)][start:end]
+            datum_raw = archive['x_raw_' + str(self.phase)][start:end]
+            label = archive['y_' + str(self.phase)][index]
+            return datum, label, datum_raw
+
+    def __len__(self):
+        return len(self.lengths)
+
+
+class VirtualWindowDataset(data.Dataset):
+    '''
+    windows sliced on access from the memory mapped arrays of the raw store (see raw_store.py) instead of samples read
+    from a dataset file: every row of the index is (run, terminal, offset, label) and yields the voltages of the terminal
+    from offset on, preprocessed like the saved datasets (zero meaned by itself and scaled with the max abs values
+    fitted on the training windows, see fit_max_abs). For the dummy dataset, negative windows are held constant at
+    their first value.
+    '''
+    def __init__(self, manifest, index, sample_length, max_abs=None, constant_negatives=False):
+        self.folder = manifest['folder']
+        self.files = [run['array'] for run in manifest['runs']]
+        self.index = np.asarray(index, dtype=np.int64)
+        self.sample_length = sample_length
+        self.constant_negatives = constant_negatives
+        self.max_abs = None if max_abs is None else np.where(np.asarray(max_abs) == 0, 1, max_abs).astype(np.float32)
+        self._arrays = {}
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_arrays'] = {}                   # workers map the arrays themselves instead of getting copies
+        return state
+
+    def array(self, run):
+        if run not in self._arrays:
+            self._arrays[run] = np.load(os.path.join(self.folder, self.files[run]), mmap_mode='r')
+        return self._arrays[run]
+
+    def windows(self, rows):
+        '''
+        raw windows of the given index rows [rows, sample length], gathered per run
+        '''
+        rows = self.index[rows]
+        windows = np.empty((len(rows), self.sample_length), dtype=np.float32)
+        steps = np.arange(self.sample_length)
+        for run in np.unique(rows[:, 0]):
+            of_run = rows[:, 0] == run
+            windows[of_run] = self.array(run)[rows[of_run, 2][:, None] + steps, rows[of_run, 1][:, None]]
+        if self.constant_negatives:
+            negative = rows[:, 3] == 0
+            windows[negative] = windows[negative, :1]
+        return windows
+
+    def preprocess(self, windows):
+        windows = windows - windows.mean(axis=-1, keepdims=True)
+        return windows / self.max_abs if self.max_abs is not None else windows
+
+    def fit_max_abs(self, batch_size=10000):
+        '''
+        fits the max abs values of the zero meaned windows of this (training) dataset and uses them from now on
+        '''
+        max_abs = np.zeros(self.sample_length, dtype=np.float32)
+        for start in range(0, len(self.index), batch_size):
+            windows = self.windows(np.arange(start, min(start + batch_size, len(self.index))))
+            np.maximum(max_abs, np.abs(windows - windows.mean(axis=1, keepdims=True)).max(axis=0), out=max_abs)
+        self.max_abs = np.where(max_abs == 0, 1, max_abs)
+        return max_abs
+
+    def __getitem__(self, index):
+        datum_raw = self.windows([index])[0]
+        return self.preprocess(datum_raw).astype(np.float32), self.index[index, 3:4], datum_raw
+
+    def __len__(self):
+        return len(self.index)
+
+
+class LengthBucketSampler(data.Sampler):
+    '''
+    batches of samples of (nearly) the same length so that hardly any padding is needed: samples are sorted by length
+    (ties broken randomly), cut into batches and the order of the batches is shuffled every epoch
+    '''
+    def __init__(self, lengths, batch_size, shuffle=True):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+
+    def __iter__(self):
+        if self.shuffle:
+            order = np.lexsort((np.random.permutation(len(self.lengths)), self.lengths))
+        else:
+            order = np.argsort(self.lengths, kind='stable')
+        batches = [order[i:i + self.batch_size].tolist() for i in range(0, len(order), self.batch_size)]
+        if self.shuffle:
+            random.shuffle(batches)
+        return iter(batches)
+
+    def __len__(self):
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+
+def pad_collate(batch):
+    '''
+    pads the samples of a batch at the end to the longest one and adds their lengths:
+    (samples [batch, longest], labels [batch, 1], raw samples [batch, longest], lengths [batch])
+    '''
+    lengths = torch.tensor([len(datum) for datum, label, datum_raw in batch])
+    data = torch.zeros(len(batch), int(lengths.max()))
+    data_raw = torch.zeros(len(batch), int(lengths.max()))
+    for i, (datum, label, datum_raw) in enumerate(batch):
+        data[i, :len(datum)] = torch.as_tensor(datum)
+        data_raw[i, :len(datum_raw)] = torch.as_tensor(datum_raw)
+    labels = torch.as_tensor(np.array([label for datum, label, datum_raw in batch]))
+    return data, labels, data_raw, lengths
+
+
+def last_valid_outputs(output, lengths=None):
+    '''
+    output of the last time step of every sample [batch, classes]; with lengths (padded batches) the last valid one
+    '''
+    if lengths is None:
+        return output[:, -1]
+    return output[torch.arange(len(output), device=output.device), lengths.to(output.device) - 1]
+
+
+def stream_last_outputs(test_loader, forward, device):
+    '''
+    streams through the whole test set and only keeps the output of the last time step (most informed output) of every
+    sample, so memory grows with the number of samples times the number of classes only; forward(samples, lengths)
+    returns the outputs of a batch [batch, steps, classes]. Returns the predicted classes, the last outputs and the
+    labels (empty if the test set is)
+    '''
+    number_of_samples = len(test_loader.dataset)
+    if number_of_samples == 0:
+        return torch.empty(0, dtype=torch.long), torch.empty(0, 0, device=device), torch.empty(0, dtype=torch.long)
+    last_outputs_cumm = None
+    y_test = torch.empty(number_of_samples, dtype=torch.long)
+    samples_done = 0
+    with inference_mode():
+        for test_batch in test_loader:
+            input_sequences, labels, raw_seq = test_batch[:3]
+            lengths = test_batch[3] if len(test_batch) > 3 else None
+            outputs = forward(input_sequences, lengths)
+            if last_outputs_cumm is None:                # results are written into a tensor allocated once
+                last_outputs_cumm = torch.empty(number_of_samples, outputs.size(-1), device=device)
+            batch = slice(samples_done, samples_done + len(outputs))
+            samples_done += len(outputs)
+
+            last_outputs_cumm[batch] = last_valid_outputs(outputs, lengths)
+            y_test[batch] = labels.view(len(labels), -1)[:, -1]
+
+    pred = torch.argmax(last_outputs_cumm, dim=-1)  # chose class that has highest probability
+    return pred, last_outputs_cumm, y_test
@@ -5,22 +5,18 @@ compute the training loss. This is done because this output is thought of as the
 
 import torch
 from torch import nn
-from sklearn.preprocessing import MaxAbsScaler
-from sklearn.metrics import precision_recall_fscore_support
-from sklearn.metrics import accuracy_score
 import random
 import numpy as np
 import copy
-import importlib
 import os
 
-from experiment_config import experiment_path, chosen_experiment
-spec = importlib.util.spec_from_file_location(chosen_experiment, experiment_path)
-config = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(config)
+from experiment_config import config, learning_config
+from profiling import stage, training_profiler
+from HDF5Dataset import last_valid_outputs, stream_last_outputs
 
-
-configuration = config.learning_config
+configuration = learning_config
+inference_mode = getattr(torch, 'inference_mode', torch.no_grad)       # torch.inference_mode only exists from torch 1.9 on
+is_inference_mode_enabled = getattr(torch, 'is_inference_mode_enabled', lambda: False)
 
 def choose_best(models_and_losses):
     index_best = [i[1] for i in models_and_losses].index(min([i[1] for i in models_and_losses]))
@@ -39,6 +35,7 @@ def save_model(model, epoch, loss):
             'model_state_dict': model.state_dict(),
             'optimizer_state_dict': model.optimizer.state_dict(),
             'loss': loss,
+            'variable_length': model.variable_length,
         }, os.path.join(path, 'model.pth'))
     except TypeError:
         torch.save({
@@ -46,6 +43,7 @@ def save_model(model, epoch, loss):
             'model_state_dict': model.state_dict,
             'optimizer_state_dict': model.optimizer.state_dict(),
             'loss': loss,
+            'variable_length': model.variable_length,
         }, os.path.join(path, 'model.pth'))
 
 class RNN(nn.Module):
@@ -62,37 +60,61 @@ class RNN(nn.Module):
         self._fc = nn.Linear(hidden_dim, output_size).to(self._device)
         self.optimizer = self.choose_optimizer(alpha=configuration["learning rate"] * configuration["mini batch size"])     # linear scaling of LR
         self._estimator_type = 'classifier'
+        self._hidden = {}                                   # initial hidden states of zeros per batch shape
+        self.variable_length = False                        # trained on padded batches, recurrence along the time axis
+
 
+    def forward(self, x, lengths=None):
+        seq_length = x.size(1)
 
-    def forward(self, x):
-        seq_length = len(x[0])
+        if lengths is not None:
+            return self.forward_packed(x, lengths)
 
         # Initializing hidden state for first input using method defined below
-        hidden = self.init_hidden(seq_length).to(self._device)
+        hidden = self.init_hidden(seq_length)
 
         if x.dim() == 2:
             x = x.view(-1,seq_length, 1)
-        # Passing in the input and hidden state into the model and obtaining outputs
-        if x.device == torch.device("cpu"):
-            self._rnn = self._rnn.to(torch.device("cpu"))
-            self._fc = self._fc.to(torch.device("cpu"))
-            out, hidden = self._rnn(x, hidden)
-            out = self._fc(out)
-        else:
-            self._rnn = self._rnn.to(self.choose_device())
-            self._fc = self._fc.to(self.choose_device())
-            out, hidden = self._rnn(x, hidden)
-            # feed output into the fully connected layer
-            out = self._fc(out)
+        # Passing in the input and hidden state into the model and obtaining outputs; the model stays on the device it
+        # was pinned to, only the input is moved if necessary
+        out, hidden = self._rnn(x.to(self._device), hidden)
+        # feed output into the fully connected layer
+        out = self._fc(out)
+
+        return out, hidden
+
+    def forward_packed(self, x, lengths):
+        # Padded batch of samples of different lengths [batch, longest, features]: the samples are packed so that the
+        # recurrence runs along the time axis of every sample and stops at its last valid step
+        if x.dim() == 2:
+            x = x.view(x.size(0), -1, 1)
+        hidden = self.init_hidden(x.size(0))
+        packed = nn.utils.rnn.pack_padded_sequence(x.to(self._device), lengths.cpu(), batch_first=True, enforce_sorted=False)
+        out, hidden = self._rnn(packed, hidden)
+        out, _ = nn.utils.rnn.pad_packed_sequence(out, batch_first=True, total_length=x.size(1))
+        out = self._fc(out)
 
         return out, hidden
 
     def init_hidden(self, seq_length):
         device = self._device
         # This method generates the first hidden state of zeros which we'll use in the forward pass
-        hidden = torch.zeros(self.n_layers, seq_length, self.hidden_dim).to(device)
-        # We'll send the tensor holding the hidden state to the device we specified earlier as well
-        return hidden
+        # It is never written to, so the same tensor is reused for every batch of the same shape (separately for
+        # inference mode, as tensors created in there cannot be used by autograd); not while tracing for an export
+        # though, as a cached tensor would be exported as a constant of fixed size
+        key = (seq_length, is_inference_mode_enabled())
+        if torch.jit.is_tracing() or key not in self._hidden:
+            hidden = torch.zeros(self.n_layers, seq_length, self.hidden_dim, device=device)
+            if torch.jit.is_tracing():
+                return hidden
+            self._hidden[key] = hidden
+        return self._hidden[key]
+
+    def pin_device(self, device=None):
+        # Moves the model to one device once, instead of checking the device of the input in every forward pass
+        self._device = device if device is not None else self.choose_device()
+        self._hidden = {}
+        return self.to(self._device)
 
     def fit(self, train_loader=None, test_loader=None, X_train=None, y_train=None, X_test=None, y_test=None, early_stopping=True, control_lr=None, prev_epoch=1, prev_loss=1):
 
@@ -117,11 +139,13 @@ class RNN(nn.Module):
         if prev_epoch is None:
             prev_epoch = 1
 
+        step_profiler = training_profiler(configuration, type(self).__name__)
         for epoch in range(prev_epoch, configuration["number of epochs"] + 1):
 
             if configuration["optimizer"] == 'SGD' and not epoch == prev_epoch:             #ADAM optimizer has internal states and should therefore not be reinitialized every epoch; only for SGD bc here changing the learning rate makes sense
                 self.optimizer, lr = self.control_learning_rate(lr=lr, loss=loss, losses=training_losses, nominal_lr=nominal_lr, epoch=epoch)
             lrs.append(lr)
+            train_stage = stage('train epoch', epoch=epoch).begin()
 
             if X_train and y_train:
                 zipped_X_y = list(zip(X, y))
@@ -158,6 +182,7 @@ class RNN(nn.Module):
                     loss.backward()     # Does backpropagation and calculates gradients
                     torch.nn.utils.clip_grad_norm_(self.parameters(), configuration["gradient clipping"])       # `clip_grad_norm` helps prevent the exploding gradient problem in RNNs / LSTMs.
                     self.optimizer.step()    # Updates the weights accordingly
+                    step_profiler.step()
 
                     self.detach([last_outputs, sequences, labels, hidden])      #detach tensors from GPU to free memory
 
@@ -170,13 +195,16 @@ class RNN(nn.Module):
                 sys.stdout.flush()
                 sys.stdout.write("\b" * (toolbar_width+1)) # return to start of line, after '['
 
-                for i, (sequences, labels, raw_seq) in enumerate(train_loader):
+                for i, batch in enumerate(train_loader):
+                    sequences, labels, raw_seq = batch[:3]
+                    lengths = batch[3] if len(batch) > 3 else None              # padded batches of samples of different lengths
+                    self.variable_length = lengths is not None
                     labels = labels.to(self._device)
                     sequences = sequences.to(self._device)
                     self.optimizer.zero_grad()  # Clears existing gradients from previous batch so as not to backprop through entire dataset
-                    output, hidden = self(sequences)
+                    output, hidden = self(sequences, lengths)
 
-                    last_outputs = torch.stack([i[-1] for i in output])         #choose last output of timeseries (most informed output)
+                    last_outputs = last_valid_outputs(output, lengths)          #choose last (valid) output of timeseries (most informed output)
                     last_outputs = last_outputs.to(self._device)
 
                     labels = torch.stack([i[-1] for i in labels]).long()
@@ -185,6 +213,7 @@ class RNN(nn.Module):
                     loss.backward()     # Does backpropagation and calculates gradients
                     torch.nn.utils.clip_grad_norm_(self.parameters(), configuration["gradient clipping"])       # `clip_grad_norm` helps prevent the exploding gradient problem in RNNs / LSTMs.
                     self.optimizer.step()    # Updates the weights accordingly
+                    step_profiler.step()
 
                     self.detach([last_outputs, sequences, labels, hidden])      #detach tensors from GPU to free memory
 
@@ -199,16 +228,18 @@ class RNN(nn.Module):
             else:
                 print('Either provide X and y or dataloaders!')
 
-            if X_train and y_train:
-                training_losses.append(loss)
-                val_outputs = torch.stack([i[-1].view(-1) for i in self.predict(X_test)[1]]).to(self._device)
-                val_loss = criterion(val_outputs, torch.Tensor([np.array(y_test)]).view(-1).long().to(self._device))
-            else:
-                training_losses.append(loss)
-                pred, val_outputs, y_test = self.predict(test_loader=test_loader)
-                val_outputs = torch.stack([i[-1] for i in val_outputs]).to(self._device)
-                y_test = y_test.view(-1).long().to(self._device)
-                val_loss = criterion(val_outputs, y_test).to(self._device)
+            train_stage.end(items=len(X) if X_train and y_train else len(train_loader.dataset))
+
+            with stage('validate', epoch=epoch) as validate_stage:
+                if X_train and y_train:
+                    training_losses.append(loss)
+                    val_outputs = torch.stack([i[-1].view(-1) for i in self.predict(X_test)[1]]).to(self._device)
+                    val_loss = criterion(val_outputs, torch.Tensor([np.array(y_test)]).view(-1).long().to(self._device))
+                else:
+                    training_losses.append(loss)
+                    pred, val_outputs, y_test = self.predict_last_outputs(test_loader)
+                    val_loss = criterion(val_outputs, y_test.to(self._device)).to(self._device)
+                validate_stage.count(len(y_test))
 
             models_and_val_losses.append((copy.deepcopy(self.state_dict), val_loss.item()))
 
@@ -223,6 +254,7 @@ class RNN(nn.Module):
                         pause += 1
                         if pause == 5:
                             print('Validation loss has not changed for {0} epochs! Early stopping of training after {1} epochs!'.format(pause, epoch))
+                            step_profiler.stop()
                             return models_and_val_losses, training_losses, lrs
                 except IndexError:
                     pass
@@ -231,51 +263,49 @@ class RNN(nn.Module):
                 print('Epoch: {}/{}.............'.format(epoch, configuration["number of epochs"]), end=' ')
                 print("Loss: {:.4f}".format(loss.item()))
 
+        step_profiler.stop()
         return models_and_val_losses, training_losses, lrs
 
     def predict(self, test_loader=None, X=None):
 
-        if X is not None:
-            input_sequences = torch.stack([torch.Tensor(i).view(len(i), -1) for i in X])
-
-            input_sequences = input_sequences.to(self._device)
-            outputs, hidden = self(input_sequences)
+        was_training = self.training
+        self.eval()
 
-            last_outputs = torch.stack([i[-1] for i in outputs]).to(self._device)
-            probs = nn.Softmax(dim=-1)(last_outputs)
-
-            pred = torch.argmax(probs, dim=-1)  # chose class that has highest probability
+        if X is not None:
+            with inference_mode():
+                input_sequences = torch.stack([torch.Tensor(i).view(len(i), -1) for i in X])
 
-            self.detach([input_sequences, hidden, outputs])
-            return [i.item() for i in pred], outputs
-        elif test_loader:
-            pred = torch.Tensor()
-            y_test = torch.Tensor()
-            outputs_cumm = torch.Tensor()
-            for i, (input_sequences, labels, raw_seq) in enumerate(test_loader):
                 input_sequences = input_sequences.to(self._device)
                 outputs, hidden = self(input_sequences)
 
-                last_outputs = torch.stack([i[-1] for i in outputs]).to(self._device)
+                last_outputs = outputs[:, -1]
                 probs = nn.Softmax(dim=-1)(last_outputs)
 
-                outputs_cumm = torch.cat((outputs_cumm.to(self._device), outputs.float()), 0)
-                pred = torch.cat((pred.to(self._device), torch.argmax(probs, dim=-1).float()), 0)  # chose class that has highest probability
-                y_test = torch.cat((y_test, labels.float()), 0)   # chose class that has highest probability
+                pred = torch.argmax(probs, dim=-1)  # chose class that has highest probability
 
-                self.detach([input_sequences, hidden, outputs])
-                if configuration["train test split"] <= 1:
-                    share_of_test_set = len(test_loader)*configuration["train test split"]*labels.size()[0]
-                else:
-                    share_of_test_set = configuration["train test split"]
-                if y_test.size()[0] >= share_of_test_set:           #to choose the test set size (memory issues!!)
-                    break
-            return [i.item() for i in pred], outputs_cumm, y_test
+            self.train(was_training)
+            return pred.tolist(), outputs
+        elif test_loader:
+            pred, last_outputs, y_test = self.predict_last_outputs(test_loader)
+            probs = nn.Softmax(dim=-1)(last_outputs)
+
+            self.train(was_training)
+            return pred.cpu().numpy(), probs.cpu().numpy(), y_test.numpy()
 
         else:
+            self.train(was_training)
             print('Either provide X or a dataloader!')
 
-    def choose_optimizer(self, alpha=configuration["learning rate"]):
+    def predict_last_outputs(self, test_loader):
+        '''
+        streams through the whole test set and only keeps the output of the last time step (most informed output) of
+        every sample, see HDF5Dataset.stream_last_outputs
+        '''
+        return stream_last_outputs(test_loader, lambda x, lengths: self(x.to(self._device), lengths)[0], self._device)
+
+    def choose_optimizer(self, alpha=None):
+        if alpha is None:
+            alpha = configuration["learning rate"]
         if configuration["optimizer"] == 'Adam':
             optimizer = torch.optim.Adam(self.parameters(), lr=alpha)
         else:
@@ -309,6 +339,7 @@ class RNN(nn.Module):
         return X_train, X_test
 
     def fit_scaler(self, X):
+        from sklearn.preprocessing import MaxAbsScaler
         X_zeromean = np.array([x - x.mean() for x in X])                        # deduct it's own mean from every sample
         maxabs_scaler = MaxAbsScaler().fit(X_zeromean)                          # fit scaler as to scale training data between -1 and 1
         return maxabs_scaler
@@ -319,6 +350,7 @@ class RNN(nn.Module):
         return X
 
     def score(self, y_test, y_pred):
+        from sklearn.metrics import precision_recall_fscore_support, accuracy_score
         metrics = precision_recall_fscore_support(y_test, y_pred, average='macro')
         accuracy = accuracy_score(y_test, y_pred)
         return [accuracy, metrics]
@@ -1,23 +1,17 @@
 import torch
 from torch import nn
 import torch.nn.functional as F
-from sklearn.preprocessing import MaxAbsScaler
-from sklearn.metrics import precision_recall_fscore_support
-from sklearn.metrics import accuracy_score
 import random
 import numpy as np
-import importlib
 import math, copy
 import gc
 import os
 
-from experiment_config import experiment_path, chosen_experiment
-spec = importlib.util.spec_from_file_location(chosen_experiment, experiment_path)
-config = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(config)
+from experiment_config import config, learning_config
+from profiling import stage, training_profiler
+from HDF5Dataset import last_valid_outputs, stream_last_outputs
 
-
-configuration = config.learning_config
+configuration = learning_config
 
 def choose_best(models_and_losses):
     index_best = [i[1] for i in models_and_losses].index(min([i[1] for i in models_and_losses]))
@@ -50,14 +44,30 @@ def clones(module, N):
     return nn.ModuleList([copy.deepcopy(module) for _ in range(N)])
 
 class LayerNorm(nn.Module):
-    "Construct a layernorm module."
-    def __init__(self, features, eps=1e-6):
+    """
+    Construct a layernorm module.
+    mode 'reference': mean, unbiased std and affine in separate kernels, (x - mean) / (std + eps)
+    mode 'compat': one fused F.layer_norm kernel that reproduces 'reference' (up to a relative difference in the order
+    of eps / std) by scaling with sqrt((n-1)/n) for the unbiased std and adding eps to the variance instead of the std
+    mode 'fused': plain F.layer_norm (biased variance like nn.LayerNorm); meant for models trained with it
+    The parameters keep their names in every mode so checkpoints can be loaded regardless of the mode.
+    """
+    def __init__(self, features, eps=1e-6, mode='reference'):
         super(LayerNorm, self).__init__()
+        if mode not in ('reference', 'compat', 'fused'):
+            raise ValueError("Layer norm mode has to be 'reference', 'compat' or 'fused', not %s" % mode)
         self.a_2 = nn.Parameter(torch.ones(features))
         self.b_2 = nn.Parameter(torch.zeros(features))
         self.eps = eps
+        self.mode = mode
+        self.unbiased_correction = math.sqrt((features - 1) / features) if features > 1 else 1.
 
     def forward(self, x):
+        if self.mode == 'compat':
+            c = self.unbiased_correction
+            return F.layer_norm(x, self.a_2.shape, self.a_2 * c, self.b_2, (c * self.eps) ** 2)
+        if self.mode == 'fused':
+            return F.layer_norm(x, self.a_2.shape, self.a_2, self.b_2, self.eps)
         mean = x.mean(-1, keepdim=True)
         std = x.std(-1, keepdim=True)
         return self.a_2 * (x - mean) / (std + self.eps) + self.b_2
@@ -67,9 +77,9 @@ class SublayerConnection(nn.Module):
     A residual connection followed by a layer norm.
     Note for code simplicity the norm is first as opposed to last.
     """
-    def __init__(self, size, dropout):
+    def __init__(self, size, dropout, layer_norm='reference'):
         super(SublayerConnection, self).__init__()
-        self.norm = LayerNorm(size)
+        self.norm = LayerNorm(size, mode=layer_norm)
         self.dropout = nn.Dropout(dropout)
 
     def forward(self, x, sublayer):
@@ -128,7 +138,7 @@ class MHPooling(nn.Module):
         subsequent_mask =  np.triu(np.ones(attn_shape), k=1).astype('uint8')
         try:
             self.mask = (torch.from_numpy(subsequent_mask) == 0).unsqueeze(1).cuda()
-        except RuntimeError and AssertionError:
+        except (RuntimeError, AssertionError):
             self.mask = (torch.from_numpy(subsequent_mask) == 0).unsqueeze(1)
 
     def forward(self, x):
@@ -171,7 +181,7 @@ class LocalRNN(nn.Module):
         try:
             self.select_index = torch.LongTensor(idx).cuda()
             self.zeros = torch.zeros((self.ksize-1, input_dim)).cuda()
-        except RuntimeError and AssertionError:
+        except (RuntimeError, AssertionError):
             self.select_index = torch.LongTensor(idx)
             self.zeros = torch.zeros((self.ksize-1, input_dim))
 
@@ -193,10 +203,10 @@ class LocalRNN(nn.Module):
 
 class LocalRNNLayer(nn.Module):
     "Encoder is made up of attconv and feed forward (defined below)"
-    def __init__(self, input_dim, output_dim, rnn_type, ksize, dropout):
+    def __init__(self, input_dim, output_dim, rnn_type, ksize, dropout, layer_norm='reference'):
         super(LocalRNNLayer, self).__init__()
         self.local_rnn = LocalRNN(input_dim, output_dim, rnn_type, ksize, dropout)
-        self.connection = SublayerConnection(output_dim, dropout)
+        self.connection = SublayerConnection(output_dim, dropout, layer_norm)
 
     def forward(self, x):
         "Follow Figure 1 (left) for connections."
@@ -209,11 +219,11 @@ class Block(nn.Module):
     """
     One Block
     """
-    def __init__(self, input_dim, output_dim, rnn_type, ksize, N, h, dropout):
+    def __init__(self, input_dim, output_dim, rnn_type, ksize, N, h, dropout, layer_norm='reference'):
         super(Block, self).__init__()
         self.layers = clones(
-            LocalRNNLayer(input_dim, output_dim, rnn_type, ksize, dropout), N)
-        self.connections = clones(SublayerConnection(output_dim, dropout), 2)
+            LocalRNNLayer(input_dim, output_dim, rnn_type, ksize, dropout, layer_norm), N)
+        self.connections = clones(SublayerConnection(output_dim, dropout, layer_norm), 2)
         self.pooling = MHPooling(input_dim, h, dropout)
         self.feed_forward = PositionwiseFeedForward(input_dim, dropout)
 
@@ -231,18 +241,18 @@ class RTransformer(nn.Module):
     """
     The overal model
     """
-    def __init__(self, d_model, rnn_type, ksize, n_level, n, h, dropout):
+    def __init__(self, d_model, rnn_type, ksize, n_level, n, h, dropout, layer_norm='reference'):
         super(RTransformer, self).__init__()
         N = n
         self.d_model = d_model
         self.dropout = nn.Dropout(dropout)
-        self.norm = LayerNorm(d_model)
+        self.norm = LayerNorm(d_model, mode=layer_norm)
         self.feed_forward = PositionwiseFeedForward(d_model, dropout)
 
         layers = []
         for i in range(n_level):
             layers.append(
-                Block(d_model, d_model, rnn_type, ksize, N=N, h=h, dropout=dropout))
+                Block(d_model, d_model, rnn_type, ksize, N=N, h=h, dropout=dropout, layer_norm=layer_norm))
         self.forward_net = nn.Sequential(*layers)
 
     def forward(self, x):
@@ -250,16 +260,18 @@ class RTransformer(nn.Module):
         return x
 
 class RT(nn.Module):
-    def __init__(self, input_size, d_model, output_size, h, rnn_type, ksize, n, n_level, dropout, emb_dropout):
+    def __init__(self, input_size, d_model, output_size, h, rnn_type, ksize, n, n_level, dropout, emb_dropout, layer_norm='reference'):
         super(RT, self).__init__()
         self.encoder = nn.Linear(input_size, d_model)
-        self.rt = RTransformer(d_model, rnn_type, ksize, n_level, n, h, dropout)
+        self.rt = RTransformer(d_model, rnn_type, ksize, n_level, n, h, dropout, layer_norm)
         self.linear = nn.Linear(d_model, output_size)
         self.sig = nn.Sigmoid()
         self._device = self.choose_device()
         self.optimizer = self.choose_optimizer(alpha=configuration["learning rate"] * configuration["mini batch size"])     # linear scaling of LR
 
-    def forward(self, x):
+    def forward(self, x, lengths=None):
+        # lengths of padded batches are not needed here: local RNNs and pooling only look back in time, so the padding
+        # at the end of shorter samples never reaches their valid steps
         x = self.encoder(x)
         output = self.rt(x)
         output = self.linear(output).double()
@@ -288,11 +300,13 @@ class RT(nn.Module):
         if prev_epoch is None:
             prev_epoch = 1
 
+        step_profiler = training_profiler(configuration, type(self).__name__)
         for epoch in range(prev_epoch, configuration["number of epochs"] + 1):
 
             if configuration["optimizer"] == 'SGD' and not epoch == prev_epoch:             #ADAM optimizer has internal states and should therefore not be reinitialized every epoch; only for SGD bc here changing the learning rate makes sense
                 self.optimizer, lr = self.control_learning_rate(lr=lr, loss=loss, losses=training_losses, nominal_lr=nominal_lr, epoch=epoch)
             lrs.append(lr)
+            train_stage = stage('train epoch', epoch=epoch).begin()
 
             if X_train and y_train:
                 zipped_X_y = list(zip(X, y))
@@ -333,6 +347,7 @@ class RT(nn.Module):
                     loss.backward()     # Does backpropagation and calculates gradients
                     #torch.nn.utils.clip_grad_norm_(self.parameters(), configuration["gradient clipping"])       # `clip_grad_norm` helps prevent the exploding gradient problem in RNNs / LSTMs.
                     self.optimizer.step()    # Updates the weights accordingly
+                    step_profiler.step()
 
                     gc.collect()
                     self.detach([sequences, labels])      #detach tensors from GPU to free memory
@@ -346,13 +361,15 @@ class RT(nn.Module):
                 sys.stdout.flush()
                 sys.stdout.write("\b" * (toolbar_width+1)) # return to start of line, after '['
 
-                for i, (sequences, labels, raw_seq) in enumerate(train_loader):
+                for i, batch in enumerate(train_loader):
+                    sequences, labels, raw_seq = batch[:3]
+                    lengths = batch[3] if len(batch) > 3 else None              # padded batches of samples of different lengths
                     labels = labels.to(self._device)
                     sequences = sequences.to(self._device)
                     self.optimizer.zero_grad()  # Clears existing gradients from previous batch so as not to backprop through entire dataset
-                    output = self(sequences.view(len(sequences), -1, 1))
+                    output = self(sequences.view(len(sequences), sequences.size(1), -1), lengths=lengths)
 
-                    last_outputs = torch.stack([i[-1] for i in output])         #choose last output of timeseries (most informed output)
+                    last_outputs = last_valid_outputs(output, lengths)          #choose last (valid) output of timeseries (most informed output)
                     last_outputs = last_outputs.to(self._device)
 
                     labels = torch.stack([i[-1] for i in labels]).long()
@@ -361,6 +378,7 @@ class RT(nn.Module):
                     loss.backward()     # Does backpropagation and calculates gradients
                     torch.nn.utils.clip_grad_norm_(self.parameters(), configuration["gradient clipping"])       # `clip_grad_norm` helps prevent the exploding gradient problem in RNNs / LSTMs.
                     self.optimizer.step()    # Updates the weights accordingly
+                    step_profiler.step()
 
                     self.detach([last_outputs, sequences, labels])      #detach tensors from GPU to free memory
 
@@ -375,16 +393,18 @@ class RT(nn.Module):
             else:
                 print('Either provide X and y or dataloaders!')
 
-            if X_train and y_train:
-                training_losses.append(loss)
-                val_outputs = torch.stack([i[-1].view(-1) for i in self.predict(X_test)[1]]).to(self._device)
-                val_loss = criterion(val_outputs, torch.Tensor([np.array(y_test)]).view(-1).long().to(self._device))
-            else:
-                training_losses.append(loss)
-                pred, val_outputs, y_test = self.predict(test_loader=test_loader)
-                val_outputs = torch.stack([i[-1] for i in val_outputs]).to(self._device)
-                y_test = y_test.view(-1).long().to(self._device)
-                val_loss = criterion(val_outputs, y_test).to(self._device)
+            train_stage.end(items=len(X) if X_train and y_train else len(train_loader.dataset))
+
+            with stage('validate', epoch=epoch) as validate_stage:
+                if X_train and y_train:
+                    training_losses.append(loss)
+                    val_outputs = torch.stack([i[-1].view(-1) for i in self.predict(X_test)[1]]).to(self._device)
+                    val_loss = criterion(val_outputs, torch.Tensor([np.array(y_test)]).view(-1).long().to(self._device))
+                else:
+                    training_losses.append(loss)
+                    pred, val_outputs, y_test = self.predict_last_outputs(test_loader)
+                    val_loss = criterion(val_outputs, y_test.to(self._device)).to(self._device)
+                validate_stage.count(len(y_test))
 
             models_and_val_losses.append((copy.deepcopy(self.state_dict()), val_loss.item()))
 
@@ -399,6 +419,7 @@ class RT(nn.Module):
                         pause += 1
                         if pause == 5:
                             print('Validation loss has not changed for {0} epochs! Early stopping of training after {1} epochs!'.format(pause, epoch))
+                            step_profiler.stop()
                             return models_and_val_losses, training_losses, lrs
                 except IndexError:
                     pass
@@ -407,6 +428,7 @@ class RT(nn.Module):
                 print('Epoch: {}/{}.............'.format(epoch, configuration["number of epochs"]), end=' ')
                 print("Loss: {:.4f}".format(loss.item()))
 
+        step_profiler.stop()
         return models_and_val_losses, training_losses, lrs
 
     def predict(self, test_loader=None, X=None):
@@ -425,33 +447,29 @@ class RT(nn.Module):
             self.detach([input_sequences, outputs])
             return [i.item() for i in pred], outputs
         elif test_loader:
-            pred = torch.Tensor()
-            y_test = torch.Tensor()
-            outputs_cumm = torch.Tensor()
-            for i, (input_sequences, labels, raw_seq) in enumerate(test_loader):
-                input_sequences = input_sequences.to(self._device)
-                outputs = self(input_sequences.view(len(input_sequences), -1, 1))
-
-                last_outputs = torch.stack([i[-1] for i in outputs]).to(self._device)
-                probs = nn.Softmax(dim=-1)(last_outputs)
-
-                outputs_cumm = torch.cat((outputs_cumm.to(self._device), outputs.float()), 0)   #
-                pred = torch.cat((pred.to(self._device), torch.argmax(probs, dim=-1).float()), 0)  # chose class that has highest probability
-                y_test = torch.cat((y_test, labels.float()), 0)   # chose class that has highest probability
-
-                self.detach([input_sequences, outputs])
-                if configuration["train test split"] <= 1:
-                    share_of_test_set = len(test_loader)*configuration["train test split"]*labels.size()[0]
-                else:
-                    share_of_test_set = configuration["train test split"]
-                if y_test.size()[0] >= share_of_test_set:           #to choose the test set size (memory issues!!)
-                    break
-            return [i.item() for i in pred], outputs_cumm, y_test
+            pred, last_outputs, y_test = self.predict_last_outputs(test_loader)
+            probs = nn.Softmax(dim=-1)(last_outputs)
+
+            return pred.cpu().numpy(), probs.cpu().numpy(), y_test.numpy()
 
         else:
             print('Either provide X or a dataloader!')
 
-    def choose_optimizer(self, alpha=configuration["learning rate"]):
+    def predict_last_outputs(self, test_loader):
+        '''
+        streams through the whole test set and only keeps the output of the last time step (most informed output) of
+        every sample, see HDF5Dataset.stream_last_outputs
+        '''
+        was_training = self.training
+        self.eval()
+        result = stream_last_outputs(test_loader, lambda x, lengths: self(
+            x.to(self._device).view(len(x), x.size(1), -1), lengths=lengths), self._device)
+        self.train(was_training)
+        return result
+
+    def choose_optimizer(self, alpha=None):
+        if alpha is None:
+            alpha = configuration["learning rate"]
         if configuration["optimizer"] == 'Adam':
             optimizer = torch.optim.Adam(self.parameters(), lr=alpha)
         else:
@@ -485,6 +503,7 @@ class RT(nn.Module):
         return X_train, X_test
 
     def fit_scaler(self, X):
+        from sklearn.preprocessing import MaxAbsScaler
         X_zeromean = np.array([x - x.mean() for x in X])                        # deduct it's own mean from every sample
         maxabs_scaler = MaxAbsScaler().fit(X_zeromean)                          # fit scaler as to scale training data between -1 and 1
         return maxabs_scaler
@@ -495,6 +514,7 @@ class RT(nn.Module):
         return X
 
     def score(self, y_test, y_pred):
+        from sklearn.metrics import precision_recall_fscore_support, accuracy_score
         metrics = precision_recall_fscore_support(y_test, y_pred, average='macro')
         accuracy = accuracy_score(y_test, y_pred)
         return [accuracy, metrics]
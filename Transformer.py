@@ -1,24 +1,18 @@
 import torch
 from torch import nn
 import torch.nn.functional as F
-from sklearn.preprocessing import MaxAbsScaler
-from sklearn.metrics import precision_recall_fscore_support
-from sklearn.metrics import accuracy_score
 import random
 import numpy as np
 import copy
-import importlib
 import math
 import gc
 import os
 
-from experiment_config import experiment_path, chosen_experiment
-spec = importlib.util.spec_from_file_location(chosen_experiment, experiment_path)
-config = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(config)
+from experiment_config import config, learning_config
+from profiling import stage, training_profiler
+from HDF5Dataset import last_valid_outputs, stream_last_outputs
 
-
-configuration = config.learning_config
+configuration = learning_config
 
 def choose_best(models_and_losses):
     index_best = [i[1] for i in models_and_losses].index(min([i[1] for i in models_and_losses]))
@@ -72,7 +66,7 @@ class PositionalEncoding(nn.Module):
         position = torch.arange(0, max_len, dtype=torch.float).unsqueeze(1)
         div_term = torch.exp(torch.arange(0, d_model, 2).float() * (-math.log(10000.0) / d_model))
         pe[:, 0::2] = torch.sin(position * div_term)
-        pe[:, 1::2] = torch.cos(position * div_term)
+        pe[:, 1::2] = torch.cos(position * div_term[:d_model // 2])      # odd widths, e.g. 3 input channels
         pe = pe.unsqueeze(0).transpose(0, 1)
         self.register_buffer('pe', pe)
 
@@ -123,19 +117,28 @@ class Transformer(nn.Module):
         nn.init.zeros_(self.decoder.weight)
         nn.init.uniform_(self.decoder.weight, -initrange, initrange)
 
-    def forward(self, src, has_mask=True):
+    def forward(self, src, has_mask=True, lengths=None):
+        key_padding_mask = None
+        if lengths is not None:
+            # padded batch of samples of different lengths [batch, longest, features]: attention runs along the time
+            # axis of every sample, the padded steps are masked as keys
+            src = src.transpose(0, 1)
+            padded = torch.arange(src.size(0), device=src.device)[None, :] >= lengths.to(src.device)[:, None]
+            key_padding_mask = torch.zeros(padded.shape, device=src.device).masked_fill(padded, float('-inf'))
         if has_mask:
             device = src.device
-            if self.src_mask is None or self.src_mask.size(0) != len(src):
-                mask = self._generate_square_subsequent_mask(len(src)).to(device)
+            if torch.jit.is_tracing() or self.src_mask is None or self.src_mask.size(0) != len(src):     # a cached mask would be exported as a constant of fixed size
+                mask = self._generate_square_subsequent_mask(src.size(0)).to(device)
                 self.src_mask = mask
         else:
             self.src_mask = None
 
         #src = self.encoder(src) * math.sqrt(self.ninp)
         src = self.pos_encoder(src)
-        output = self.transformer_encoder(src, self.src_mask)
+        output = self.transformer_encoder(src, self.src_mask, src_key_padding_mask=key_padding_mask)
         output = self.decoder(output)
+        if lengths is not None:
+            output = output.transpose(0, 1)
 
         #gc.collect()
         return F.log_softmax(output, dim=-1)
@@ -163,11 +166,13 @@ class Transformer(nn.Module):
         if prev_epoch is None:
             prev_epoch = 1
 
+        step_profiler = training_profiler(configuration, type(self).__name__)
         for epoch in range(prev_epoch, configuration["number of epochs"] + 1):
 
             if configuration["optimizer"] == 'SGD' and not epoch == prev_epoch:             #ADAM optimizer has internal states and should therefore not be reinitialized every epoch; only for SGD bc here changing the learning rate makes sense
                 self.optimizer, lr = self.control_learning_rate(lr=lr, loss=loss, losses=training_losses, nominal_lr=nominal_lr, epoch=epoch)
             lrs.append(lr)
+            train_stage = stage('train epoch', epoch=epoch).begin()
 
             if X_train and y_train:
                 zipped_X_y = list(zip(X, y))
@@ -207,6 +212,7 @@ class Transformer(nn.Module):
 
                     loss.backward()     # Does backpropagation and calculates gradients
                     self.optimizer.step()    # Updates the weights accordingly
+                    step_profiler.step()
 
                     gc.collect()
                     self.detach([sequences, labels])      #detach tensors from GPU to free memory
@@ -220,13 +226,15 @@ class Transformer(nn.Module):
                 sys.stdout.flush()
                 sys.stdout.write("\b" * (toolbar_width+1)) # return to start of line, after '['
 
-                for i, (sequences, labels, raw_seq) in enumerate(train_loader):
+                for i, batch in enumerate(train_loader):
+                    sequences, labels, raw_seq = batch[:3]
+                    lengths = batch[3] if len(batch) > 3 else None              # padded batches of samples of different lengths
                     labels = labels.to(self._device)
                     sequences = sequences.to(self._device)
                     self.optimizer.zero_grad()  # Clears existing gradients from previous batch so as not to backprop through entire dataset
-                    output = self(sequences.view(len(sequences), -1, 1))
+                    output = self(sequences.view(len(sequences), sequences.size(1), -1), lengths=lengths)
 
-                    last_outputs = torch.stack([i[-1] for i in output])         #choose last output of timeseries (most informed output)
+                    last_outputs = last_valid_outputs(output, lengths)          #choose last (valid) output of timeseries (most informed output)
                     last_outputs = last_outputs.to(self._device)
 
                     labels = torch.stack([i[-1] for i in labels]).long()
@@ -235,6 +243,7 @@ class Transformer(nn.Module):
                     loss.backward()     # Does backpropagation and calculates gradients
                     #torch.nn.utils.clip_grad_norm_(self.parameters(), configuration["gradient clipping"])       # `clip_grad_norm` helps prevent the exploding gradient problem in RNNs / LSTMs.
                     self.optimizer.step()    # Updates the weights accordingly
+                    step_profiler.step()
 
                     self.detach([last_outputs, sequences, labels])      #detach tensors from GPU to free memory
 
@@ -249,16 +258,18 @@ class Transformer(nn.Module):
             else:
                 print('Either provide X and y or dataloaders!')
 
-            if X_train and y_train:
-                training_losses.append(loss)
-                val_outputs = torch.stack([i[-1].view(-1) for i in self.predict(X_test)[1]]).to(self._device)
-                val_loss = criterion(val_outputs, torch.Tensor([np.array(y_test)]).view(-1).long().to(self._device))
-            else:
-                training_losses.append(loss)
-                pred, val_outputs, y_test = self.predict(test_loader=test_loader)
-                val_outputs = torch.stack([i[-1] for i in val_outputs]).to(self._device)
-                y_test = y_test.view(-1).long().to(self._device)
-                val_loss = criterion(val_outputs, y_test).to(self._device)
+            train_stage.end(items=len(X) if X_train and y_train else len(train_loader.dataset))
+
+            with stage('validate', epoch=epoch) as validate_stage:
+                if X_train and y_train:
+                    training_losses.append(loss)
+                    val_outputs = torch.stack([i[-1].view(-1) for i in self.predict(X_test)[1]]).to(self._device)
+                    val_loss = criterion(val_outputs, torch.Tensor([np.array(y_test)]).view(-1).long().to(self._device))
+                else:
+                    training_losses.append(loss)
+                    pred, val_outputs, y_test = self.predict_last_outputs(test_loader)
+                    val_loss = criterion(val_outputs, y_test.to(self._device)).to(self._device)
+                validate_stage.count(len(y_test))
 
             models_and_val_losses.append((copy.deepcopy(self.state_dict), val_loss.item()))
 
@@ -273,6 +284,7 @@ class Transformer(nn.Module):
                         pause += 1
                         if pause == 5:
                             print('Validation loss has not changed for {0} epochs! Early stopping of training after {1} epochs!'.format(pause, epoch))
+                            step_profiler.stop()
                             return models_and_val_losses, training_losses, lrs
                 except IndexError:
                     pass
@@ -281,6 +293,7 @@ class Transformer(nn.Module):
                 print('Epoch: {}/{}.............'.format(epoch, configuration["number of epochs"]), end=' ')
                 print("Loss: {:.4f}".format(loss.item()))
 
+        step_profiler.stop()
         return models_and_val_losses, training_losses, lrs
 
     def predict(self, test_loader=None, X=None):
@@ -299,33 +312,29 @@ class Transformer(nn.Module):
             self.detach([input_sequences, outputs])
             return [i.item() for i in pred], outputs
         elif test_loader:
-            pred = torch.Tensor()
-            y_test = torch.Tensor()
-            outputs_cumm = torch.Tensor()
-            for i, (input_sequences, labels, raw_seq) in enumerate(test_loader):
-                input_sequences = input_sequences.to(self._device)
-                outputs = self(input_sequences.view(len(input_sequences), -1, 1))
-
-                last_outputs = torch.stack([i[-1] for i in outputs]).to(self._device)
-                probs = nn.Softmax(dim=-1)(last_outputs)
-
-                outputs_cumm = torch.cat((outputs_cumm.to(self._device), outputs.float()), 0)   #
-                pred = torch.cat((pred.to(self._device), torch.argmax(probs, dim=-1).float()), 0)  # chose class that has highest probability
-                y_test = torch.cat((y_test, labels.float()), 0)   # chose class that has highest probability
-
-                self.detach([input_sequences, outputs])
-                if configuration["train test split"] <= 1:
-                    share_of_test_set = len(test_loader)*configuration["train test split"]*labels.size()[0]
-                else:
-                    share_of_test_set = configuration["train test split"]
-                if y_test.size()[0] >= share_of_test_set:           #to choose the test set size (memory issues!!)
-                    break
-            return [i.item() for i in pred], outputs_cumm, y_test
+            pred, last_outputs, y_test = self.predict_last_outputs(test_loader)
+            probs = nn.Softmax(dim=-1)(last_outputs)
+
+            return pred.cpu().numpy(), probs.cpu().numpy(), y_test.numpy()
 
         else:
             print('Either provide X or a dataloader!')
 
-    def choose_optimizer(self, alpha=configuration["learning rate"]):
+    def predict_last_outputs(self, test_loader):
+        '''
+        streams through the whole test set and only keeps the output of the last time step (most informed output) of
+        every sample, see HDF5Dataset.stream_last_outputs
+        '''
+        was_training = self.training
+        self.eval()
+        result = stream_last_outputs(test_loader, lambda x, lengths: self(
+            x.to(self._device).view(len(x), x.size(1), -1), lengths=lengths), self._device)
+        self.train(was_training)
+        return result
+
+    def choose_optimizer(self, alpha=None):
+        if alpha is None:
+            alpha = configuration["learning rate"]
         if configuration["optimizer"] == 'Adam':
             optimizer = torch.optim.Adam(self.parameters(), lr=alpha)
         else:
@@ -359,6 +368,7 @@ class Transformer(nn.Module):
         return X_train, X_test
 
     def fit_scaler(self, X):
+        from sklearn.preprocessing import MaxAbsScaler
         X_zeromean = np.array([x - x.mean() for x in X])                        # deduct it's own mean from every sample
         maxabs_scaler = MaxAbsScaler().fit(X_zeromean)                          # fit scaler as to scale training data between -1 and 1
         return maxabs_scaler
@@ -369,6 +379,7 @@ class Transformer(nn.Module):
         return X
 
     def score(self, y_test, y_pred):
+        from sklearn.metrics import precision_recall_fscore_support, accuracy_score
         metrics = precision_recall_fscore_support(y_test, y_pred, average='macro')
         accuracy = accuracy_score(y_test, y_pred)
         return [accuracy, metrics]
@@ -0,0 +1,102 @@
+'''
+Smart meter measurement noise as a transform of the batches coming out of a data loader instead of noise baked into the
+dataset: one clean dataset (add_noise = False) can then be trained on with any accuracy class. The noise is a normal
+distribution truncated at the biggest error of the meter (accuracy times the ratio of the top of the measuring range
+to the rated voltage, as in create_instances.add_noise) with a standard deviation of a third of it. Noise is drawn
+from a seeded generator, either afresh every epoch or the same in every epoch (e.g. for the test set).
+
+    loader = NoisyLoader(load_data('train'), SmartMeterNoise(noise_bound(), seed=0), max_abs)
+'''
+import math
+import torch
+
+from experiment_config import config
+
+
+def noise_bound():
+    '''
+    biggest error of a smart meter of the configured accuracy class
+    '''
+    return (config.smartmeter_voltage_range[1] / config.smartmeter_ratedvoltage_range[0]) * config.accuracy
+
+
+def truncated_normal(shape, std, bound, generator=None):
+    '''
+    normal distribution with the given standard deviation truncated at +-bound, drawn in one go by inverting the
+    cumulative distribution function on the uniform samples between the bounds
+    '''
+    low = 0.5 * (1 + math.erf(-bound / (std * math.sqrt(2))))
+    uniform = low + (1 - 2 * low) * torch.rand(shape, generator=generator, dtype=torch.float64)
+    samples = math.sqrt(2) * std * torch.erfinv(2 * uniform - 1)
+    return samples.clamp_(-bound, bound).float()
+
+
+class SmartMeterNoise:
+
+    def __init__(self, bound, std=None, seed=0, fresh=True):
+        self.bound = bound
+        self.std = std if std is not None else bound / 3        # the bound is 3 standard deviations away from the mean
+        self.seed = seed
+        self.fresh = fresh
+        self.generator = torch.Generator()
+
+    def start_epoch(self, epoch):
+        # the same noise in every epoch unless fresh noise is drawn per epoch
+        self.generator.manual_seed(self.seed * 1000003 + epoch if self.fresh else self.seed)
+
+    def __call__(self, shape):
+        return truncated_normal(shape, self.std, self.bound, self.generator)
+
+
+class NoisyLoader:
+    '''
+    data loader adding smart meter noise to every batch: the noise is added to the raw samples and the preprocessed
+    samples are updated accordingly (the noise is zero meaned per sample and scaled with the max abs values), so the
+    loader yields the same (samples, labels, raw samples[, lengths]) batches as the loader it wraps
+    '''
+
+    def __init__(self, loader, noise, max_abs):
+        self.loader = loader
+        self.dataset = loader.dataset
+        self.noise = noise
+        scale = torch.as_tensor(max_abs, dtype=torch.float32).view(-1)
+        scale[scale == 0] = 1
+        self.scale = scale
+        self.epoch = 0
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        self.noise.start_epoch(self.epoch)
+        self.epoch += 1
+        for batch in self.loader:
+            yield self.add_noise(*batch)
+
+    def add_noise(self, data, labels, data_raw, lengths=None):
+        steps = data_raw.size(1)
+        features = (1,) * (data_raw.dim() - 2)                 # samples with more than one feature per step
+        noise = self.noise(data_raw.shape)
+        if lengths is None:
+            shift = noise - noise.mean(dim=1, keepdim=True)
+        else:                                                   # padding stays zero
+            valid = (torch.arange(steps).view(1, -1) < lengths.view(-1, 1)).view((-1, steps) + features)
+            noise = noise * valid
+            shift = (noise - noise.sum(dim=1, keepdim=True) / lengths.view((-1, 1) + features)) * valid
+        scale = self.scale[:steps].view((1, steps) + features)
+        batch = (data + (shift / scale).to(data.dtype), labels, data_raw + noise.to(data_raw.dtype))
+        return batch if lengths is None else batch + (lengths,)
+
+
+def noisy_loader(loader, type, file, learning_config):
+    '''
+    wraps the loader of the dataset file if noise augmentation is switched on in the learning config; fresh noise every
+    epoch applies to the training set only, the test set is noised the same way in every epoch
+    '''
+    if not learning_config.get("noise_augmentation", False):
+        return loader
+    from util import load_max_abs
+    max_abs = load_max_abs(type, file)
+    fresh = type == 'train' and learning_config.get("fresh noise every epoch", True)
+    seed = learning_config.get("noise seed", 0) + (type != 'train')
+    return NoisyLoader(loader, SmartMeterNoise(noise_bound(), seed=seed, fresh=fresh), max_abs)
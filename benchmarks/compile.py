@@ -0,0 +1,87 @@
+'''
+speedup of the compilation modes of util.compile_model per classifier: every classifier is built with the model settings
+of the chosen experiment, compiled with 'torch.compile' and 'TorchScript' and compared to the eager model on random
+input of the experiment's sample length (training step and inference throughput; compile time includes the first call)
+
+usage (from the project folder):
+    python benchmarks/compile.py [--classifiers RNN LSTM] [--batch-size 60] [--steps 20] [--modes torch.compile TorchScript]
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CLASSIFIERS = ['RNN', 'LSTM', 'GRU', 'Transformer', 'RTransformer']
+
+
+def measure(model, x, labels, steps):
+    import torch
+    from torch import nn
+
+    criterion = nn.CrossEntropyLoss()
+
+    def train_step():
+        model.optimizer.zero_grad()
+        output = model(x)
+        if isinstance(output, tuple):
+            output = output[0]
+        criterion(output[:, -1], labels).backward()
+        model.optimizer.step()
+
+    model.train()
+    train_step()
+    start = time.perf_counter()
+    for _ in range(steps):
+        train_step()
+    train = steps * len(x) / (time.perf_counter() - start)
+
+    model.eval()
+    with torch.no_grad():
+        model(x)
+        start = time.perf_counter()
+        for _ in range(steps):
+            model(x)
+    inference = steps * len(x) / (time.perf_counter() - start)
+    return train, inference
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compilation benchmark')
+    parser.add_argument('--classifiers', nargs='+', default=CLASSIFIERS, choices=CLASSIFIERS)
+    parser.add_argument('--modes', nargs='+', default=['torch.compile', 'TorchScript'])
+    parser.add_argument('--batch-size', type=int, default=60)
+    parser.add_argument('--steps', type=int, default=20)
+    args = parser.parse_args()
+
+    import torch
+    import util
+    from experiment_config import config, learning_config
+
+    x = torch.randn(args.batch_size, config.sample_length, 1)
+    labels = torch.randint(0, 2, (args.batch_size,))
+    print('%-13s %-14s %12s %16s %20s' % ('classifier', 'mode', 'compile s', 'train samples/s', 'inference samples/s'))
+    for classifier in args.classifiers:
+        settings = dict(learning_config)
+        settings['classifier'] = classifier
+        baseline = None
+        for mode in ['None'] + args.modes:
+            settings['compile'] = mode
+            torch.manual_seed(0)
+            model = util.build_model(settings, torch.device('cpu'))
+            start = time.perf_counter()
+            model = util.compile_model(model, settings, example=x)
+            if mode == 'TorchScript':
+                model.eval()
+                with torch.no_grad():
+                    model(x)                    # traces are made on the first inference call
+            compile_time = time.perf_counter() - start
+            train, inference = measure(model, x, labels, args.steps)
+            if baseline is None:
+                baseline = train, inference
+                print('%-13s %-14s %12s %16.1f %20.1f' % (classifier, 'eager', '-', train, inference))
+            else:
+                print('%-13s %-14s %12.2f %10.1f (%.2fx) %13.1f (%.2fx)' % (classifier, mode, compile_time, train,
+                                                                            train / baseline[0], inference,
+                                                                            inference / baseline[1]))
@@ -0,0 +1,59 @@
+'''
+measures the cold start of the project modules: every module is imported in a fresh interpreter (so nothing is cached)
+and the median wall time over several runs is reported, along with whether the experiment config had to be executed
+and which heavy packages got pulled in
+
+usage (from the project folder):
+    python benchmarks/import_time.py [--repeat 5] [--modules main util RNN] [--repo path/to/other/checkout]
+
+pass --repo to time another checkout (e.g. an older commit added with git worktree) in the same way for comparison
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY_PACKAGES = ['sklearn', 'matplotlib', 'pandas', 'onnxruntime', 'RNN', 'LSTM', 'GRU', 'Transformer', 'RTransformer']
+
+PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+import {module}
+duration = time.perf_counter() - start
+config_module = sys.modules.get('experiment_config')
+loaded = getattr(config_module, '_config', 'n/a') is not None
+print(json.dumps({{'seconds': duration, 'config executed': loaded,
+                  'heavy imports': [p for p in {heavy} if p in sys.modules]}}))
+'''
+
+
+def time_import(module, repo, repeat):
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_PACKAGES)], cwd=repo,
+                             capture_output=True, text=True)
+        if out.returncode != 0:
+            print('Importing %s failed:\n%s' % (module, out.stderr.strip().splitlines()[-1]))
+            return None
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {'median seconds': statistics.median([r['seconds'] for r in runs]),
+            'config executed': runs[-1]['config executed'],
+            'heavy imports': runs[-1]['heavy imports']}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import time benchmark')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--modules', nargs='+', default=['main', 'util', 'RNN', 'Transformer', 'RTransformer'])
+    parser.add_argument('--repo', default=os.getcwd())
+    args = parser.parse_args()
+
+    print('Timing imports in %s (%d fresh interpreters per module)' % (args.repo, args.repeat))
+    for module in args.modules:
+        result = time_import(module, args.repo, args.repeat)
+        if result:
+            print('%-14s %6.3f s   config executed: %-5s   heavy imports: %s' % (module, result['median seconds'],
+                                                                          result['config executed'],
+                                                                          ', '.join(result['heavy imports']) or '-'))
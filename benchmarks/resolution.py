@@ -0,0 +1,98 @@
+'''
+accuracy and throughput of the classifiers at every resolution of the pyramid (see resolution.py): a synthetic dataset
+(as in throughput.py) is written to a temporary folder, then every classifier is built with the model settings of the
+chosen experiment (input size set to the channels of the resolution) and trained for a few epochs on the samples at
+each resolution
+
+measured per classifier and resolution:
+    training (forward + backward + optimizer step) and forward only throughput (samples/s)
+    accuracy on the test set after training
+
+usage (from the project folder):
+    python benchmarks/resolution.py [--factors 1 2 4] [--length 672] [--samples 1000] [--epochs 5] [--classifiers RNN LSTM]
+'''
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CLASSIFIERS = ['RNN', 'LSTM', 'GRU', 'Transformer', 'RTransformer']
+
+
+def measure(classifier, factor, files, epochs):
+    import torch
+    from torch import nn
+    import util
+    from experiment_config import learning_config
+
+    torch.manual_seed(0)
+    learning_config['classifier'] = classifier
+    learning_config['resolution'] = factor                 # loaders and input size follow the resolution
+    model = util.build_model(learning_config, torch.device('cpu'))
+    train_loader = util.load_data('train', files['train'])
+    test_loader = util.load_data('test', files['test'])
+    criterion = nn.CrossEntropyLoss()
+
+    def inputs(sequences):
+        return sequences.view(len(sequences), sequences.size(1), -1)          # [batch, steps, channels]
+
+    model.train()
+    samples, duration = 0, 0
+    for epoch in range(epochs):
+        for sequences, labels, raw_seq in train_loader:
+            start = time.perf_counter()
+            model.optimizer.zero_grad()
+            output = model(inputs(sequences))
+            if isinstance(output, tuple):
+                output = output[0]
+            loss = criterion(output[:, -1].float(), labels.view(len(labels), -1)[:, -1].long())
+            loss.backward()
+            torch.nn.utils.clip_grad_norm_(model.parameters(), learning_config["gradient clipping"])
+            model.optimizer.step()
+            duration += time.perf_counter() - start
+            samples += len(sequences)
+
+    model.eval()
+    forward_samples, forward_duration = 0, 0
+    with torch.no_grad():
+        for sequences, labels, raw_seq in test_loader:
+            start = time.perf_counter()
+            model(inputs(sequences))
+            forward_duration += time.perf_counter() - start
+            forward_samples += len(sequences)
+    pred, outputs, y_test = model.predict_last_outputs(test_loader)
+    accuracy = (pred.cpu() == y_test).float().mean().item()
+    return samples / duration, forward_samples / forward_duration, accuracy
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Accuracy and throughput per resolution')
+    parser.add_argument('--factors', type=int, nargs='+', default=[1, 2, 4], help='time steps per step fed to the models')
+    parser.add_argument('--length', type=int, default=672, help='sample length at full resolution')
+    parser.add_argument('--samples', type=int, default=1000, help='number of training samples')
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--classifiers', nargs='+', default=CLASSIFIERS, choices=CLASSIFIERS)
+    args = parser.parse_args()
+
+    from throughput import write_dataset
+    from experiment_config import config
+
+    folder = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        files = write_dataset(folder, args.length, args.samples)
+        print('%-13s %10s %6s %16s %18s %9s' % ('classifier', 'resolution', 'steps', 'train samples/s',
+                                                 'forward samples/s', 'accuracy'))
+        for classifier in args.classifiers:
+            baseline = None
+            for factor in args.factors:
+                train, forward, accuracy = measure(classifier, factor, files, args.epochs)
+                baseline = baseline or (train, forward)
+                print('%-13s %7d min %6d %9.1f (%.2fx) %11.1f (%.2fx) %9.3f' % (
+                    classifier, config.step_size * factor, args.length // factor, train, train / baseline[0], forward,
+                    forward / baseline[1], accuracy))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
@@ -0,0 +1,240 @@
+'''
+training and inference throughput of the classifiers on synthetic data: for every sample length a synthetic dataset
+(in the format read by HDF5Dataset) is written to a temporary folder, then every classifier is built with the model
+settings of the chosen experiment (see experiment_config.py) and measured in a fresh process, so that the peak memory
+of one run does not carry over to the next one
+
+measured per classifier and sample length:
+    data loading rate of the training loader (samples/s)
+    training (forward + backward + optimizer step) and forward only throughput (samples/s)
+    validation time over the test loader (s)
+    ONNX inference latency of the exported model with onnxruntime (ms per sample, batch of 1)
+    peak resident memory of the process (MB)
+
+usage (from the project folder):
+    python benchmarks/throughput.py [--lengths 96 672 2688] [--samples 1000] [--classifiers RNN LSTM] [--output benchmark.json]
+    python benchmarks/throughput.py --compare benchmark_old.json benchmark_new.json
+'''
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from profiling import peak_rss_mb
+
+CLASSIFIERS = ['RNN', 'LSTM', 'GRU', 'Transformer', 'RTransformer']
+METRICS = [('load samples/s', True), ('train samples/s', True), ('forward samples/s', True), ('validation s', False),
+           ('onnx latency ms', False), ('peak RSS MB', False)]
+
+
+def write_dataset(folder, sample_length, samples, seed=0):
+    '''
+    two classes of noisy voltage curves around 1 p.u., the positive class carries a small periodic deviation
+    '''
+    import numpy as np
+    from util import DatasetWriter
+
+    rng = np.random.default_rng(seed)
+    files = {}
+    max_abs = None
+    for type, n in [('train', samples), ('test', max(samples // 5, 1))]:
+        y = rng.integers(0, 2, (n, 1))
+        t = np.linspace(0, 2 * np.pi * sample_length / 96, sample_length)
+        x_raw = (1 + 0.01 * rng.standard_normal((n, sample_length)) + 0.02 * y * np.sin(t)).astype(np.float32)
+        files[type] = os.path.join(folder, '%s_%d.hdf5' % (type, sample_length))
+        writer = DatasetWriter(files[type], type, max_abs=max_abs)       # the test set is scaled like the training set
+        writer.append(x_raw, y)
+        max_abs = writer.close()
+    return files
+
+
+def measure(classifier, sample_length, folder, batches, onnx_runs):
+    import numpy as np
+    import torch
+    from torch import nn
+    import util
+    from experiment_config import learning_config
+
+    torch.manual_seed(0)
+    settings = dict(learning_config)
+    settings['classifier'] = classifier
+    device = util.choose_device()
+    model = util.build_model(settings, device)
+    train_loader = util.load_data('train', os.path.join(folder, 'train_%d.hdf5' % sample_length))
+    test_loader = util.load_data('test', os.path.join(folder, 'test_%d.hdf5' % sample_length))
+    result = {}
+
+    def synchronize():
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+
+    start = time.perf_counter()
+    samples, in_memory = 0, []
+    for sequences, labels, raw_seq in train_loader:
+        samples += len(sequences)
+        if len(in_memory) < batches + 1:
+            in_memory.append((sequences.view(len(sequences), sequences.size(1), -1).to(device),    # [batch, steps, channels]
+                              labels.view(len(labels), -1)[:, -1].long().to(device)))
+    result['load samples/s'] = samples / (time.perf_counter() - start)
+
+    criterion = nn.CrossEntropyLoss()
+    warm_up, timed = in_memory[0], in_memory[1:] or in_memory
+    timed_samples = sum(len(labels) for sequences, labels in timed)
+
+    def train_step(sequences, labels):                 # same steps as in fit
+        model.optimizer.zero_grad()
+        output = model(sequences)
+        if isinstance(output, tuple):
+            output = output[0]
+        loss = criterion(output[:, -1], labels)
+        loss.backward()
+        torch.nn.utils.clip_grad_norm_(model.parameters(), settings["gradient clipping"])
+        model.optimizer.step()
+
+    model.train()
+    train_step(*warm_up)
+    synchronize()
+    start = time.perf_counter()
+    for sequences, labels in timed:
+        train_step(sequences, labels)
+    synchronize()
+    result['train samples/s'] = timed_samples / (time.perf_counter() - start)
+
+    model.eval()
+    with torch.no_grad():
+        model(warm_up[0])
+        synchronize()
+        start = time.perf_counter()
+        for sequences, labels in timed:
+            model(sequences)
+        synchronize()
+    result['forward samples/s'] = timed_samples / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    model.predict_last_outputs(test_loader)
+    result['validation s'] = time.perf_counter() - start
+
+    result['onnx latency ms'] = onnx_latency(model, sample_length, folder, onnx_runs, tuple(warm_up[0].shape[1:]))
+    result['peak RSS MB'] = peak_rss_mb()
+    return result
+
+
+def onnx_latency(model, sample_length, folder, runs, input_shape):
+    import inspect
+    import numpy as np
+    import torch
+
+    try:
+        import onnxruntime
+    except ImportError:
+        return None
+
+    if hasattr(model, 'pin_device'):
+        model.pin_device(torch.device("cpu"))
+    model.to(torch.device("cpu"))
+    model.eval()
+    name = os.path.join(folder, 'model_%d.onnx' % sample_length)
+    export_settings = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        export_settings['dynamo'] = False
+    try:
+        with torch.no_grad():
+            torch.onnx.export(model, torch.randn((1,) + input_shape), name, input_names=['input'], **export_settings)
+        session = onnxruntime.InferenceSession(name, providers=['CPUExecutionProvider'])
+    except Exception as e:
+        print('ONNX export failed: %s' % e, file=sys.stderr)
+        return None
+
+    x = np.random.randn(1, *input_shape).astype(np.float32)      # [1, steps, channels] as fed to the model
+    session.run(None, {'input': x})
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        session.run(None, {'input': x})
+        durations.append(time.perf_counter() - start)
+    return float(np.median(durations)) * 1000
+
+
+def run(args):
+    import torch
+
+    report = {'torch': torch.__version__, 'platform': platform.platform(), 'python': platform.python_version(),
+              'samples': args.samples, 'timed batches': args.batches, 'results': {}}
+    try:
+        report['commit'] = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                          check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        report['commit'] = None
+
+    folder = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        for sample_length in args.lengths:
+            write_dataset(folder, sample_length, args.samples)
+            for classifier in args.classifiers:
+                print('%s, sample length %d ..' % (classifier, sample_length))
+                out = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', classifier, str(sample_length),
+                                      folder, str(args.batches), str(args.onnx_runs)], capture_output=True, text=True)
+                if out.returncode != 0:
+                    print('Benchmark of %s failed:\n%s' % (classifier, out.stderr.strip()[-2000:]))
+                    continue
+                result = json.loads(out.stdout.strip().splitlines()[-1])
+                report['results'].setdefault(classifier, {})[str(sample_length)] = result
+                print('    ' + ', '.join('%s: %s' % (metric, format_value(result.get(metric))) for metric, _ in METRICS))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print('Report written to %s' % args.output)
+
+
+def format_value(value):
+    return '-' if value is None else '%.3g' % value
+
+
+def compare(old_file, new_file):
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+    print('%s (%s) -> %s (%s), ratios > 1 are improvements' % (old_file, old.get('commit'), new_file, new.get('commit')))
+    for classifier, lengths in new['results'].items():
+        for sample_length, result in lengths.items():
+            before = old['results'].get(classifier, {}).get(sample_length)
+            if before is None:
+                continue
+            ratios = []
+            for metric, higher_is_better in METRICS:
+                if before.get(metric) and result.get(metric):
+                    ratio = result[metric] / before[metric] if higher_is_better else before[metric] / result[metric]
+                    ratios.append('%s: %.2fx' % (metric, ratio))
+            print('%-13s %5s  %s' % (classifier, sample_length, ', '.join(ratios)))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        classifier, sample_length, folder, batches, onnx_runs = sys.argv[2:7]
+        result = measure(classifier, int(sample_length), folder, int(batches), int(onnx_runs))
+        print(json.dumps(result))
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description='Training and inference throughput benchmark')
+    parser.add_argument('--lengths', type=int, nargs='+', default=[96, 672, 2688])
+    parser.add_argument('--samples', type=int, default=1000, help='number of training samples per dataset')
+    parser.add_argument('--classifiers', nargs='+', default=CLASSIFIERS, choices=CLASSIFIERS)
+    parser.add_argument('--batches', type=int, default=10, help='number of mini batches timed for training')
+    parser.add_argument('--onnx-runs', type=int, default=50)
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(args)
@@ -0,0 +1,68 @@
+'''
+Compact storage of the raw voltage samples: instead of float32, every sample is stored as int16 steps of a fixed scale
+(by default 1e-5 p.u., far below the accuracy of the smart meters) away from a base value of the sample (the middle of
+its range, kept as float32 per sample), which halves the size of x_raw on disk and in the page cache. The rounding error
+is at most half the scale; values further than 32767 steps from the base are clipped (reported when encoding).
+
+With the delta mode, the difference of every step to the one before is stored instead of the offset from the base, so
+slowly changing series compress better with gzip; the steps are summed up again when decoding. Both modes decode to the
+same values.
+
+    q, base = encode(x_raw, scale=1e-5)                 # int16 [samples, steps(, features)], float32 [samples(, features)]
+    x_raw = decode(q, base, scale=1e-5)
+'''
+import numpy as np
+
+MODES = ('offset', 'delta')
+LIMIT = np.iinfo(np.int16).max
+
+
+def encode(x, scale=1e-5, mode='offset'):
+    '''
+    int16 steps of the samples [samples, steps(, features)] away from their base values [samples(, features)]
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    base = ((x.min(axis=1) + x.max(axis=1)) / 2).astype(np.float32)
+    q = np.rint((x - np.expand_dims(base, 1)) / scale)
+    clipped = np.count_nonzero(np.abs(q) > LIMIT)
+    if clipped:
+        print('%d values more than %g away from the base of their sample clipped' % (clipped, LIMIT * scale))
+    q = np.clip(q, -LIMIT, LIMIT).astype(np.int16)
+    if mode == 'delta':
+        q = np.diff(q, axis=1, prepend=np.zeros_like(q[:, :1]))       # wraps around in int16, undone by the sum
+    return q, base
+
+
+def decode(q, base, scale=1e-5, mode='offset', axis=1):
+    '''
+    float32 samples from the int16 steps and the base values written by encode; axis is the one of the time steps (0
+    for a single sample)
+    '''
+    q = np.asarray(q)
+    if mode == 'delta':
+        q = np.cumsum(q, axis=axis, dtype=np.int16)
+    return (np.expand_dims(np.asarray(base, dtype=np.float64), axis) + q * scale).astype(np.float32)
+
+
+def error_bound(scale=1e-5, magnitude=1.0):
+    '''
+    biggest difference between a value (of about the given magnitude) and its decoded value, unless it was clipped:
+    half the scale plus the rounding to float32
+    '''
+    return scale / 2 + 2 * float(np.spacing(np.float32(magnitude)))
+
+
+def encoded(dataset):
+    return dataset.attrs.get('codec') in MODES
+
+
+def read_raw(hdf, name, index=slice(None)):
+    '''
+    samples of an x_raw dataset of an open HDF5 file, decoded if they are stored encoded (codec, scale and the name of
+    the dataset holding the base values are attributes of the dataset)
+    '''
+    dataset = hdf[name]
+    if not encoded(dataset):
+        return dataset[index]
+    return decode(dataset[index], hdf[dataset.attrs['base']][index], dataset.attrs['scale'], dataset.attrs['codec'],
+                  axis=0 if isinstance(index, (int, np.integer)) else 1)
@@ -1,8 +1,5 @@
-import importlib
-from experiment_config import experiment_path, chosen_experiment
-spec = importlib.util.spec_from_file_location(chosen_experiment, experiment_path)
-config = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(config)
+from experiment_config import config
+import os
 import pandas as pd
 import numpy as np
 import random
@@ -10,20 +7,14 @@ import random
 def add_noise(df):
 
     if config.add_noise:
-        biggest_error_value = (config.smartmeter_voltage_range[1] / config.smartmeter_ratedvoltage_range[
-            0]) * config.accuracy
-        times_std = 3  # means biggest error value (i.e maximum value of smartmeter scale) is bigger than 98.8% of distribution
-        mean = 0
-        num_samples = len(df)
-        calibrated = False
-
-        while calibrated == False:
-            std = biggest_error_value / times_std   # biggest error should be 1% of expected value (or of maximum of scale of measuring device)
-            samples = np.random.normal(mean, std, size=num_samples)
-            if samples.max() > biggest_error_value:
-                times_std = times_std + 0.1
-            else:
-                calibrated = True
+        import torch
+        from augmentation import noise_bound, truncated_normal
+        biggest_error_value = noise_bound()
+        std = biggest_error_value / 3   # biggest error should be 1% of expected value (or of maximum of scale of measuring device)
+        # drawn in one go from the normal distribution truncated at the biggest error instead of redrawing until no
+        # sample exceeds it; seeded from numpy so that np.random.seed still makes datasets reproducible
+        generator = torch.Generator().manual_seed(int(np.random.randint(2 ** 31)))
+        samples = truncated_normal(len(df), std, biggest_error_value, generator).numpy()
 
         if config.just_voltages:
             df_noised = df[('ElmTerm', 'm:u')] + samples
@@ -38,10 +29,13 @@ def add_noise(df):
             df_noised = df
         return df_noised
 
-def add_samples(train_samples, test_samples, num_features, sample_dict, samples_per_term, samples_before, label, dummy=False):
+def add_samples(train_samples, test_samples, num_features, sample_dict, samples_per_term, samples_before, label, dummy=False,
+                near_duplicates=None):
 
     for key in random.sample(list(sample_dict), samples_per_term):
         sample = sample_dict[key]
+        if near_duplicates is not None and not near_duplicates.add(sample[('ElmTerm', 'm:u')].values[None], [label])[0]:
+            continue                    # near duplicate of a sample already in the dataset (compared before noise is added)
         sample_number = int(len(train_samples.columns) + len(test_samples.columns) / num_features)
 
         noised_data = add_noise(sample)
@@ -85,22 +79,12 @@ def add_samples(train_samples, test_samples, num_features, sample_dict, samples_
 
     return train_samples, test_samples
 
-def extract_malfunction_data(df, combinations_already_in_dataset, number_of_samples_before):
+def malfunction_samples_per_terminal(terminals_with_devices, terminals_with_malfunctions, number_of_samples_before):
     '''
-
-    :param df:
-    :param combinations_already_in_dataset:
-    :return:
-
-    extracts data of interest (no duplicates) and labels it with 1 for malfunction present, and 0 with no malfunction present
-    also adds noise to data
+    number of samples taken from every terminal of a raw result file and their label (1 for the terminals with
+    malfunctions), in the order of the terminals; the share of positive samples is kept by spreading the samples lost
+    to flooring over the terminals
     '''
-
-    metainfo = df[('metainfo', 'in the first', 'few indices')]
-    terminals_with_malfunctions = [i for i in metainfo.iloc[5].split("'") if 'Bus' in i]
-    terminals_with_devices = [i for i in metainfo.iloc[6].split("'") if 'Bus' in i]
-
-    sample_length = config.sample_length
     samples_to_go = config.number_of_samples - number_of_samples_before
     share_from_df = 1 / (config.simruns * config.number_of_grids)                                          # share of samples taken from current df
     if samples_to_go < int(config.number_of_samples * share_from_df):
@@ -116,22 +100,8 @@ def extract_malfunction_data(df, combinations_already_in_dataset, number_of_samp
     difference_by_flooring = int(pos_samples_per_term) * len(terminals_with_malfunctions) - int(neg_samples_per_term) * (
             len(terminals_with_devices) - len(terminals_with_malfunctions))
 
-    train_samples = pd.DataFrame(index=df.index[:sample_length].append(pd.Index(['label'])))
-    test_samples = pd.DataFrame(index=df.index[:sample_length].append(pd.Index(['label'])))
-    features_per_sample = len(df[terminals_with_devices[0]].columns)
-
-    if len(combinations_already_in_dataset) > 0:
-        for combination in combinations_already_in_dataset:
-            if set(terminals_with_devices) == set(combination[0]) \
-                    and (terminals_with_malfunctions) == combination[1]:
-                return train_samples, test_samples, combinations_already_in_dataset
-    else:
-        combinations_already_in_dataset.append((terminals_with_devices, terminals_with_malfunctions))
-
+    samples_per_terminal = []
     for term in terminals_with_devices:
-        sample_dict = {name: group for name, group in df[term].groupby(np.arange(len(df[term])) // sample_length) if
-                       len(group) == sample_length}
-
         if term in terminals_with_malfunctions:
 
             if difference_by_flooring < 0:
@@ -139,9 +109,7 @@ def extract_malfunction_data(df, combinations_already_in_dataset, number_of_samp
                 pos_samples = int(pos_samples_per_term) + 1
             else:
                 pos_samples = int(pos_samples_per_term)
-
-            train_samples, test_samples = add_samples(train_samples, test_samples, features_per_sample, sample_dict, pos_samples,
-                                                      number_of_samples_before, 1)
+            samples_per_terminal.append((term, pos_samples, 1))
 
         else:
 
@@ -150,13 +118,50 @@ def extract_malfunction_data(df, combinations_already_in_dataset, number_of_samp
                 neg_samples = int(neg_samples_per_term) + 1
             else:
                 neg_samples = int(neg_samples_per_term)
+            samples_per_terminal.append((term, neg_samples, 0))
+
+    return samples_per_terminal
+
+def extract_malfunction_data(df, combinations_already_in_dataset, number_of_samples_before, near_duplicates=None):
+    '''
+
+    :param df:
+    :param combinations_already_in_dataset:
+    :return:
+
+    extracts data of interest (no duplicates) and labels it with 1 for malfunction present, and 0 with no malfunction present
+    also adds noise to data
+    '''
+
+    metainfo = df[('metainfo', 'in the first', 'few indices')]
+    terminals_with_malfunctions = [i for i in metainfo.iloc[5].split("'") if 'Bus' in i]
+    terminals_with_devices = [i for i in metainfo.iloc[6].split("'") if 'Bus' in i]
+
+    sample_length = config.sample_length
+
+    train_samples = pd.DataFrame(index=df.index[:sample_length].append(pd.Index(['label'])))
+    test_samples = pd.DataFrame(index=df.index[:sample_length].append(pd.Index(['label'])))
+    features_per_sample = len(df[terminals_with_devices[0]].columns)
+
+    if len(combinations_already_in_dataset) > 0:
+        for combination in combinations_already_in_dataset:
+            if set(terminals_with_devices) == set(combination[0]) \
+                    and (terminals_with_malfunctions) == combination[1]:
+                return train_samples, test_samples, combinations_already_in_dataset
+    else:
+        combinations_already_in_dataset.append((terminals_with_devices, terminals_with_malfunctions))
 
-            train_samples, test_samples = add_samples(train_samples, test_samples, features_per_sample, sample_dict, neg_samples,
-                                                      number_of_samples_before, 0)
+    for term, number_of_samples, label in malfunction_samples_per_terminal(terminals_with_devices, terminals_with_malfunctions,
+                                                                           number_of_samples_before):
+        sample_dict = {name: group for name, group in df[term].groupby(np.arange(len(df[term])) // sample_length) if
+                       len(group) == sample_length}
+
+        train_samples, test_samples = add_samples(train_samples, test_samples, features_per_sample, sample_dict, number_of_samples,
+                                                  number_of_samples_before, label, near_duplicates=near_duplicates)
 
     return train_samples, test_samples, combinations_already_in_dataset
 
-def extract_PV_noPV_data(df, combinations_already_in_dataset, number_of_samples_before):
+def extract_PV_noPV_data(df, combinations_already_in_dataset, number_of_samples_before, near_duplicates=None):
     '''
 
     :param df:
@@ -209,7 +214,7 @@ def extract_PV_noPV_data(df, combinations_already_in_dataset, number_of_samples_
                 pos_samples = int(pos_samples_per_term)
 
             df_reduced = add_samples(df_reduced, features_per_sample, sample_dict, pos_samples,
-                                     number_of_samples_before, 1)
+                                     number_of_samples_before, 1, near_duplicates=near_duplicates)
 
         else:
 
@@ -220,12 +225,12 @@ def extract_PV_noPV_data(df, combinations_already_in_dataset, number_of_samples_
                 neg_samples = int(neg_samples_per_term)
 
             df_reduced = add_samples(df_reduced, features_per_sample, sample_dict, neg_samples,
-                                     number_of_samples_before, 0)
+                                     number_of_samples_before, 0, near_duplicates=near_duplicates)
 
     return df_reduced, combinations_already_in_dataset
 
 
-def extract_dummy_data(df, combinations_already_in_dataset, number_of_samples_before):
+def extract_dummy_data(df, combinations_already_in_dataset, number_of_samples_before, near_duplicates=None):
     '''
 
     :param df:
@@ -276,7 +281,7 @@ def extract_dummy_data(df, combinations_already_in_dataset, number_of_samples_be
                 pos_samples = int(pos_samples_per_term)
 
             df_reduced = add_samples(df_reduced, features_per_sample, sample_dict, pos_samples,
-                                     number_of_samples_before, 1)
+                                     number_of_samples_before, 1, near_duplicates=near_duplicates)
 
         else:
 
@@ -286,20 +291,61 @@ def extract_dummy_data(df, combinations_already_in_dataset, number_of_samples_be
             else:
                 neg_samples = int(neg_samples_per_term)
 
-            df_reduced = add_samples(df_reduced, features_per_sample, sample_dict, neg_samples, number_of_samples_before, 0, dummy=True)
+            df_reduced = add_samples(df_reduced, features_per_sample, sample_dict, neg_samples, number_of_samples_before, 0, dummy=True,
+                                     near_duplicates=near_duplicates)
 
     return df_reduced, combinations_already_in_dataset
 
-def create_samples(dir, file, combinations_already_in_dataset, number_of_samples_before):
+def planned_rows(metainfo, combinations_already_in_dataset, number_of_samples_before):
+    '''
+    rows of a raw result file that extract_malfunction_data will take samples from: the windows are drawn here the same
+    way as in add_samples and the state of the random generator is restored afterwards, so the extraction draws exactly
+    these windows again
+    '''
+    terminals_with_malfunctions = [i for i in metainfo.iloc[5].split("'") if 'Bus' in i]
+    terminals_with_devices = [i for i in metainfo.iloc[6].split("'") if 'Bus' in i]
+    for combination in combinations_already_in_dataset:
+        if set(terminals_with_devices) == set(combination[0]) and (terminals_with_malfunctions) == combination[1]:
+            return terminals_with_devices, []                   # skipped as a duplicate, no samples needed
+
+    sample_length = config.sample_length
+    number_of_windows = len(metainfo) // sample_length
+    state = random.getstate()
+    rows = []
+    for term, number_of_samples, label in malfunction_samples_per_terminal(terminals_with_devices, terminals_with_malfunctions,
+                                                                           number_of_samples_before):
+        for key in random.sample(range(number_of_windows), number_of_samples):
+            rows.append(np.arange(key * sample_length, (key + 1) * sample_length))
+    random.setstate(state)
+    return terminals_with_devices, np.concatenate(rows) if rows else []
+
+def read_raw_data(path, combinations_already_in_dataset, number_of_samples_before):
+    '''
+    reads the metainfo of a raw result file first and then only what the extraction needs: the columns of the terminals
+    named in the metainfo (only their voltages if just_voltages) and, for the malfunctions dataset, only the rows of
+    the windows that will be drawn
+    '''
+    from raw_store import read_metainfo, read_raw_results, labelled_terminals
+    metainfo = read_metainfo(path)
+    if metainfo is None:
+        return None
+    if config.raw_data_set_name == 'malfunctions_in_LV_grid_dataset':
+        terminals, rows = planned_rows(metainfo, combinations_already_in_dataset, number_of_samples_before)
+    else:
+        terminals, rows = labelled_terminals(metainfo)[0], None
+    return read_raw_results(path, terminals, rows, just_voltages=config.just_voltages, metainfo=metainfo)
+
+def create_samples(dir, file, combinations_already_in_dataset, number_of_samples_before, near_duplicates=None):
 
-    df = pd.read_csv(os.path.join(dir, file), header = [0,1,2],sep=';', low_memory=False)
+    df = read_raw_data(os.path.join(dir, file), combinations_already_in_dataset, number_of_samples_before)
     if config.raw_data_set_name == 'PV_noPV':
         train_samples, test_samples, terminals_already_in_dataset = extract_PV_noPV_data(df, combinations_already_in_dataset,
-                                                                number_of_samples_before)
+                                                                number_of_samples_before, near_duplicates)
     elif config.raw_data_set_name == 'malfunctions_in_LV_grid_dataset':
-        train_samples, test_samples, combinations_already_in_dataset = extract_malfunction_data(df, combinations_already_in_dataset, number_of_samples_before)
+        train_samples, test_samples, combinations_already_in_dataset = extract_malfunction_data(df, combinations_already_in_dataset, number_of_samples_before,
+                                                                                                near_duplicates)
     else:
         train_samples, test_samples, combinations_already_in_dataset = extract_dummy_data(df, combinations_already_in_dataset,
-                                                                            number_of_samples_before)
+                                                                            number_of_samples_before, near_duplicates)
 
     return train_samples, test_samples, combinations_already_in_dataset
\ No newline at end of file
@@ -4,12 +4,7 @@ import numpy as np
 import random, math
 import datetime
 import os
-import importlib
-from experiment_config import experiment_path, chosen_experiment
-
-spec = importlib.util.spec_from_file_location(chosen_experiment, experiment_path)
-config = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(config)
+from experiment_config import config
 
 
 def set_QDS_settings(app, study_case_obj, t_start, t_end):
@@ -0,0 +1,105 @@
+'''
+Datasets stored under a key computed from everything they are made of instead of under the name of the experiment
+only: the key is a hash of the settings that shape the samples (sample length, number of samples, share of positive
+samples, train test split, noise, ...) and of the raw result files they are taken from (names, sizes and a hash of the
+beginning and the end of every file). A dataset with the same key is reused, any change of the settings or the raw
+results leads to a new key and the dataset is created again, so dataset_available does not have to be set by hand.
+Datasets made from other datasets ("derive from", "combine datasets") are not cached.
+
+    entry = use_dataset_cache()             # the dataset of the learning config is read from / written to the cache
+    if not entry['hit']:
+        ...                                 # create and save the dataset
+        save_cache_entry(entry)
+'''
+import os
+import json
+import hashlib
+
+from experiment_config import config, learning_config
+
+CACHE_FOLDER = 'dataset_cache'
+ENTRY = 'cache_entry.json'
+
+# settings of the experiment config and of the learning config the samples depend on
+DATA_PARAMETERS = ['raw_data_set_name', 'sample_length', 'number_of_samples', 'share_of_positive_samples',
+                   'train_test_split', 'add_noise', 'accuracy', 'smartmeter_voltage_range',
+                   'smartmeter_ratedvoltage_range', 'just_voltages', 'simruns', 'number_of_grids', 'step_size',
+                   'dataset_format']
+DATA_SETTINGS = ['virtual_windows', 'window stride', 'deduplicate_windows', 'dedup tolerance', 'raw codec',
+                 'raw codec scale']
+
+
+def file_fingerprint(path, block=1 << 16):
+    '''
+    size and hash of the first and the last block of a file; raw results are too big to be hashed as a whole, but a
+    new simulation run changes its metainfo at the top and its values throughout
+    '''
+    size = os.path.getsize(path)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        digest.update(f.read(block))
+        if size > block:
+            f.seek(max(size - block, block))
+            digest.update(f.read(block))
+    return [size, digest.hexdigest()]
+
+
+def raw_run_manifest(results_folder=None):
+    '''
+    raw result files the dataset is made of (the first simruns files of every grid, as in create_dataset) with their
+    fingerprints
+    '''
+    results_folder = results_folder or os.path.join(config.results_folder, config.raw_data_set_name + '_raw_data')
+    runs = []
+    if not os.path.isdir(results_folder):
+        return runs
+    for grid in sorted(os.listdir(results_folder)):
+        if os.path.isdir(os.path.join(results_folder, grid)):
+            for file in sorted(os.listdir(os.path.join(results_folder, grid))[0:int(config.simruns)]):
+                runs.append([grid, file] + file_fingerprint(os.path.join(results_folder, grid, file)))
+    return runs
+
+
+def data_parameters():
+    parameters = {name: getattr(config, name, None) for name in DATA_PARAMETERS}
+    parameters.update({name: learning_config.get(name) for name in DATA_SETTINGS})
+    return parameters
+
+
+def dataset_key(parameters=None, runs=None):
+    parameters = data_parameters() if parameters is None else parameters
+    runs = raw_run_manifest() if runs is None else runs
+    content = json.dumps({'parameters': parameters, 'raw runs': runs}, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()[:16]
+
+
+def cache_folder(key):
+    return os.path.join(config.results_folder, CACHE_FOLDER, key)
+
+
+def use_dataset_cache():
+    '''
+    points the dataset of the learning config to its folder in the cache; returns the cache entry, with hit True if the
+    dataset was created before with the same settings from the same raw results (save_cache_entry marks it complete)
+    '''
+    from util import DATASET_FOLDERS
+    parameters, runs = data_parameters(), raw_run_manifest()
+    key = dataset_key(parameters, runs)
+    folder = cache_folder(key)
+    DATASET_FOLDERS[learning_config['dataset']] = folder
+    hit = os.path.exists(os.path.join(folder, ENTRY))
+    print('Dataset %s %s in the dataset cache (key %s)' % (learning_config['dataset'], 'found' if hit else 'not found', key))
+    return {'key': key, 'folder': folder, 'hit': hit, 'dataset': learning_config['dataset'], 'parameters': parameters,
+            'raw runs': runs}
+
+
+def save_cache_entry(entry):
+    '''
+    marks the dataset in the cache folder of the entry as complete, written after the dataset so that an interrupted
+    build is not taken for a hit
+    '''
+    os.makedirs(entry['folder'], exist_ok=True)
+    with open(os.path.join(entry['folder'], ENTRY), 'w') as f:
+        json.dump({name: value for name, value in entry.items() if name not in ['hit', 'folder']}, f, indent=1,
+                  default=str)
+    print('Dataset %s saved in the dataset cache (key %s)' % (entry['dataset'], entry['key']))
@@ -0,0 +1,125 @@
+'''
+Removal of near duplicate windows before they enter a dataset: all simulation runs of a grid share the load profiles,
+so windows of terminals far from any PV are nearly the same in every run. Windows are compared as the classifiers see
+them, zero meaned by themselves; two windows are near duplicates if no time step differs by more than the tolerance.
+Candidates are found with locality sensitive hashing (the signs of random projections, split into bands; windows that
+agree on all signs of any band share a bucket) and then verified, so a window is compared to a handful of windows
+instead of to all windows kept so far.
+
+    index = NearDuplicateIndex(tolerance=0.001)
+    keep = index.add(windows, labels)          # boolean mask of the windows that are not near duplicates
+    index.print_report()
+'''
+import os
+import json
+import numpy as np
+
+
+class NearDuplicateIndex:
+
+    def __init__(self, tolerance, bands=4, bits=12, seed=0):
+        self.tolerance = tolerance
+        self.bands = bands
+        self.bits = bits
+        self.seed = seed
+        self.planes = None
+        self.buckets = [{} for _ in range(bands)]
+        self.windows = None                             # zero meaned windows kept so far, in the first count rows
+        self.count = 0
+        self.labels = []
+        self.report_counts = {}
+
+    def _signatures(self, windows):
+        if self.planes is None:
+            rng = np.random.default_rng(self.seed)
+            self.planes = rng.standard_normal((windows.shape[1], self.bands * self.bits)).astype(np.float32)
+            self.windows = np.empty((0, windows.shape[1]), dtype=np.float32)
+        signs = (windows @ self.planes > 0).reshape(len(windows), self.bands, self.bits)
+        keys = np.packbits(signs, axis=-1, bitorder='little')
+        flat = np.abs(windows).max(axis=1) <= self.tolerance / 2        # all flat windows are near duplicates
+        return keys, flat
+
+    def _count(self, label, name):
+        counts = self.report_counts.setdefault(int(label), {'candidates': 0, 'kept': 0, 'dropped': 0,
+                                                            'near duplicates of the other class': 0})
+        counts[name] += 1
+
+    def add(self, windows, labels):
+        '''
+        adds the windows [windows, steps] with their labels and returns which of them are kept; a window is dropped if
+        a window of the same class within the tolerance was kept before (near duplicates of the other class are kept
+        but counted in the report)
+        '''
+        windows = np.asarray(windows, dtype=np.float32).reshape(len(windows), -1)
+        windows = windows - windows.mean(axis=1, keepdims=True)
+        labels = np.asarray(labels).reshape(-1)
+        keys, flat = self._signatures(windows)
+        keep = np.ones(len(windows), dtype=bool)
+        new = []
+
+        for i, window in enumerate(windows):
+            label = int(labels[i])
+            self._count(label, 'candidates')
+            bucket_keys = [('flat',)] if flat[i] else [(band, keys[i, band].tobytes()) for band in range(self.bands)]
+            candidates = {c for band, key in enumerate(bucket_keys)
+                          for c in self.buckets[0 if flat[i] else band].get(key, ())}
+            close_labels = set()
+            if candidates:
+                candidates = np.fromiter(candidates, dtype=np.int64)
+                stored = self._stored(candidates, new)
+                close_labels = {self.labels[c] for c in candidates[np.abs(stored - window).max(axis=1) <= self.tolerance]}
+            if label in close_labels:
+                keep[i] = False
+                self._count(label, 'dropped')
+                continue
+            if close_labels:
+                self._count(label, 'near duplicates of the other class')
+            self._count(label, 'kept')
+
+            number = len(self.labels)
+            self.labels.append(label)
+            new.append(window)
+            for band, key in enumerate(bucket_keys):
+                self.buckets[0 if flat[i] else band].setdefault(key, []).append(number)
+
+        if new:
+            # the capacity is doubled when it runs out, so windows added one by one are not all copied again every time
+            if self.count + len(new) > len(self.windows):
+                capacity = max(2 * len(self.windows), self.count + len(new), 64)
+                windows = np.empty((capacity, self.windows.shape[1]), dtype=np.float32)
+                windows[:self.count] = self.windows[:self.count]
+                self.windows = windows
+            self.windows[self.count:self.count + len(new)] = np.stack(new)
+            self.count += len(new)
+        return keep
+
+    def _stored(self, numbers, new):
+        # windows kept so far, including the ones added in the current call
+        stored = np.empty((len(numbers), self.windows.shape[1]), dtype=np.float32)
+        before = numbers < self.count
+        stored[before] = self.windows[numbers[before]]
+        for j in np.flatnonzero(~before):
+            stored[j] = new[numbers[j] - self.count]
+        return stored
+
+    def report(self):
+        total = {name: sum(counts[name] for counts in self.report_counts.values())
+                 for name in ['candidates', 'kept', 'dropped', 'near duplicates of the other class']}
+        return {'tolerance': self.tolerance, 'total': total,
+                'per class': {str(label): counts for label, counts in sorted(self.report_counts.items())}}
+
+    def print_report(self):
+        report = self.report()
+        print("\n########## Near duplicate windows (tolerance %g) ##########" % self.tolerance)
+        for label, counts in report['per class'].items():
+            print('class %s: %d candidates, %d kept, %d dropped, %d near duplicates of the other class' % (
+                label, counts['candidates'], counts['kept'], counts['dropped'],
+                counts['near duplicates of the other class']))
+        print('samples skipped as near duplicates: %s' % ', '.join(
+            'class %s: %d' % (label, counts['dropped']) for label, counts in report['per class'].items()))
+
+    def write_report(self, file):
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        with open(file, 'w') as f:
+            json.dump(self.report(), f, indent=4)
+        print('Near duplicate report written to %s' % file)
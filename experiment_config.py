@@ -1,5 +1,7 @@
 import os
 import sys
+import importlib.util
+from collections.abc import MutableMapping
 
 #see experiment folder for all experiments (combinations of datasets, timeseries length and sample number)
 
@@ -42,3 +44,60 @@ except AttributeError:
     pass
 
 experiment_path = os.path.join(experiments_folder, chosen_experiment) + '.py'
+
+
+_config = None
+
+
+def load_config():
+    '''
+    executes the chosen experiment file once (on first access) and returns the cached module; every module shares
+    this single object instead of re-executing the experiment file at import time
+    '''
+    global _config
+    if _config is None:
+        spec = importlib.util.spec_from_file_location(chosen_experiment, experiment_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _config = module
+    return _config
+
+
+class LazyConfig:
+    '''
+    stands in for the experiment module; attribute access loads the config on first use
+    '''
+
+    def __getattr__(self, name):
+        return getattr(load_config(), name)
+
+    def __setattr__(self, name, value):
+        setattr(load_config(), name, value)
+
+
+class LazyLearningConfig(MutableMapping):
+    '''
+    stands in for the learning_config dict of the experiment; item access loads the config on first use
+    '''
+
+    def __getitem__(self, key):
+        return load_config().learning_config[key]
+
+    def __setitem__(self, key, value):
+        load_config().learning_config[key] = value
+
+    def __delitem__(self, key):
+        del load_config().learning_config[key]
+
+    def __iter__(self):
+        return iter(load_config().learning_config)
+
+    def __len__(self):
+        return len(load_config().learning_config)
+
+    def __repr__(self):
+        return repr(load_config().learning_config)
+
+
+config = LazyConfig()
+learning_config = LazyLearningConfig()
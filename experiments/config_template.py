@@ -16,11 +16,28 @@ local_machine_tz = 'Europe/Berlin'                          #timezone; it's impo
 learning_config = {
     "mode": "train",    #train, eval
     "dataset": "malfunctions_in_LV_grid_dataset_7day_10k",
+    "combine datasets": [],             #e.g. ["malfunctions_in_LV_grid_dataset_1day_10k", "malfunctions_in_LV_grid_dataset_7day_10k"]: samples of all lengths saved as "dataset" and trained on in length bucketed, padded batches
+    "derive from": None,                #e.g. {"dataset": "malfunctions_in_LV_grid_dataset_7day_20k", "slice length": 96, "stride": None, "aggregate": None, "aggregation": 'mean', "number of samples": None}: "dataset" derived from an existing dataset by cutting its samples into slices of "slice length" steps (every "stride" steps) and/or reducing every "aggregate" steps to one (mean, min, max or last), without creating it from the raw data again
+    "resolution": 1,                    #time steps of the dataset per step fed to the models: 1 for full (15 minute) resolution, 2 for 30 minutes, 4 for 1 hour; coarser samples come as mean, min and max channels (the input size of the model settings is set to 3) and are faster to train on (see benchmarks/resolution.py)
+    "raw codec": None,                  #'offset' or 'delta' to store the raw samples of the dataset as int16 steps of the raw codec scale from a base value per sample (half the size of float32, see codec.py); None for float32
+    "raw codec scale": 1e-5,            #p.u. per int16 step, the rounding error is at most half of it
+    "dataset_cache": False,             #keep datasets under a hash of the settings they depend on (sample length, number of samples, noise, ...) and of the raw results, reuse them when nothing changed and create them otherwise; dataset_available is not needed then
+    "in_memory_data": False,            #load the whole dataset into shared memory once (other processes using the same dataset file attach to it) and slice shuffled batches from it instead of reading sample by sample; for datasets that fit into memory
+    "append_dataset": False,            #with dataset_available = False, only create the samples of raw results not in the dataset yet (see its manifest) and append them to the existing dataset files instead of rewriting them
+    "virtual_windows": False,           #instead of creating the dataset from the raw data, index windows of the raw results (converted to a memory mapped store once) that are sliced when accessed
+    "window stride": None,              #steps between the starts of windows with virtual_windows; None for non overlapping windows of the sample length, smaller values for overlapping ones
+    "noise_augmentation": False,        #add smart meter noise (see accuracy and smartmeter ranges below) to the batches of the loaders instead of to the dataset (leave add_noise False then)
+    "fresh noise every epoch": True,    #draw new noise for the training samples every epoch; test samples get the same noise every epoch
+    "noise seed": 0,
+    "deduplicate_windows": False,       #drop windows that are near duplicates (zero meaned, no step differing by more than the dedup tolerance) of a window of the same class already in the dataset; a report is written along with the dataset
+    "dedup tolerance": 0.001,
+    # model settings are given in the order below or as a dict with the names registered in util (e.g. {"input_size": 1, "output_size": 2, "hidden_dim": 6, "n_layers": 2})
     "RNN model settings": [1, 2, 6, 2],     # number of input features, number of output features, number of features in hidden state, number of of layers
     "LSTM model settings": [1, 2, 3, 3],     # number of input features, number of output features, number of features in hidden state, number of of layers
     "GRU model settings": [1, 2, 3, 4],     # number of input features, number of output features, number of features in hidden state, number of of layers
     "Transformer model settings": [2, 1, 1, 6, 2, 0.1],     # ntoken > 2 outputs, ninp > word/input embedding, nhead, nhid, nlayers, dropout=0.5
     "R-Transformer model settings": [1, 3, 2, 1, 'GRU', 7, 4, 1, 0.1, 0.1],     # input size, dimension of model,output size, h (heads?), rnn_type ('GRU', 'LSTM', 'RNN'), ksize (key size?), n (# local RNN layers), n_level (how many RNN-multihead-attention-fc blocks), dropout, emb_dropout
+    "R-Transformer layer norm": 'reference',     # reference, compat (fused kernel, matches reference up to a relative difference of about eps / std), fused (nn.LayerNorm semantics, for newly trained models)
     "number of epochs": 100,
     "learning rate": 1*10**-5,
     "activation function": 'relu',          # relu, tanh
@@ -38,8 +55,20 @@ learning_config = {
     "cross_val_metrics": ['fit_time', 'test_accuracy', 'test_precision_macro', 'test_recall_macro', 'test_f1_macro'],
     "plot samples": True,
     "classifier": "RTransformer",  # RNN, LSTM, GRU, Transformer, RTransformer
+    "compile": 'None',             #None, torch.compile (forward and training step, falls back to TorchScript if it fails), TorchScript (traced inference only)
     "save_model": True,            #saves state dict and optimizer for later use/further training
-    "export_model": False          #for an application
+    "export_model": False,         #for an application
+    "export_preprocessing": False, #embed zero meaning, max abs scaling, last step selection and softmax into the exported model (raw voltages in, class probabilities out)
+    "export_dynamic_sequence": False, #exported model accepts any sequence length (batch size is always dynamic); not possible with export_preprocessing
+    "quantize_model": False,        #int8 variant of the exported model for CPU inference; refused if the F-score drops too much
+    "quantization": 'dynamic',      #dynamic, static (calibrated on the first samples of the test set)
+    "quantization calibration samples": 500,
+    "max F-score drop": 0.01,       #F-score of the int8 model compared to the float32 model on the test set
+    "profile_pipeline": False,      #time every stage (wall/CPU time, process peak memory, items processed) and write <dataset>_profile.json
+    "profile_trace": False,         #additionally write the stages as Chrome trace <dataset>_trace.json
+    "profile_training": False,      #torch.profiler (CPU) over the first training steps: hot operators in <dataset>_<classifier>_ops.txt plus a trace
+    "profiler schedule": [1, 1, 5], #mini batches to skip, to profile as warm up (discarded) and to record
+    "profiler top operators": 20
 
 }
 
@@ -2,12 +2,7 @@ import pflib.pf as pf
 import pandas as pd
 import numpy as np
 import os
-import importlib
-from experiment_config import experiment_path, chosen_experiment
-
-spec = importlib.util.spec_from_file_location(chosen_experiment, experiment_path)
-config = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(config)
+from experiment_config import config
 
 
 def define_PV_controls(app):
@@ -7,7 +7,10 @@ def inference(model, input):
     session = onnxruntime.InferenceSession(model)
     input_name = session.get_inputs()[0].name
     all_predictions = session.run(None, {input_name: input})[0]
-    last_prediction = all_predictions[-1][-1]
-    softmaxed_last_prediction = np.exp(last_prediction) / np.sum(np.exp(last_prediction))
+    if all_predictions.ndim == 2:       # model exported with preprocessing: raw voltages in, class probabilities out
+        softmaxed_last_prediction = all_predictions[-1]
+    else:
+        last_prediction = all_predictions[-1][-1]
+        softmaxed_last_prediction = np.exp(last_prediction) / np.sum(np.exp(last_prediction))
     prediction = np.where(softmaxed_last_prediction == np.amax(softmaxed_last_prediction))[0][0]
     return prediction, softmaxed_last_prediction
\ No newline at end of file
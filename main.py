@@ -35,28 +35,12 @@ Description:
       Time spent:   (Hours)   ~20                 25          ~15         5             to be seen
       Conclusion:   It took much longer than planned to actually get the RNN running and producing meaningful outputs
 """
-import importlib
-
-from experiment_config import experiment_path, chosen_experiment
-spec = importlib.util.spec_from_file_location(chosen_experiment, experiment_path)
-config = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(config)
-learning_config = config.learning_config
-import plotting
-if not config.raw_data_available:
-    from start_powerfactory import start_powerfactory
-    from grid_preparation import prepare_grid
-    from data_creation import create_data
+from experiment_config import config, learning_config
 from create_instances import create_samples
-from malfunctions_in_LV_grid_dataset import MlfctinLVdataset
-from PV_noPV_dataset import PVnoPVdataset
-from dummy_dataset import Dummydataset
-from util import load_model, export_model, save_model, load_data, plot_samples, model_exists, choose_best
+from profiling import profiler, stage
+from util import load_model, dataset_file, new_dataset_manifest, load_dataset_manifest, save_dataset_manifest, dataset_writer, compile_model, combine_datasets, derive_dataset, save_window_index, near_duplicate_index, dedup_report_file, export_model, quantize_model, save_model, load_data, plot_samples, model_exists, choose_best
 
 import numpy as np
-from sklearn.model_selection import cross_validate
-from sklearn.linear_model import SGDClassifier
-from sklearn.model_selection import KFold
 import logging, sys
 import torch
 import h5py
@@ -68,6 +52,9 @@ import os
 def generate_raw_data():
 
     if config.raw_data_available == False:
+        from start_powerfactory import start_powerfactory      # needs PowerFactory, so only imported when raw data is generated
+        from grid_preparation import prepare_grid
+        from data_creation import create_data
         for file in os.listdir(config.data_folder):
             if os.path.isdir(config.data_folder + file):
 
@@ -83,7 +70,12 @@ def generate_raw_data():
     return
 
 
-def create_dataset():
+def create_dataset(manifest=None):
+    '''
+    samples of the raw result files; with a dataset manifest (see util.load_dataset_manifest), the files listed in it
+    are skipped and the files the samples are taken from are added to it, so that only the samples of new raw results
+    are created when the dataset is appended to
+    '''
 
     train_set = pd.DataFrame()
     test_set = pd.DataFrame()
@@ -91,51 +83,64 @@ def create_dataset():
         print(
             "Dataset %s is created from raw data" % learning_config['dataset'])
         if (1/config.share_of_positive_samples).is_integer():
+            near_duplicates = near_duplicate_index()
 
             results_folder = config.results_folder + config.raw_data_set_name + '_raw_data' + '\\'
+            samples_before = manifest['samples'] if manifest else 0
             for dir in os.listdir(results_folder):
                 if os.path.isdir(results_folder + dir):
                     combinations_already_in_dataset = []  # avoid having duplicate samples (i.e. data of terminal with malfunction at same terminal and same terminals having a PV)
+                    if manifest:
+                        combinations_already_in_dataset = manifest['combinations'].setdefault(dir, [])
                     files = os.listdir(results_folder + dir)[0:int(config.simruns)]
                     for file in files:
+                        if manifest and [dir, file] in manifest['runs']:
+                            continue
                         train_samples, test_samples, combinations_already_in_dataset = create_samples(results_folder + dir, file, combinations_already_in_dataset,
-                                                                                                      len(train_set.columns) + len(test_set.columns))
+                                                                                                      samples_before + len(train_set.columns) + len(test_set.columns),
+                                                                                                      near_duplicates)
                         train_set = pd.concat([train_set, train_samples], axis=1, sort=False)
                         test_set = pd.concat([test_set, test_samples], axis=1, sort=False)
+                        if manifest is not None:
+                            manifest['runs'].append([dir, file])
+            if manifest is not None:
+                manifest['samples'] = samples_before + len(train_set.columns) + len(test_set.columns)
+            if near_duplicates is not None:
+                near_duplicates.print_report()
+                near_duplicates.write_report(dedup_report_file())
             return train_set, test_set
         else:
             print("Share of malfunctioning samples wrongly chosen, please choose a value that yields a real number as an inverse i.e. 0.25 or 0.5")
             return train_set, test_set
 
-def save_dataset(df, type='train', scaler=None):
+def save_dataset(df, type='train', max_abs=None, append=False):
+    '''
+    saves the samples (columns of df, label in the last row) one sample per row; the max abs values are fitted on the
+    training set and returned so that the test set is scaled with them. With append, the samples are added to the
+    existing dataset and the max abs values are updated with them.
+    '''
 
     if config.dataset_available == False:
         if config.dataset_format == 'HDF':
-            from sklearn.preprocessing import MaxAbsScaler
-            from util import fit_scaler, preprocessing
-
-            path = config.results_folder + learning_config['dataset'] + '\\' + type + '\\'
-            if not os.path.isdir(path):
-                os.makedirs(path)
+            if len(df.columns) == 0:
+                print("No new %s samples for dataset %s" % (type, learning_config['dataset']))
+                if not (append and os.path.exists(dataset_file(type))):
+                    return max_abs
+                writer = dataset_writer(type, max_abs=None if type == 'train' else max_abs, append=append)
+                return writer.close()       # the samples in there are rescaled if the max abs values of training changed
 
             data_raw = df[:-1].astype(np.float32)
             label = df.iloc[-1].copy()[:].astype(int)
-
-            if type == 'train':
-                scaler = fit_scaler(data_raw)
-            data_preprocessed = preprocessing(data_raw, scaler).transpose()
-
-            with h5py.File(path + learning_config['dataset'] + '_' + type + '.hdf5', 'w') as hdf:
-                if int(len(data_raw.columns)/len(label)) > 1:
-                    dset_data = hdf.create_dataset('x_raw_' + type, data=data_raw, shape=(len(data_raw.columns), len(data_raw), int(len(data_raw.columns)/len(label))), compression='gzip', chunks=True)
-                    dset_data_pre = hdf.create_dataset('x_' + type, data=data_preprocessed, shape=(len(data_preprocessed.columns), len(data_preprocessed), int(len(data_preprocessed.columns)/len(label))), compression='gzip', chunks=True)
-                else:
-                    dset_data = hdf.create_dataset('x_raw_' + type, data=data_raw, shape=(len(data_raw.columns), len(data_raw)), compression='gzip', chunks=True)
-                    dset_data_pre = hdf.create_dataset('x_' + type, data=data_preprocessed, shape=(len(data_preprocessed.columns), len(data_preprocessed)), compression='gzip', chunks=True)
-
-                dset_label = hdf.create_dataset('y_' + type, data=label, shape=(len(label), 1), compression='gzip', chunks=True)
-                hdf.close()
-                return scaler
+            features = int(len(data_raw.columns) / len(label))
+
+            x_raw = data_raw.values.transpose()                                 # [samples * features, steps]
+            if features > 1:
+                x_raw = x_raw.reshape(len(label), features, -1).transpose(0, 2, 1)    # [samples, steps, features]
+            writer = dataset_writer(type, max_abs=None if type == 'train' else max_abs, append=append)
+            writer.append(x_raw, label.values)
+            max_abs = writer.close()        # fitted max abs values, e.g. to embed the preprocessing into an exported model
+            print("Dataset %s saved" % learning_config['dataset'])
+            return max_abs
         else:
             df.to_csv(config.results_folder + learning_config['dataset'] + '.csv', header=True, sep=';', decimal='.', float_format='%.' + '%sf' % config.float_decimal)
     print(
@@ -144,6 +149,7 @@ def save_dataset(df, type='train', scaler=None):
 
 
 def cross_val(X, y, model):
+    from sklearn.model_selection import KFold
     kf = KFold(n_splits=learning_config['k folds'])
     best_clfs = []
     scores = []
@@ -170,6 +176,8 @@ def cross_val(X, y, model):
     return model, scores_dict
 
 def baseline(X, y):
+    from sklearn.model_selection import cross_validate
+    from sklearn.linear_model import SGDClassifier
     clf_baseline = SGDClassifier()
     scores = cross_validate(clf_baseline, X, y, scoring=learning_config["metrics"], cv=10, n_jobs=1)
     print("########## Linear Baseline: 10-fold Cross-validation ##########")
@@ -198,11 +206,47 @@ def init():
 
 if __name__ == '__main__':  #see config file for settings
 
-    generate_raw_data()
-    if config.dataset_available == False:
-        train_set, test_set = create_dataset()
-        scaler = save_dataset(train_set, 'train')
-        save_dataset(test_set, 'test', scaler=scaler)
+    profiler.enabled = learning_config.get("profile_pipeline", False)
+
+    with stage('generate raw data'):
+        generate_raw_data()
+    cache_entry = None
+    derived = learning_config.get("combine datasets") or learning_config.get("derive from")   # made from other datasets
+    if learning_config.get("dataset_cache") and config.dataset_format == 'HDF' and derived:
+        print('Dataset %s is made from other datasets, it is not cached' % learning_config['dataset'])
+    elif learning_config.get("dataset_cache") and config.dataset_format == 'HDF':
+        from dataset_cache import use_dataset_cache, save_cache_entry
+        with stage('dataset cache'):
+            cache_entry = use_dataset_cache()
+        config.dataset_available = cache_entry['hit']           # created only if the settings or raw results changed
+    from_raw_data = config.dataset_available == False and not derived
+    if from_raw_data and learning_config.get("virtual_windows"):
+        with stage('index raw windows'):
+            save_window_index(stride=learning_config.get("window stride"))
+    elif from_raw_data:
+        append = learning_config.get("append_dataset", False) and config.dataset_format == 'HDF' and cache_entry is None
+        manifest = load_dataset_manifest() if append else None
+        if manifest is None:                                    # created anew
+            append, manifest = False, new_dataset_manifest()
+        with stage('create dataset') as s:
+            train_set, test_set = create_dataset(manifest)
+            s.count(len(train_set.columns) + len(test_set.columns))
+        with stage('save dataset', items=len(train_set.columns), type='train'):
+            max_abs = save_dataset(train_set, 'train', append=append)
+        with stage('save dataset', items=len(test_set.columns), type='test'):
+            save_dataset(test_set, 'test', max_abs=max_abs, append=append)
+        save_dataset_manifest(manifest)
+    if cache_entry is not None and not cache_entry['hit']:
+        save_cache_entry(cache_entry)
+    if learning_config.get("combine datasets"):
+        with stage('combine datasets'):
+            combine_datasets(learning_config["combine datasets"])
+    if learning_config.get("derive from"):
+        with stage('derive dataset'):
+            settings = learning_config["derive from"]
+            derive_dataset(settings["dataset"], slice_length=settings.get("slice length"), stride=settings.get("stride"),
+                           aggregate=settings.get("aggregate"), how=settings.get("aggregation", 'mean'),
+                           number_of_samples=settings.get("number of samples"))
 
     print("\n########## Configuration ##########")
     for key, value in learning_config.items():
@@ -213,14 +257,18 @@ if __name__ == '__main__':  #see config file for settings
 
     # Load data
     logger.info("Loading Data ...")
-    if learning_config["mode"] == 'train':
-        train_loader = load_data('train')
-    test_loader = load_data('test')
+    with stage('load data') as s:
+        if learning_config["mode"] == 'train':
+            train_loader = load_data('train')
+            s.count(len(train_loader.dataset))
+        test_loader = load_data('test')
+        s.count(len(test_loader.dataset))
     logger.info(f"Loaded data.")
 
     #dataset, X, y = load_dataset()
     if learning_config["plot samples"] and learning_config["mode"] == 'train':
-        for i, (X, y, X_raw) in enumerate(train_loader):
+        for i, batch in enumerate(train_loader):
+            X, y, X_raw = batch[:3]             # loaders of samples of different lengths add their lengths
             plot_samples(X_raw, y, X)
             break
 
@@ -231,6 +279,7 @@ if __name__ == '__main__':  #see config file for settings
 
     path = os.path.join(config.models_folder, learning_config['classifier'])
     model, epoch, loss = load_model(learning_config)
+    model = compile_model(model, learning_config)
 
     if not learning_config["cross_validation"]:
 
@@ -239,16 +288,19 @@ if __name__ == '__main__':  #see config file for settings
         print("\n########## Training ##########")
         if learning_config["mode"] == 'train':
             logger.info("Training classifier ..")
-            clfs, losses, lrs = model.fit(train_loader, test_loader, early_stopping=learning_config['early stopping'], control_lr=learning_config['LR adjustment'], prev_epoch=epoch, prev_loss=loss)
+            with stage('train'):
+                clfs, losses, lrs = model.fit(train_loader, test_loader, early_stopping=learning_config['early stopping'], control_lr=learning_config['LR adjustment'], prev_epoch=epoch, prev_loss=loss)
             logger.info("Training finished!")
             logger.info('Finished Training')
+            import plotting
             plotting.plot_2D([losses, [i[1] for i in clfs]], labels=['Training loss', 'Validation loss'], title='Losses after each epoch', x_label='Epoch', y_label='Loss')   #plot training loss for each epoch
             plotting.plot_2D(lrs, labels='learning rate', title='Learning rate for each epoch', x_label='Epoch',
                              y_label='Learning rate')
             clf, epoch = choose_best(clfs)
             model.state_dict = clf[0]                           #pick weights of best model found
 
-        y_pred, outputs, y_test = model.predict(test_loader=test_loader)
+        with stage('evaluate', items=len(test_loader.dataset)):
+            y_pred, probs, y_test = model.predict(test_loader=test_loader)
         if learning_config["mode"] == 'eval':
             clf = model
             score = model.score(y_test, y_pred)
@@ -278,7 +330,18 @@ if __name__ == '__main__':  #see config file for settings
         save_model(model, epoch, clf[1])
 
     if learning_config["export_model"]:
-        export_model(model, learning_config)
+        with stage('export model'):
+            export_model(model, learning_config)
+
+    if learning_config.get("quantize_model", False):
+        with stage('quantize model'):
+            quantize_model(model, learning_config)
+
+    if profiler.enabled:
+        profiler.print_summary()
+        profiler.write_report(learning_config['dataset'] + '_profile.json')
+        if learning_config.get("profile_trace", False):
+            profiler.write_chrome_trace(learning_config['dataset'] + '_trace.json')
 
 
 
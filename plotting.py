@@ -1,11 +1,6 @@
 import numpy as np
 import matplotlib.pyplot as plt
-import importlib
-
-from experiment_config import experiment_path, chosen_experiment
-spec = importlib.util.spec_from_file_location(chosen_experiment, experiment_path)
-config = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(config)
+from experiment_config import config
 
 
 def plot_sample(Y, x=None, label = None, title=None, save=False, figname=None):
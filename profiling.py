@@ -0,0 +1,198 @@
+'''
+Lightweight instrumentation of the pipeline: stages are timed with context managers that record wall time, CPU time,
+the peak memory of the process and the number of items (e.g. samples) processed. The operating system only keeps the
+peak of the whole process lifetime, so a stage records that peak at its end and by how much it was raised during the
+stage (0 for a stage that stayed below an earlier peak), not the memory the stage used itself. The collected stages
+are summarized in a JSON report and can also be written as a Chrome trace (open chrome://tracing or
+https://ui.perfetto.dev and load the file).
+
+    from profiling import stage
+    with stage('load data', items=len(dataset)):
+        ...
+
+Profiling is switched on with "profile_pipeline" in the learning config; while it is off, stages are not recorded.
+'''
+import json
+import os
+import sys
+import time
+import threading
+
+
+def peak_rss_mb():
+    '''
+    peak resident memory of the process so far in MB (None if it can't be determined on this platform)
+    '''
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024        # bytes on macOS, kilobytes on Linux
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1024 ** 2                       # peak working set on Windows
+    except ImportError:
+        return None
+
+
+class Stage:
+    '''
+    one timed stage; used as a context manager or, for long blocks, with begin() and end()
+    '''
+
+    def __init__(self, profiler, name, items=None, **args):
+        self.profiler = profiler
+        self.name = name
+        self.items = items
+        self.args = args
+
+    def count(self, items):
+        self.items = (self.items or 0) + items
+
+    def begin(self):
+        if self.profiler.enabled:
+            self.start = time.perf_counter()
+            self.cpu_start = time.process_time()
+            self.rss_start = peak_rss_mb()
+        return self
+
+    def end(self, items=None):
+        if items is not None:
+            self.count(items)
+        if self.profiler.enabled and hasattr(self, 'start'):
+            wall = time.perf_counter() - self.start
+            peak = peak_rss_mb()
+            self.profiler.record({
+                'name': self.name,
+                'start': self.start - self.profiler.origin,
+                'wall time': wall,
+                'cpu time': time.process_time() - self.cpu_start,
+                'process peak RSS MB': peak,
+                'process peak RSS increase MB': peak - self.rss_start if peak is not None else None,
+                'items': self.items,
+                'thread': threading.get_ident(),
+                'args': self.args,
+            })
+        return self
+
+    def __enter__(self):
+        return self.begin()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end()
+        return False
+
+
+class Profiler:
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self.stages = []
+        self._lock = threading.Lock()
+
+    def stage(self, name, items=None, **args):
+        return Stage(self, name, items, **args)
+
+    def record(self, stage):
+        with self._lock:
+            self.stages.append(stage)
+
+    def summary(self):
+        '''
+        stages aggregated by name in the order they first occurred
+        '''
+        summary = {}
+        for s in self.stages:
+            total = summary.setdefault(s['name'], {'calls': 0, 'wall time': 0.0, 'cpu time': 0.0, 'items': None,
+                                                   'process peak RSS MB': None})
+            total['calls'] += 1
+            total['wall time'] += s['wall time']
+            total['cpu time'] += s['cpu time']
+            if s['items'] is not None:
+                total['items'] = (total['items'] or 0) + s['items']
+            if s['process peak RSS MB'] is not None:
+                total['process peak RSS MB'] = max(total['process peak RSS MB'] or 0, s['process peak RSS MB'])
+        for total in summary.values():
+            total['items/s'] = total['items'] / total['wall time'] if total['items'] and total['wall time'] else None
+        return summary
+
+    def print_summary(self):
+        print("\n########## Profile ##########")
+        for name, total in self.summary().items():
+            print('%-20s calls: %-5d wall: %9.3f s  cpu: %9.3f s  items/s: %10s  process peak RSS: %s MB' % (
+                name, total['calls'], total['wall time'], total['cpu time'],
+                '-' if total['items/s'] is None else '%.1f' % total['items/s'],
+                '-' if total['process peak RSS MB'] is None else '%.0f' % total['process peak RSS MB']))
+
+    def write_report(self, file):
+        with open(file, 'w') as f:
+            json.dump({'summary': self.summary(), 'stages': self.stages}, f, indent=4, default=str)
+        print('Profile written to %s' % file)
+
+    def write_chrome_trace(self, file):
+        events = [{'name': s['name'], 'ph': 'X', 'pid': os.getpid(), 'tid': s['thread'],
+                   'ts': s['start'] * 10 ** 6, 'dur': s['wall time'] * 10 ** 6,
+                   'args': dict(s['args'], **{'cpu time': s['cpu time'], 'items': s['items'],
+                                              'process peak RSS MB': s['process peak RSS MB']})} for s in self.stages]
+        with open(file, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+        print('Chrome trace written to %s' % file)
+
+
+profiler = Profiler()
+stage = profiler.stage
+
+
+class TrainingProfiler:
+    '''
+    torch.profiler over a few training steps (mini batches): after wait steps, warmup steps are profiled but discarded
+    and the following active steps are recorded; the operators with the highest self CPU time are printed and written
+    to <name>_ops.txt along with a trace of the steps (<name>_trace_<time>.json). Does nothing unless enabled.
+    '''
+
+    def __init__(self, name, wait=1, warmup=1, active=5, top=20, enabled=True):
+        self.name = name
+        self.top = top
+        self.steps = 0
+        self.total = wait + warmup + active
+        self.profile = None
+        if enabled:
+            from torch import profiler as torch_profiler
+            self.profile = torch_profiler.profile(activities=[torch_profiler.ProfilerActivity.CPU],     # CPU only
+                                                  schedule=torch_profiler.schedule(wait=wait, warmup=warmup,
+                                                                                   active=active, repeat=1),
+                                                  on_trace_ready=self.export, record_shapes=True)
+            self.profile.start()
+
+    def step(self):
+        if self.profile is None:
+            return
+        self.profile.step()
+        self.steps += 1
+        if self.steps >= self.total:
+            self.stop()
+
+    def stop(self):
+        if self.profile is not None:
+            profile, self.profile = self.profile, None
+            profile.stop()
+
+    def export(self, profile):
+        table = profile.key_averages().table(sort_by='self_cpu_time_total', row_limit=self.top)
+        print("\n########## Hot operators (self CPU time) ##########")
+        print(table)
+        with open(self.name + '_ops.txt', 'w') as f:
+            f.write(table)
+        trace = '%s_trace_%s.json' % (self.name, time.strftime('%Y%m%d-%H%M%S'))
+        profile.export_chrome_trace(trace)
+        print('Operator table written to %s, trace to %s' % (self.name + '_ops.txt', trace))
+
+
+def training_profiler(learning_config, classifier):
+    wait, warmup, active = learning_config.get("profiler schedule", [1, 1, 5])
+    return TrainingProfiler(learning_config['dataset'] + '_' + classifier, wait, warmup, active,
+                            top=learning_config.get("profiler top operators", 20),
+                            enabled=learning_config.get("profile_training", False))
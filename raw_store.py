@@ -0,0 +1,269 @@
+'''
+Memory mapped store of the raw simulation results: the voltages of the terminals of every raw result file (simulation
+run) are converted once into a .npy array [time steps, terminals] next to a manifest (raw_store.json) holding the
+terminals and their labels per run. Samples are then not copied into dataset files anymore but described by an index of
+(run, terminal, offset, label) rows and sliced from the memory mapped arrays when they are accessed (see
+HDF5Dataset.VirtualWindowDataset), so windows at arbitrary (also overlapping) offsets cost nothing but an index entry.
+
+    store = build_raw_store()
+    index = window_index(store, config.sample_length, stride=config.sample_length)
+    train_index, test_index = split_index(index, 0.2)
+'''
+import os
+import json
+import numpy as np
+import pandas as pd
+
+from experiment_config import config
+
+MANIFEST = 'raw_store.json'
+METAINFO = ('metainfo', 'in the first', 'few indices')
+RAW_READERS = {}
+
+
+def register_raw_reader(extension, read_columns, read):
+    '''
+    registers a format of raw result files by file extension: read_columns(path) returns the columns (3 level tuples
+    like in the CSV header), read(path, columns=None, rows=None) the given columns of the given rows (all if None) as a
+    DataFrame indexed by the row numbers
+    '''
+    RAW_READERS[extension] = {'columns': read_columns, 'read': read}
+
+
+def read_csv_columns(path):
+    return list(pd.read_csv(path, header=[0, 1, 2], sep=';', nrows=0).columns)
+
+
+def read_csv(path, columns=None, rows=None):
+    '''
+    only the given columns (usecols) of the given rows (all other lines are skipped by the parser, which stops after the
+    last row needed) are parsed; the header is read separately as usecols can't be combined with a 3 line header
+    '''
+    header = read_csv_columns(path)
+    usecols = list(range(len(header))) if columns is None else sorted(header.index(column) for column in columns)
+    if rows is None:
+        df = pd.read_csv(path, header=None, skiprows=3, sep=';', usecols=usecols, low_memory=False)
+    else:
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        needed = rows + 3                                                   # 3 header lines
+        skip = np.setdiff1d(np.arange(needed[-1] + 1 if len(rows) else 3), needed)
+        df = pd.read_csv(path, header=None, skiprows=skip, nrows=len(rows), sep=';', usecols=usecols, low_memory=False)
+        df.index = rows
+    df.columns = pd.MultiIndex.from_tuples([header[i] for i in usecols])
+    return df
+
+
+def read_hdf5_columns(path):
+    import h5py
+    with h5py.File(path, 'r') as hdf:
+        return [tuple(column) for column in json.loads(hdf['values'].attrs['columns'])] + [METAINFO]
+
+
+def read_hdf5(path, columns=None, rows=None):
+    '''
+    raw results saved with save_raw_results_hdf5: the values are chunked by column, so only the chunks of the columns
+    asked for are read
+    '''
+    import h5py
+    all_columns = read_hdf5_columns(path)
+    columns = all_columns if columns is None else list(columns)
+    with h5py.File(path, 'r') as hdf:
+        values = hdf['values']
+        data = {}
+        for column in columns:
+            if column == METAINFO:
+                # strings come back as bytes with h5py 3 (asstr is not there in h5py 2.10), as str with h5py 2
+                data[column] = [s.decode() if isinstance(s, bytes) else s for s in hdf['metainfo'][:]]
+            else:
+                data[column] = values[:, all_columns.index(column)]
+    df = pd.DataFrame(data)
+    df.columns = pd.MultiIndex.from_tuples(columns)
+    if rows is not None:
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        df = df.iloc[rows]
+    return df
+
+
+def save_raw_results_hdf5(df, path):
+    '''
+    binary alternative to the raw result CSV files: all values in one float array chunked by column, the metainfo as
+    strings
+    '''
+    import h5py
+    columns = [column for column in df.columns if column != METAINFO and not is_index_column(column)]
+    with h5py.File(path, 'w') as hdf:
+        values = df[columns].to_numpy(dtype=np.float64)
+        dset = hdf.create_dataset('values', data=values, chunks=(min(len(values), 1 << 14), 1), compression='gzip')
+        dset.attrs['columns'] = json.dumps([list(column) for column in columns])
+        hdf.create_dataset('metainfo', data=df[METAINFO].fillna('').astype(str).tolist(), dtype=h5py.string_dtype())
+
+
+register_raw_reader('.csv', read_csv_columns, read_csv)
+register_raw_reader('.hdf5', read_hdf5_columns, read_hdf5)
+
+
+def raw_reader(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in RAW_READERS:
+        print('No reader for raw results of type %s (%s)' % (extension, path))
+        return None
+    return RAW_READERS[extension]
+
+
+def is_index_column(column):
+    return str(column[0]).startswith('Unnamed')               # time index written along with the CSV
+
+
+def read_metainfo(path):
+    reader = raw_reader(path)
+    if reader is None:
+        return None
+    return reader['read'](path, [METAINFO])[METAINFO]
+
+
+def read_raw_results(path, terminals=None, rows=None, just_voltages=True, metainfo=None):
+    '''
+    reads the metainfo and, of the given terminals (all if None), only the voltages (or all their variables unless
+    just_voltages) in the given rows; the result has all rows of the file, the rows not read are empty (NaN), so that
+    windows are cut from it as from the whole file
+    '''
+    reader = raw_reader(path)
+    if reader is None:
+        return None
+    if metainfo is None:
+        metainfo = read_metainfo(path)
+    columns = [column for column in reader['columns'](path) if column != METAINFO and not is_index_column(column)]
+    if terminals is not None:
+        columns = [column for column in columns if column[0] in terminals]
+    if just_voltages:
+        columns = [column for column in columns if column[1:] == ('ElmTerm', 'm:u')]
+    df = reader['read'](path, columns, rows)
+    if rows is not None:
+        df = df.reindex(range(len(metainfo)))
+    df[METAINFO] = metainfo.values
+    return df
+
+
+def raw_results_folder():
+    return os.path.join(config.results_folder, config.raw_data_set_name + '_raw_data')
+
+
+def store_folder():
+    return os.path.join(config.results_folder, config.raw_data_set_name + '_raw_store')
+
+
+def labelled_terminals(metainfo):
+    '''
+    terminals of a run that samples are taken from and the ones among them that make up the positive class, read from
+    the metainfo column of a raw result (same rows as in create_instances)
+    '''
+    rows = (3, 4) if config.raw_data_set_name == 'dummy' else (5, 6)
+    positive = [i for i in str(metainfo.iloc[rows[0]]).split("'") if 'Bus' in i]
+    terminals = [i for i in str(metainfo.iloc[rows[1]]).split("'") if 'Bus' in i]
+    return terminals, positive
+
+
+def build_raw_store(folder=None, results_folder=None):
+    '''
+    converts the raw results (the first simruns files of every grid) that are not in the store yet; runs with the same
+    combination of terminals and positive terminals as an earlier run of the grid are skipped as in create_dataset.
+    Returns the manifest.
+    '''
+    folder = folder or store_folder()
+    results_folder = results_folder or raw_results_folder()
+    os.makedirs(folder, exist_ok=True)
+    manifest = load_manifest(folder) or {'dataset': config.raw_data_set_name, 'runs': []}
+    known = {(run['grid'], run['file']) for run in manifest['runs']}
+
+    for grid in sorted(os.listdir(results_folder)):
+        if not os.path.isdir(os.path.join(results_folder, grid)):
+            continue
+        combinations = [(set(run['terminals']), set(run['positive'])) for run in manifest['runs'] if run['grid'] == grid]
+        for file in os.listdir(os.path.join(results_folder, grid))[0:int(config.simruns)]:
+            if (grid, file) in known:
+                continue
+            path = os.path.join(results_folder, grid, file)
+            metainfo = read_metainfo(path)
+            if metainfo is None:
+                continue
+            terminals, positive = labelled_terminals(metainfo)
+            if (set(terminals), set(positive)) in combinations:
+                continue
+            combinations.append((set(terminals), set(positive)))
+            df = read_raw_results(path, terminals, metainfo=metainfo)           # only the voltages of these terminals
+
+            voltages = np.stack([df[(term, 'ElmTerm', 'm:u')].values for term in terminals], axis=1).astype(np.float32)
+            array = '%s_%s.npy' % (grid, os.path.splitext(file)[0].replace('#', '_'))
+            np.save(os.path.join(folder, array), voltages)
+            manifest['runs'].append({'grid': grid, 'file': file, 'array': array, 'length': len(voltages),
+                                     'terminals': terminals, 'positive': positive,
+                                     'labels': [int(term in positive) for term in terminals]})
+            print('Raw results %s of grid %s added to the raw store' % (file, grid))
+
+    with open(os.path.join(folder, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    manifest['folder'] = folder
+    return manifest
+
+
+def load_manifest(folder=None):
+    folder = folder or store_folder()
+    if not os.path.exists(os.path.join(folder, MANIFEST)):
+        return None
+    with open(os.path.join(folder, MANIFEST)) as f:
+        manifest = json.load(f)
+    manifest['folder'] = folder
+    return manifest
+
+
+def window_index(manifest, sample_length, stride=None, number_of_samples=None, share_of_positive_samples=None, seed=0,
+                 near_duplicates=None, batch_size=10000):
+    '''
+    index of windows [samples, 4] with the columns run, terminal, offset and label: windows start every stride steps
+    (sample_length, i.e. non overlapping windows like in create_instances, if None); near duplicates of windows before
+    them are removed if a dedup.NearDuplicateIndex is given; with number_of_samples, that many windows are drawn at
+    random with the given share of positive samples
+    '''
+    stride = stride or sample_length
+    blocks = []
+    for run, entry in enumerate(manifest['runs']):
+        offsets = np.arange(0, entry['length'] - sample_length + 1, stride)
+        terminals = np.arange(len(entry['terminals']))
+        terminal, offset = [a.ravel() for a in np.meshgrid(terminals, offsets, indexing='ij')]
+        labels = np.asarray(entry['labels'], dtype=np.int64)[terminal]
+        blocks.append(np.stack([np.full(len(terminal), run), terminal, offset, labels], axis=1))
+    index = np.concatenate(blocks).astype(np.int64) if blocks else np.zeros((0, 4), dtype=np.int64)
+
+    if near_duplicates is not None:
+        from HDF5Dataset import VirtualWindowDataset
+        candidates = VirtualWindowDataset(manifest, index, sample_length,
+                                          constant_negatives=config.raw_data_set_name == 'dummy')
+        keep = np.concatenate([near_duplicates.add(candidates.windows(np.arange(start, min(start + batch_size, len(index)))),
+                                                   index[start:start + batch_size, 3])
+                               for start in range(0, len(index), batch_size)] or [np.zeros(0, dtype=bool)])
+        index = index[keep]
+
+    if number_of_samples is not None:
+        rng = np.random.default_rng(seed)
+        share = 0.5 if share_of_positive_samples is None else share_of_positive_samples
+        positives, negatives = np.flatnonzero(index[:, 3] == 1), np.flatnonzero(index[:, 3] == 0)
+        number_of_positives = min(int(round(number_of_samples * share)), len(positives))
+        number_of_negatives = min(number_of_samples - number_of_positives, len(negatives))
+        if number_of_positives + number_of_negatives < number_of_samples:
+            print('Only %d of %d samples available in the raw store' % (number_of_positives + number_of_negatives,
+                                                                        number_of_samples))
+        chosen = np.concatenate([rng.choice(positives, number_of_positives, replace=False),
+                                 rng.choice(negatives, number_of_negatives, replace=False)])
+        index = index[np.sort(chosen)]
+    return index
+
+
+def split_index(index, train_test_split, seed=0):
+    '''
+    random split of an index into training and test windows; train_test_split is the number (int) or share (float) of
+    test samples like in the experiment configs
+    '''
+    share = train_test_split / len(index) if isinstance(train_test_split, int) else train_test_split
+    order = np.random.default_rng(seed).permutation(len(index))
+    number_of_test_samples = int(round(len(index) * share))
+    return index[np.sort(order[number_of_test_samples:])], index[np.sort(order[:number_of_test_samples])]
@@ -0,0 +1,74 @@
+'''
+Coarser time resolutions of the samples to trade accuracy for speed: the recurrent models cost linearly and the
+attention blocks of the transformers quadratically in the number of time steps, so every halving of the resolution
+(15 min, 30 min, 1 h, ...) saves at least half of the time per sample. Every period of factor steps is reduced to its
+mean, min and max (so that short spikes within the period are not averaged away), which are fed to the models as
+channels (input_size 3 instead of 1, see input_channels). The reduction is a transform of the batches coming out of a
+data loader, so the saved datasets stay at full resolution and every resolution can be trained from them.
+
+    loader = ResolutionLoader(load_data('train'), factor=4)     # hourly samples [batch, steps / 4, 3]
+    levels = resolution_pyramid(x, factors=(1, 2, 4))           # 15 min, 30 min and 1 h
+'''
+import torch
+
+CHANNELS = ('mean', 'min', 'max')
+
+
+def downsample(x, factor):
+    '''
+    samples [batch, steps(, 1)] reduced to [batch, steps / factor, 3] with the mean, min and max of every period of
+    factor steps (incomplete periods at the end are dropped); factor 1 leaves the samples as they are
+    '''
+    if factor == 1:
+        return x
+    x = x.reshape(x.size(0), -1)
+    steps = x.size(1) // factor
+    periods = x[:, :steps * factor].reshape(x.size(0), steps, factor)
+    return torch.stack([periods.mean(dim=-1), periods.min(dim=-1)[0], periods.max(dim=-1)[0]], dim=-1)
+
+
+def resolution_pyramid(x, factors=(1, 2, 4)):
+    '''
+    the samples at every resolution of the pyramid, by factor
+    '''
+    return {factor: downsample(x, factor) for factor in factors}
+
+
+def input_channels(factor):
+    return 1 if factor == 1 else len(CHANNELS)
+
+
+class ResolutionLoader:
+    '''
+    data loader yielding the batches of the loader it wraps at a coarser resolution: the preprocessed and the raw
+    samples are downsampled, the lengths of padded batches of samples of different lengths are cut to the complete
+    periods
+    '''
+
+    def __init__(self, loader, factor):
+        self.loader = loader
+        self.dataset = loader.dataset
+        self.factor = factor
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        for batch in self.loader:
+            yield self.downsample(*batch)
+
+    def downsample(self, data, labels, data_raw, lengths=None):
+        batch = (downsample(data, self.factor), labels, downsample(data_raw, self.factor))
+        return batch if lengths is None else batch + (torch.div(lengths, self.factor, rounding_mode='floor'),)
+
+
+def resolution(learning_config):
+    '''
+    number of time steps of the datasets per time step of the samples fed to the models
+    '''
+    return int(learning_config.get("resolution", 1) or 1)
+
+
+def resolution_loader(loader, learning_config):
+    factor = resolution(learning_config)
+    return loader if factor == 1 else ResolutionLoader(loader, factor)
@@ -0,0 +1,200 @@
+'''
+Datasets that fit into memory are loaded as a whole instead of sample by sample through HDF5Dataset: the preprocessed
+samples and the labels (and the raw samples, only needed for plotting) of a dataset file are copied once into one block
+of shared memory, batches are sliced from it along a permutation drawn per epoch. The block is named after the dataset
+file, so other processes on the same machine (e.g. experiments running side by side on the same dataset) attach to the
+copy that is already there instead of loading their own; a changed file gets a new block. A block left unfilled by a
+process that ended while filling it (e.g. killed) is removed and created again by the next process asking for it.
+
+    loader = SharedTensorLoader(dataset_file('train'), 'train', batch_size=60, shuffle=True)
+    for samples, labels, raw_samples in loader:
+        ...
+'''
+import os
+import time
+import atexit
+import hashlib
+import numpy as np
+import torch
+from torch.utils import data
+from multiprocessing import shared_memory
+
+from codec import read_raw
+
+HEADER = 64                             # bytes in front of the tensors: state (set once they are filled), creator pid
+READY = 1
+ABANDONED = -1                          # creator pid of a block whose creator failed to fill it
+
+
+def block_name(file, with_raw):
+    stat = os.stat(file)
+    key = '%s|%d|%d|%d' % (os.path.abspath(file), stat.st_size, stat.st_mtime_ns, with_raw)
+    return 'lvgrid_' + hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+def attach(name):
+    '''
+    attaches to an existing block of shared memory; only the process that created it removes it when it ends
+    '''
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(block._name, 'shared_memory')
+    except (ImportError, AttributeError, KeyError):
+        pass
+    return block
+
+
+def process_alive(pid):
+    if os.name == 'nt':
+        try:
+            import psutil
+            return psutil.pid_exists(pid)
+        except ImportError:
+            return True                                 # os.kill would end the process on Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass                                            # alive, but of another user
+    return True
+
+
+def unlink_stale(name, pid):
+    '''
+    removes the block if it is still the unfilled one of the given (ended) process, not one created again meanwhile
+    '''
+    try:
+        block = attach(name)
+    except FileNotFoundError:
+        return
+    header = np.ndarray((2,), dtype=np.int64, buffer=block.buf)
+    stale = header[0] != READY and header[1] == pid
+    del header
+    block.close()
+    if stale:
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.register(block._name, 'shared_memory')      # unlink unregisters it again
+        except (ImportError, AttributeError):
+            pass
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def aligned(size):
+    return (size + 63) // 64 * 64
+
+
+class SharedTensors:
+    '''
+    samples [samples, steps(, features)], labels [samples, 1] and (with_raw) raw samples of a dataset file as tensors in
+    one block of shared memory, created and filled by the first process asking for them
+    '''
+
+    def __init__(self, file, type, with_raw=False, timeout=600):
+        import h5py
+        with h5py.File(file, 'r') as hdf:
+            shape = hdf['x_' + type].shape
+        fields = [('x', shape, torch.float32), ('y', (shape[0], 1), torch.int64)]
+        if with_raw:
+            fields.append(('x_raw', shape, torch.float32))
+        offsets, size = {}, HEADER
+        for name, field_shape, dtype in fields:
+            offsets[name] = size
+            size += aligned(int(np.prod(field_shape)) * torch.empty(0, dtype=dtype).element_size())
+
+        self.name = block_name(file, with_raw)
+        while True:
+            try:
+                self.block = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+                created = True
+            except FileExistsError:
+                self.block = attach(self.name)
+                created = False
+
+            self.tensors = {name: torch.frombuffer(self.block.buf, dtype=dtype, count=int(np.prod(field_shape)),
+                                                   offset=offsets[name]).view(field_shape)
+                            for name, field_shape, dtype in fields}
+            header = np.ndarray((2,), dtype=np.int64, buffer=self.block.buf)
+            if created:
+                header[1] = os.getpid()
+                try:
+                    self.fill(file, type)
+                except BaseException:
+                    header[1] = ABANDONED               # processes waiting for it create it again
+                    self.unlink()
+                    raise
+                header[0] = READY
+                atexit.register(self.unlink)            # processes attached keep their copy, new ones create a new block
+                print('Dataset %s (%s) loaded into shared memory %s' % (file, type, self.name))
+                return
+
+            waited = time.time()
+            while header[0] != READY and (header[1] == 0 or header[1] > 0 and process_alive(int(header[1]))):
+                if time.time() - waited > timeout:
+                    raise TimeoutError('Shared memory %s was not filled within %d s' % (self.name, timeout))
+                time.sleep(0.1)
+            if header[0] == READY:
+                print('Dataset %s (%s) attached from shared memory %s' % (file, type, self.name))
+                return
+            creator = int(header[1])
+            print('Shared memory %s was left unfilled%s, it is created again' % (
+                self.name, '' if creator == ABANDONED else ' by process %d' % creator))
+            del header
+            self.tensors = None                         # views of the block have to be released before it is closed
+            self.block.close()
+            unlink_stale(self.name, creator)
+
+    def unlink(self):
+        try:
+            self.block.unlink()
+        except FileNotFoundError:
+            pass
+
+    def fill(self, file, type, chunk_samples=10000):
+        import h5py
+        with h5py.File(file, 'r') as hdf:
+            for start in range(0, len(self.tensors['x']), chunk_samples):
+                rows = slice(start, start + chunk_samples)
+                self.tensors['x'][rows] = torch.from_numpy(hdf['x_' + type][rows].astype(np.float32))
+                self.tensors['y'][rows] = torch.from_numpy(hdf['y_' + type][rows].astype(np.int64).reshape(-1, 1))
+                if 'x_raw' in self.tensors:
+                    self.tensors['x_raw'][rows] = torch.from_numpy(read_raw(hdf, 'x_raw_' + type, rows).astype(np.float32))
+
+
+class SharedTensorLoader:
+    '''
+    loader over the shared tensors of a dataset file: every epoch (every iteration over the loader) the samples are
+    shuffled with a permutation and batches are sliced from the tensors; yields (samples, labels, raw samples) like
+    the loaders over HDF5Dataset, the preprocessed samples stand in for the raw ones unless they are loaded (with_raw)
+    '''
+
+    def __init__(self, file, type, batch_size, shuffle=False, with_raw=False, seed=None):
+        self.shared = SharedTensors(file, type, with_raw)
+        tensors = self.shared.tensors
+        self.dataset = data.TensorDataset(tensors['x'], tensors['y'], tensors.get('x_raw', tensors['x']))
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.generator = torch.Generator()
+        if seed is None:
+            self.generator.seed()
+        else:
+            self.generator.manual_seed(seed)
+
+    def __len__(self):
+        return (len(self.dataset) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        x, y, x_raw = self.dataset.tensors
+        if self.shuffle:
+            order = torch.randperm(len(x), generator=self.generator)
+            for start in range(0, len(x), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                yield x[batch], y[batch], x_raw[batch]
+        else:
+            for start in range(0, len(x), self.batch_size):
+                yield x[start:start + self.batch_size], y[start:start + self.batch_size], x_raw[start:start + self.batch_size]
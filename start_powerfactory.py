@@ -1,10 +1,6 @@
 import pflib.pf as pf
 import os
-import importlib
-from experiment_config import experiment_path, chosen_experiment
-spec = importlib.util.spec_from_file_location(chosen_experiment, experiment_path)
-config = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(config)
+from experiment_config import config
 
 def set_load_flow_settings(ldf_com_obj, load_scaling, generation_scaling):
 
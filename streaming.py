@@ -0,0 +1,274 @@
+'''
+Streaming detection on continuous smart meter voltage feeds: instead of scoring a complete window of readings, the
+hidden state of a recurrent classifier (RNN, LSTM or GRU) is kept per meter and advanced by one step for every new
+reading, so each reading costs one step of the recurrence no matter how long the feed has been running. The states of
+all meters live as rows of preallocated tensors (HiddenStateStore), so the readings of thousands of meters are scored
+in a single call, and they can be snapshotted so that a restart does not lose the warm-up of the recurrences.
+
+    from streaming import streaming_detector
+    detector = streaming_detector(learning_config)
+    probs = detector.update(['meter 1', 'meter 2'], [1.012, 0.998])        # [meters, classes]
+    detector.save('states')                                                 # states.npy and states.json
+
+The recurrence runs along the time axis of the feed like the variable length path (forward_packed) of the models, so it
+matches classifiers trained on length bucketed datasets (see util.combine_datasets).
+'''
+import os
+import json
+import collections
+import numpy as np
+import torch
+from torch import nn
+
+
+class HiddenStateStore:
+    '''
+    per meter states as rows of preallocated tensors (one per field, e.g. hidden and cell state): meter ids are mapped
+    to rows, when all rows are taken the least recently used meter is evicted, and the rows in use can be snapshotted to
+    an .npy file (along with a .json file holding the meter ids and the fields) and restored from it
+    '''
+
+    def __init__(self, fields, capacity=4096, device=None):
+        self.fields = {name: (tuple(shape), torch.empty(0, dtype=dtype).dtype) for name, (shape, dtype) in fields.items()}
+        self.capacity = capacity
+        self.device = device if device is not None else torch.device('cpu')
+        self.tensors = {name: torch.zeros((capacity,) + shape, dtype=dtype, device=self.device)
+                        for name, (shape, dtype) in self.fields.items()}
+        self.meters = collections.OrderedDict()         # meter id -> row, least recently used first
+        self.free = list(range(capacity - 1, -1, -1))
+        self.evictions = 0
+
+    @classmethod
+    def for_model(cls, model, capacity=4096, extra=None):
+        '''
+        store for the states of a recurrent model, shaped like the initial states of its init_hidden (hidden and, for
+        LSTMs, cell state); extra fields can be added as {name: (shape, dtype)}
+        '''
+        initial = model.init_hidden(1)
+        initial = initial if isinstance(initial, tuple) else (initial,)
+        fields = {name: ((state.size(0), state.size(2)), state.dtype) for name, state in zip(['hidden', 'cell'], initial)}
+        fields.update(extra or {})
+        return cls(fields, capacity, initial[0].device)
+
+    def rows(self, meter_ids, register=True):
+        '''
+        rows of the given meters; unknown meters get a zeroed row, evicting the least recently used meters if needed. A
+        meter can only be given once, its states would be advanced from the same row twice and one update would be lost
+        '''
+        if len(set(meter_ids)) != len(meter_ids):
+            duplicates = [meter for meter, count in collections.Counter(meter_ids).items() if count > 1]
+            raise ValueError('Meters given more than once: %s' % ', '.join(map(str, duplicates)))
+        rows = []
+        for meter in meter_ids:
+            if meter in self.meters:
+                self.meters.move_to_end(meter)
+            elif not register:
+                raise KeyError(meter)
+            else:
+                if not self.free:
+                    evicted, row = self.meters.popitem(last=False)
+                    if evicted in meter_ids:
+                        raise ValueError('More meters in one batch than the store holds (%d)' % self.capacity)
+                    self.evictions += 1
+                    self._zero(torch.as_tensor([row], device=self.device))
+                    self.free.append(row)
+                self.meters[meter] = self.free.pop()
+            rows.append(self.meters[meter])
+        return torch.as_tensor(rows, dtype=torch.long, device=self.device)
+
+    def gather(self, rows):
+        return {name: tensor[rows] for name, tensor in self.tensors.items()}
+
+    def scatter(self, rows, values):
+        for name, value in values.items():
+            self.tensors[name][rows] = value
+
+    def _zero(self, rows):
+        if len(rows):
+            for tensor in self.tensors.values():
+                tensor[rows] = 0
+
+    def reset(self, meter_ids=None):
+        '''
+        zeroes the states of the given meters (all if None)
+        '''
+        meter_ids = list(self.meters) if meter_ids is None else [m for m in meter_ids if m in self.meters]
+        self._zero(torch.as_tensor([self.meters[m] for m in meter_ids], dtype=torch.long, device=self.device))
+
+    def remove(self, meter_ids):
+        for meter in meter_ids:
+            if meter in self.meters:
+                row = self.meters.pop(meter)
+                self._zero(torch.as_tensor([row], device=self.device))
+                self.free.append(row)
+
+    def save(self, file):
+        '''
+        writes the states of the meters in the store to <file>.npy (one row per meter, least recently used first, all
+        fields flattened side by side) and the meter ids and fields to <file>.json
+        '''
+        file = file[:-4] if file.endswith('.npy') else file
+        rows = torch.as_tensor(list(self.meters.values()), dtype=torch.long, device=self.device)
+        columns = [self.tensors[name][rows].reshape(len(rows), -1).double().cpu().numpy() for name in self.fields]
+        np.save(file + '.npy', np.concatenate(columns, axis=1) if columns else np.zeros((len(rows), 0)))
+        with open(file + '.json', 'w') as f:
+            json.dump({'meters': list(self.meters), 'evictions': self.evictions,
+                       'fields': {name: [list(shape), str(dtype).replace('torch.', '')]
+                                  for name, (shape, dtype) in self.fields.items()}}, f)
+
+    def restore(self, file):
+        '''
+        loads a snapshot written by save into the store (replacing its content); returns the number of meters restored
+        or None if the snapshot does not fit the store
+        '''
+        file = file[:-4] if file.endswith('.npy') else file
+        with open(file + '.json') as f:
+            meta = json.load(f)
+        fields = {name: (tuple(shape), getattr(torch, dtype)) for name, (shape, dtype) in meta['fields'].items()}
+        if fields != self.fields:
+            print('Snapshot %s holds other states (%s) than the store (%s)' % (file, meta['fields'], self.fields))
+            return None
+        meters = [tuple(m) if isinstance(m, list) else m for m in meta['meters']]      # JSON turns tuples into lists
+        if len(meters) > self.capacity:
+            print('Snapshot %s holds %d meters, only the %d most recently used are restored' % (file, len(meters),
+                                                                                              self.capacity))
+        data = np.load(file + '.npy')[len(meters) - min(len(meters), self.capacity):]
+        meters = meters[len(meters) - len(data):]
+
+        self.reset()
+        self.meters = collections.OrderedDict()
+        self.free = list(range(self.capacity - 1, -1, -1))
+        rows = self.rows(meters)
+        start = 0
+        for name, (shape, dtype) in self.fields.items():
+            size = int(np.prod(shape))
+            values = torch.as_tensor(data[:, start:start + size]).view((len(meters),) + shape)
+            self.tensors[name][rows] = values.to(dtype=dtype, device=self.device)
+            start += size
+        self.evictions = meta.get('evictions', 0)
+        return len(meters)
+
+    def __len__(self):
+        return len(self.meters)
+
+    def __contains__(self, meter):
+        return meter in self.meters
+
+
+class StreamingDetector:
+    '''
+    per meter hidden states of a recurrent classifier, advanced reading by reading; readings are preprocessed like the
+    training samples as far as that is possible causally: the running mean of the readings of the current window is
+    deducted and the result is scaled with the max abs value of the time step (steps beyond the fitted ones are not
+    scaled). With a window, the state of a meter is reset after that many readings (e.g. the sample length the model
+    was trained on), otherwise it is carried on indefinitely. Up to capacity meters are held, beyond that the least
+    recently updated ones are evicted (and start over when they report again).
+    '''
+
+    def __init__(self, model, max_abs=None, window=None, capacity=4096):
+        self.recurrent = next((m for m in model.children() if isinstance(m, nn.RNNBase)), None)
+        if self.recurrent is None:
+            raise TypeError('Streaming detection needs a recurrent classifier (RNN, LSTM or GRU)')
+        self.model = model.eval()
+        self.fc = model._fc
+        self.window = window
+        input_size = self.recurrent.input_size
+        self.store = HiddenStateStore.for_model(model, capacity, extra={'steps': ((), torch.long),
+                                                                        'sums': ((input_size,), torch.float64)})
+        self.device = self.store.device
+
+        scale = torch.as_tensor(np.array([] if max_abs is None else max_abs), dtype=torch.float32).view(-1)
+        scale[scale == 0] = 1                       # like the MaxAbsScaler: features that are always zero are not scaled
+        self.scale = torch.cat([scale, torch.ones(1)]).to(self.device)        # last entry for steps beyond the fitted ones
+
+    def update(self, meter_ids, readings):
+        '''
+        advances the given meters by one reading each (one reading per meter and call) and returns the class
+        probabilities after it [meters, classes]
+        '''
+        rows = self.store.rows(meter_ids)
+        x = torch.as_tensor(np.ascontiguousarray(readings), dtype=torch.float32, device=self.device).view(len(rows), -1)
+
+        if self.window:
+            self.store._zero(rows[self.store.tensors['steps'][rows] >= self.window])
+        state = self.store.gather(rows)
+
+        sums = state['sums'] + x.double()
+        mean = (sums / (state['steps'] + 1).unsqueeze(-1)).float()
+        scale = self.scale[torch.clamp(state['steps'], max=len(self.scale) - 1)].unsqueeze(-1)
+        x = ((x - mean) / scale).view(1, len(rows), -1)
+
+        with torch.no_grad():
+            hidden = state['hidden'].transpose(0, 1).contiguous()        # rows are meters, the recurrence wants layers first
+            if 'cell' in state:
+                out, (hidden, cell) = self.recurrent(x, (hidden, state['cell'].transpose(0, 1).contiguous()))
+                state['cell'] = cell.transpose(0, 1)
+            else:
+                out, hidden = self.recurrent(x, hidden)
+            probs = torch.softmax(self.fc(out[0]), dim=-1)
+
+        state['hidden'] = hidden.transpose(0, 1)
+        state['steps'] = state['steps'] + 1
+        state['sums'] = sums
+        self.store.scatter(rows, state)
+        return probs.cpu().numpy()
+
+    def replay(self, meter_ids, readings):
+        '''
+        feeds a block of readings per meter [meters, steps] (e.g. to catch up after a gap) and returns the probabilities
+        after every step [meters, steps, classes]
+        '''
+        readings = np.asarray(readings)
+        return np.stack([self.update(meter_ids, readings[:, step]) for step in range(readings.shape[1])], axis=1)
+
+    def reset(self, meter_ids=None):
+        '''
+        starts the given meters (all if None) over with a fresh state, e.g. after a change in the grid
+        '''
+        self.store.reset(meter_ids)
+
+    def remove(self, meter_ids):
+        self.store.remove(meter_ids)
+
+    def save(self, file):
+        self.store.save(file)
+
+    def restore(self, file):
+        return self.store.restore(file)
+
+    def __len__(self):
+        return len(self.store)
+
+    def __contains__(self, meter):
+        return meter in self.store
+
+
+def streaming_detector(learning_config, window=None, capacity=4096, snapshot=None):
+    '''
+    streaming detector with the saved model of the learning config and the max abs values of its training set; the
+    window defaults to the sample length, the states of a snapshot (see StreamingDetector.save) are restored if it
+    exists. Only models trained on the variable length path qualify: a fresh model has learned nothing and the
+    fixed length path of the models runs the recurrence over the samples of a batch instead of over time
+    '''
+    if learning_config['classifier'] not in ['RNN', 'LSTM', 'GRU']:
+        print('Streaming detection needs a recurrent classifier (RNN, LSTM or GRU)!')
+        return None
+
+    from experiment_config import config
+    from util import load_model, load_max_abs
+    loaded = load_model(learning_config)
+    if loaded is None:
+        return None
+    model, epoch, loss = loaded
+    if epoch is None:
+        print('Streaming detection needs a trained model, none was loaded!')
+        return None
+    if not model.variable_length:
+        print('Streaming detection needs a model trained on samples of different lengths (padded batches), the saved '
+              'model was trained on samples of fixed length!')
+        return None
+    window = config.sample_length if window is None else window
+    detector = StreamingDetector(model, load_max_abs(), window=window, capacity=capacity)
+    if snapshot is not None and os.path.exists(snapshot[:-4] + '.json' if snapshot.endswith('.npy') else snapshot + '.json'):
+        print('%s meter states restored' % detector.restore(snapshot))
+    return detector
@@ -0,0 +1,34 @@
+import numpy as np
+
+from codec import encode, decode, error_bound
+
+
+def test_round_trip_error_bound():
+    '''
+    Tests if voltages decoded from the int16 codec (offset and delta mode) are within the error bound of the originals
+    '''
+    rng = np.random.default_rng(0)
+    x_raw = (1 + 0.05 * rng.standard_normal((200, 672))).astype(np.float32)
+
+    for scale in [1e-5, 1e-4]:
+        for mode in ['offset', 'delta']:
+            q, base = encode(x_raw, scale, mode)
+            decoded = decode(q, base, scale, mode)
+
+            assert q.dtype == np.int16
+            assert decoded.shape == x_raw.shape
+            assert np.abs(decoded - x_raw).max() <= error_bound(scale, np.abs(x_raw).max())
+
+
+def test_modes_and_single_samples():
+    '''
+    Tests if both modes decode to the same values, also for single samples and samples with more than one feature
+    '''
+    rng = np.random.default_rng(1)
+    x_raw = (1 + 0.05 * rng.standard_normal((10, 96, 2))).astype(np.float32)
+
+    offsets, base = encode(x_raw, mode='offset')
+    deltas, _ = encode(x_raw, mode='delta')
+
+    assert np.array_equal(decode(offsets, base), decode(deltas, base, mode='delta'))
+    assert np.array_equal(decode(deltas[3], base[3], mode='delta', axis=0), decode(offsets, base)[3])
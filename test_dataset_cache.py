@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from dataset_cache import dataset_key, data_parameters, raw_run_manifest, use_dataset_cache, save_cache_entry
+from experiment_config import config, learning_config
+
+
+@pytest.fixture
+def raw_results(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'results_folder', str(tmp_path) + os.sep)
+    monkeypatch.setattr(config, 'raw_data_set_name', 'raw')
+    monkeypatch.setattr(config, 'simruns', 2)
+    monkeypatch.setitem(learning_config, 'dataset', 'cached')
+    folder = tmp_path / 'raw_raw_data'
+    for grid in ['grid1', 'grid2']:
+        os.makedirs(folder / grid)
+        for run in range(3):
+            (folder / grid / ('run%d.csv' % run)).write_bytes(b'metainfo %s %d\n' % (grid.encode(), run) +
+                                                              b'0.99,1.01\n' * 20000)
+    return folder
+
+
+def test_key_stable(raw_results):
+    '''
+    Tests if the key is the same for the same settings and raw results and the files beyond simruns (as taken by
+    create_dataset) are not in it
+    '''
+    runs = raw_run_manifest()
+    assert [run[0] for run in runs] == ['grid1', 'grid1', 'grid2', 'grid2']
+    key = dataset_key()
+    assert dataset_key() == key
+    left_out = set(os.listdir(raw_results / 'grid1')) - {run[1] for run in runs if run[0] == 'grid1'}
+    (raw_results / 'grid1' / left_out.pop()).write_bytes(b'another run')
+    assert dataset_key() == key
+
+
+def test_key_changes(raw_results, monkeypatch):
+    '''
+    Tests if the key changes with any setting the samples depend on and with new or changed raw results, at the
+    beginning or at the end of a file
+    '''
+    keys = {dataset_key()}
+    monkeypatch.setattr(config, 'sample_length', config.sample_length * 2)
+    keys.add(dataset_key())
+    monkeypatch.setitem(learning_config, 'raw codec', 'delta')
+    keys.add(dataset_key())
+    run = raw_results / 'grid2' / raw_run_manifest()[-1][1]
+    content = run.read_bytes()
+    run.write_bytes(content[:-2] + b'2\n')
+    keys.add(dataset_key())
+    run.write_bytes(b'M' + content[1:-2] + b'2\n')
+    keys.add(dataset_key())
+    run.unlink()
+    keys.add(dataset_key())
+    assert len(keys) == 6
+
+    assert dataset_key(data_parameters(), []) != dataset_key(data_parameters(), raw_run_manifest())
+
+
+def test_cache_hit(raw_results):
+    '''
+    Tests if a dataset is found in the cache only after its entry was saved, and no more once the raw results changed
+    '''
+    entry = use_dataset_cache()
+    assert not entry['hit']
+    assert not use_dataset_cache()['hit']
+    save_cache_entry(entry)
+    assert use_dataset_cache()['hit']
+
+    (raw_results / 'grid1' / raw_run_manifest()[0][1]).write_bytes(b'new run')
+    entry = use_dataset_cache()
+    assert not entry['hit']
+    import util
+    assert util.DATASET_FOLDERS['cached'] == entry['folder']
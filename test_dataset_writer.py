@@ -0,0 +1,79 @@
+import h5py
+import numpy as np
+import pytest
+
+from util import DatasetWriter
+
+
+def samples(seed, n, spread):
+    rng = np.random.default_rng(seed)
+    return (1 + spread * rng.standard_normal((n, 96))).astype(np.float32), rng.integers(0, 2, n)
+
+
+def read(file, type):
+    with h5py.File(file, 'r') as hdf:
+        return hdf['x_' + type][:], hdf['x_raw_' + type][:], hdf['y_' + type][:], hdf['max_abs'][:]
+
+
+def test_append_equals_rebuild(tmp_path):
+    '''
+    Tests if appending samples with larger max abs values in two runs (in chunks) gives the dataset written from
+    scratch with all the samples: the preprocessed values of the samples already in the file are rescaled
+    '''
+    first, second = samples(0, 30, 0.01), samples(1, 20, 0.05)
+
+    writer = DatasetWriter(str(tmp_path / 'appended.h5'), 'train', chunk_samples=4)
+    writer.append(*first)
+    writer.close()
+    writer = DatasetWriter(str(tmp_path / 'appended.h5'), 'train', chunk_samples=4, append=True)
+    writer.append(second[0][:7], second[1][:7])
+    writer.append(second[0][7:], second[1][7:])
+    appended_max_abs = writer.close()
+
+    writer = DatasetWriter(str(tmp_path / 'rebuilt.h5'), 'train')
+    writer.append(np.concatenate([first[0], second[0]]), np.concatenate([first[1], second[1]]))
+    rebuilt_max_abs = writer.close()
+
+    appended, rebuilt = read(tmp_path / 'appended.h5', 'train'), read(tmp_path / 'rebuilt.h5', 'train')
+    assert np.array_equal(appended_max_abs, rebuilt_max_abs)
+    assert np.array_equal(appended[1], rebuilt[1]) and np.array_equal(appended[2], rebuilt[2])
+    assert np.array_equal(appended[3], rebuilt[3])
+    np.testing.assert_allclose(appended[0], rebuilt[0], rtol=1e-5, atol=1e-6)
+
+
+def test_test_set_rescaled(tmp_path):
+    '''
+    Tests if the test set is rescaled to the max abs values of the grown training set, also when no test samples are
+    appended
+    '''
+    train, more, test = samples(0, 30, 0.01), samples(1, 20, 0.05), samples(2, 10, 0.01)
+    writer = DatasetWriter(str(tmp_path / 'train.h5'), 'train')
+    writer.append(*train)
+    max_abs = writer.close()
+    writer = DatasetWriter(str(tmp_path / 'test.h5'), 'test', max_abs=max_abs)
+    writer.append(*test)
+    writer.close()
+
+    writer = DatasetWriter(str(tmp_path / 'train.h5'), 'train', append=True)
+    writer.append(*more)
+    max_abs = writer.close()
+    DatasetWriter(str(tmp_path / 'test.h5'), 'test', max_abs=max_abs, append=True).close()
+
+    x, x_raw, y, test_max_abs = read(tmp_path / 'test.h5', 'test')
+    assert np.array_equal(test_max_abs, max_abs)
+    np.testing.assert_allclose(x, (x_raw - x_raw.mean(axis=1, keepdims=True)) / max_abs, rtol=1e-5, atol=1e-6)
+
+
+def test_other_sample_length_refused(tmp_path):
+    '''
+    Tests if samples of another length are not appended
+    '''
+    writer = DatasetWriter(str(tmp_path / 'train.h5'), 'train')
+    writer.append(*samples(0, 10, 0.01))
+    writer.close()
+
+    writer = DatasetWriter(str(tmp_path / 'train.h5'), 'train', append=True)
+    with pytest.raises(ValueError):
+        writer.append(np.ones((5, 48), dtype=np.float32), np.zeros(5))
+    writer.close()
+    assert read(tmp_path / 'train.h5', 'train')[0].shape == (10, 96)
@@ -0,0 +1,69 @@
+import numpy as np
+
+from dedup import NearDuplicateIndex
+
+
+def brute_force_keep(windows, labels, tolerance):
+    '''
+    windows kept when every window is compared to all windows of its class kept before
+    '''
+    windows = windows - windows.mean(axis=1, keepdims=True)
+    kept = []
+    keep = np.zeros(len(windows), dtype=bool)
+    for i, window in enumerate(windows):
+        if not any(labels[j] == labels[i] and np.abs(windows[j] - window).max() <= tolerance for j in kept):
+            keep[i] = True
+            kept.append(i)
+    return keep
+
+
+def synthetic_windows(seed=0, steps=96):
+    '''
+    profiles shared by several runs (near duplicates of each other, also across the classes), distinct windows, flat
+    windows and windows that only differ by an offset
+    '''
+    rng = np.random.default_rng(seed)
+    profiles = 1 + 0.02 * rng.standard_normal((20, steps))
+    windows = [profiles[rng.integers(20)] + 2e-4 * rng.uniform(-1, 1, steps) for _ in range(300)]
+    windows += [1 + 0.02 * rng.standard_normal(steps) for _ in range(100)]
+    windows += [np.full(steps, 1 + rng.uniform(-0.01, 0.01)) for _ in range(20)]
+    windows += [profiles[0] + rng.uniform(-0.01, 0.01) for _ in range(10)]
+    windows = np.array(windows, dtype=np.float32)
+    labels = rng.integers(0, 2, len(windows))
+    order = rng.permutation(len(windows))
+    return windows[order], labels[order]
+
+
+def test_lsh_matches_brute_force():
+    '''
+    Tests if the windows kept by the index (locality sensitive hashing, added in several calls) are the ones kept when
+    comparing every window to all windows kept before
+    '''
+    windows, labels = synthetic_windows()
+    tolerance = 0.001
+    expected = brute_force_keep(windows, labels, tolerance)
+    assert 0 < expected.sum() < len(windows)
+
+    index = NearDuplicateIndex(tolerance)
+    keep = np.concatenate([index.add(windows[i:i + 50], labels[i:i + 50]) for i in range(0, len(windows), 50)])
+
+    assert np.array_equal(keep, expected)
+    report = index.report()
+    assert report['total']['candidates'] == len(windows)
+    assert report['total']['dropped'] == len(windows) - expected.sum()
+    for label in [0, 1]:
+        assert report['per class'][str(label)]['dropped'] == np.sum(~expected & (labels == label))
+
+
+def test_windows_added_one_by_one():
+    '''
+    Tests if adding the windows one at a time keeps the same windows as adding them at once
+    '''
+    windows, labels = synthetic_windows(seed=1)
+    at_once = NearDuplicateIndex(0.001).add(windows, labels)
+
+    index = NearDuplicateIndex(0.001)
+    one_by_one = np.concatenate([index.add(windows[i:i + 1], labels[i:i + 1]) for i in range(len(windows))])
+
+    assert np.array_equal(one_by_one, at_once)
+    assert index.count == at_once.sum() <= len(index.windows)
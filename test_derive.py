@@ -0,0 +1,99 @@
+import h5py
+import numpy as np
+import pytest
+
+import util
+from util import DatasetWriter, derive_samples, derived_slices, derive_dataset, dataset_file
+from experiment_config import learning_config
+
+
+def test_slice_counts():
+    '''
+    Tests if derived_slices gives the number of samples derive_samples cuts from every sample, including slices that
+    end exactly at the last step, strides that do not divide the steps and slices longer than the samples
+    '''
+    rng = np.random.default_rng(0)
+    for steps in [96, 97, 672]:
+        x_raw = rng.standard_normal((3, steps))
+        for aggregate in [None, 1, 4, 5]:
+            for slice_length in [None, 1, 7, 24, 96, 200]:
+                for stride in [None, 1, 5, 24]:
+                    x, y = derive_samples(x_raw, [0, 1, 1], slice_length, stride, aggregate)
+                    assert len(x) == len(y) == 3 * derived_slices(steps, slice_length, stride, aggregate)
+
+
+def test_derived_values():
+    '''
+    Tests if slices and aggregated steps hold the values of the source samples and keep their labels
+    '''
+    x_raw = np.arange(2 * 16, dtype=np.float32).reshape(2, 16)
+    x, y = derive_samples(x_raw, [0, 1], slice_length=4, stride=6)
+    assert np.array_equal(x, [[0, 1, 2, 3], [6, 7, 8, 9], [12, 13, 14, 15], [16, 17, 18, 19], [22, 23, 24, 25],
+                              [28, 29, 30, 31]])
+    assert np.array_equal(y, [0, 0, 0, 1, 1, 1])
+
+    x, y = derive_samples(x_raw, [0, 1], aggregate=5, how='max')
+    assert np.array_equal(x, [[4, 9, 14], [20, 25, 30]])
+    x, y = derive_samples(x_raw[:, :, None], [0, 1], slice_length=2, aggregate=4, how='mean')
+    assert x.shape == (4, 2, 1) and np.array_equal(x[:, :, 0], [[1.5, 5.5], [9.5, 13.5], [17.5, 21.5], [25.5, 29.5]])
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    monkeypatch.setitem(util.DATASET_FOLDERS, 'source', str(tmp_path / 'source'))
+    monkeypatch.setitem(util.DATASET_FOLDERS, 'derived', str(tmp_path / 'derived'))
+    monkeypatch.setitem(learning_config, 'dataset', 'derived')
+    rng = np.random.default_rng(1)
+    samples = {}
+    max_abs = None
+    for type, n in [('train', 40), ('test', 10)]:
+        samples[type] = (1 + 0.01 * rng.standard_normal((n, 96)).astype(np.float32), rng.integers(0, 2, n))
+        writer = DatasetWriter(dataset_file(type, 'source'), type, max_abs=max_abs, chunk_samples=8)
+        writer.append(*samples[type])
+        max_abs = writer.close()
+    return samples
+
+
+def test_derive_dataset(source):
+    '''
+    Tests if a derived dataset holds the slices of the source samples in order, read and written in chunks, scaled with
+    max abs values fitted on the derived training samples
+    '''
+    derive_dataset('source', slice_length=24, stride=12, chunk_samples=7)
+    x_raw, y = source['train']
+    with h5py.File(dataset_file('train'), 'r') as hdf:
+        assert hdf['x_raw_train'].shape == (40 * 7, 24)
+        assert np.array_equal(hdf['x_raw_train'][7 * 3 + 2], x_raw[3, 24:48])
+        assert np.array_equal(hdf['y_train'][:, 0], np.repeat(y, 7))
+        derived = hdf['x_raw_train'][:]
+        zero_meaned = derived - derived.mean(axis=1, keepdims=True)
+        np.testing.assert_allclose(hdf['max_abs'][:], np.abs(zero_meaned).max(axis=0), rtol=1e-6)
+        np.testing.assert_allclose(hdf['x_train'][:], zero_meaned / hdf['max_abs'][:], atol=1e-5)
+    with h5py.File(dataset_file('test'), 'r') as hdf:
+        assert hdf['x_raw_test'].shape == (10 * 7, 24)
+
+
+def test_derive_number_of_samples(source):
+    '''
+    Tests if number_of_samples draws that many derived training samples (and the same share of the test samples), each
+    a slice of a source sample with its label
+    '''
+    derive_dataset('source', slice_length=24, stride=12, number_of_samples=100, chunk_samples=6)
+    x_raw, y = source['train']
+    slices = np.stack([x_raw[:, start:start + 24] for start in range(0, 73, 12)], axis=1)       # [samples, 7, 24]
+    with h5py.File(dataset_file('train'), 'r') as hdf:
+        derived, labels = hdf['x_raw_train'][:], hdf['y_train'][:, 0]
+    assert len(derived) == 100
+    for sample, label in zip(derived, labels):
+        found = np.argwhere(np.all(slices == sample, axis=-1))
+        assert len(found) and y[found[0][0]] == label
+    with h5py.File(dataset_file('test'), 'r') as hdf:
+        assert len(hdf['y_test']) == round(10 * 7 * 100 / 280)
+
+
+def test_slices_longer_than_samples(source):
+    '''
+    Tests if nothing is derived from samples shorter than the slices
+    '''
+    assert derive_dataset('source', slice_length=97) is None
+    assert derive_dataset('source', slice_length=25, aggregate=4) is None
@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+onnx = pytest.importorskip('onnx')
+onnxruntime = pytest.importorskip('onnxruntime')
+
+import util
+from util import build_model, export_model, quantize_model, DatasetWriter, dataset_file
+from experiment_config import config, learning_config
+
+
+@pytest.fixture
+def rnn(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)                         # models are exported to the working directory
+    monkeypatch.setitem(util.DATASET_FOLDERS, 'exported', str(tmp_path))
+    monkeypatch.setitem(learning_config, 'dataset', 'exported')
+    monkeypatch.setitem(learning_config, 'classifier', 'RNN')
+    monkeypatch.setitem(learning_config, 'RNN model settings', [1, 2, 6, 2])
+    torch.manual_seed(0)
+    return build_model(learning_config, torch.device('cpu'))
+
+
+def test_dynamic_sequence(rnn):
+    '''
+    Tests if the graph of an RNN exported with a dynamic sequence dimension takes other batch sizes and sequence lengths
+    than the ones it was traced with and gives the outputs of the model for them
+    '''
+    name = export_model(rnn, learning_config, preprocessing=False, dynamic_sequence=True)
+    assert name == 'exported.onnx'
+    metadata = {prop.key: prop.value for prop in onnx.load(name).metadata_props}
+    assert metadata['input shape'] == '[batch, sequence, 1]'
+
+    session = onnxruntime.InferenceSession(name, providers=['CPUExecutionProvider'])
+    input_name = session.get_inputs()[0].name
+    for batch_size, seq_length in [(5, 40), (2, 3 * config.sample_length), (1, 1)]:
+        x = torch.randn(batch_size, seq_length, 1)
+        with torch.no_grad():
+            expected = rnn(x)[0]
+        output = session.run(None, {input_name: x.numpy()})[0]
+        assert output.shape == tuple(expected.shape)
+        np.testing.assert_allclose(output, expected.numpy(), rtol=1e-3, atol=1e-5)
+
+
+@pytest.mark.parametrize('quantization', ['dynamic', 'static'])
+def test_quantization_gate(rnn, monkeypatch, quantization):
+    '''
+    Tests if the int8 model is kept if its F-score on the test set is within the allowed drop and removed otherwise
+    '''
+    rng = np.random.default_rng(0)
+    writer = DatasetWriter(dataset_file('test'), 'test')
+    writer.append((1 + 0.01 * rng.standard_normal((60, config.sample_length))).astype(np.float32),
+                  rng.integers(0, 2, 60))
+    writer.close()
+    monkeypatch.setitem(learning_config, 'quantization', quantization)
+    monkeypatch.setitem(learning_config, 'quantization calibration samples', 20)
+    export_model(rnn, learning_config, preprocessing=False)
+
+    monkeypatch.setitem(learning_config, 'max F-score drop', 1)
+    assert quantize_model(rnn, learning_config) == 'exported_int8.onnx'
+    assert os.path.isfile('exported_int8.onnx')
+
+    monkeypatch.setitem(learning_config, 'max F-score drop', -1)        # any F-score is a drop of more than -1
+    assert quantize_model(rnn, learning_config) is None
+    assert not os.path.exists('exported_int8.onnx')
+
+
+def test_quantization_without_export(rnn):
+    '''
+    Tests if nothing is quantized before the model is exported
+    '''
+    assert quantize_model(rnn, learning_config) is None
@@ -0,0 +1,46 @@
+import numpy as np
+import torch
+
+from RTransformer import LayerNorm
+
+
+def layer_norms(features):
+    reference = LayerNorm(features, mode='reference')
+    with torch.no_grad():
+        reference.a_2.normal_()
+        reference.b_2.normal_()
+    compat = LayerNorm(features, mode='compat')
+    compat.load_state_dict(reference.state_dict())
+    return reference, compat
+
+
+def test_compat_matches_reference():
+    '''
+    Tests if the fused compat mode of the R-Transformer layer norm gives the results of the reference mode with the
+    same parameters: they differ by at most a relative eps / std (sqrt(var + eps^2) instead of std + eps), so for
+    inputs with a standard deviation far above eps they are the same up to float rounding
+    '''
+    torch.manual_seed(0)
+    for features in [3, 8, 64]:
+        reference, compat = layer_norms(features)
+        x = torch.randn(4, 50, features)
+        with torch.no_grad():
+            np.testing.assert_allclose(compat(x).numpy(), reference(x).numpy(), rtol=1e-4, atol=1e-5)
+
+
+def test_compat_difference_bound():
+    '''
+    Tests if the difference of the compat mode to the reference mode stays within the relative eps / std of every
+    sample, also for inputs of a standard deviation close to eps
+    '''
+    torch.manual_seed(1)
+    for features in [3, 64]:
+        reference, compat = layer_norms(features)
+        for scale in [1e-5, 1e-4, 1e-2, 1, 1e2]:
+            x = scale * (torch.randn(4, 50, features) + 1)
+            with torch.no_grad():
+                expected, result = reference(x).numpy(), compat(x).numpy()
+            normalized = np.abs(expected - reference.b_2.detach().numpy())
+            relative = reference.eps / x.std(-1, keepdim=True).numpy()
+            bound = normalized * (relative + 1e-4) + 1e-5       # plus float32 rounding
+            assert np.all(np.abs(result - expected) <= bound)
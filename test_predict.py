@@ -0,0 +1,55 @@
+import torch
+from torch.utils import data
+
+from HDF5Dataset import pad_collate
+
+
+def loader(samples, batch_size=4):
+    labels = torch.arange(samples) % 2
+    dataset = data.TensorDataset(torch.randn(samples, 12), labels.view(-1, 1), torch.randn(samples, 12))
+    return data.DataLoader(dataset, batch_size=batch_size)
+
+
+def test_predict_last_outputs():
+    '''
+    Tests if the predictions cover every sample of the test set in order, for a recurrent model and a transformer, and
+    if an empty test set gives empty results instead of failing
+    '''
+    from RNN import RNN
+    from Transformer import Transformer
+    torch.manual_seed(0)
+    for model in [RNN(1, 2, 8, 1), Transformer(2, 1, 1, 8, 1, 0)]:
+        model.eval()
+        test_loader = loader(10)
+        pred, outputs, y_test = model.predict_last_outputs(test_loader)
+
+        expected = []
+        with torch.no_grad():
+            for x, labels, x_raw in test_loader:
+                output = model(x.view(len(x), -1, 1))
+                expected.append((output[0] if isinstance(output, tuple) else output)[:, -1])
+        assert outputs.shape == (10, 2) and torch.allclose(outputs.cpu(), torch.cat(expected).cpu(), atol=1e-5)
+        assert torch.equal(pred.cpu(), outputs.argmax(-1).cpu())
+        assert torch.equal(y_test, test_loader.dataset.tensors[1].view(-1))
+
+        pred, outputs, y_test = model.predict_last_outputs(loader(0))
+        assert len(pred) == len(outputs) == len(y_test) == 0
+
+
+def test_predict_last_outputs_of_padded_batches():
+    '''
+    Tests if the last valid output of every sample is taken from padded batches
+    '''
+    from RNN import RNN
+    torch.manual_seed(0)
+    model = RNN(1, 2, 8, 1)
+    model.eval()
+    samples = [(torch.randn(length).numpy(), [length % 2], torch.randn(length).numpy()) for length in [3, 9, 5, 7]]
+    test_loader = data.DataLoader(samples, batch_size=2, collate_fn=pad_collate)
+
+    pred, outputs, y_test = model.predict_last_outputs(test_loader)
+    for i, (datum, label, datum_raw) in enumerate(samples):
+        with torch.no_grad():
+            single, _ = model(torch.as_tensor(datum).view(1, -1, 1), torch.tensor([len(datum)]))
+        assert torch.allclose(outputs[i].cpu(), single[0, -1].cpu(), atol=1e-6)
+        assert y_test[i] == label[0]
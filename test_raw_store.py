@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from raw_store import (read_csv, read_hdf5, save_raw_results_hdf5, build_raw_store, window_index, split_index,
+                       METAINFO)
+from HDF5Dataset import VirtualWindowDataset
+from experiment_config import config
+
+
+def raw_results(steps, terminals, positive, seed=0):
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for terminal in terminals:
+        columns[(terminal, 'ElmTerm', 'm:u')] = np.round(1 + 0.01 * rng.standard_normal(steps), 5)
+        columns[(terminal, 'ElmLod', 'm:Pload')] = rng.integers(0, 1000, steps).astype(np.float64)
+    df = pd.DataFrame(columns)
+    metainfo = ['simulation#%d' % seed, '', '', '', '', str(['terminal(s) with malfunction: %s' % positive, 'type']),
+                'terminals with PVs: %s' % terminals]
+    df[METAINFO] = metainfo + [''] * (steps - len(metainfo))
+    return df
+
+
+@pytest.mark.parametrize('format', ['.csv', '.hdf5'])
+def test_read_rows(tmp_path, format):
+    '''
+    Tests if reading given rows and columns of raw results gives those of the whole file, for unsorted and repeated
+    rows too
+    '''
+    df = raw_results(500, ['Bus 0', 'Bus 1'], ['Bus 1'])
+    path = str(tmp_path / ('run' + format))
+    if format == '.csv':
+        df.to_csv(path, sep=';')
+        read = read_csv
+    else:
+        save_raw_results_hdf5(df, path)
+        read = read_hdf5
+
+    columns = [('Bus 1', 'ElmTerm', 'm:u'), ('Bus 0', 'ElmLod', 'm:Pload')]
+    full = read(path, columns)
+    rows = [499, 3, 250, 3, 0, 120]
+    part = read(path, columns, rows)
+    expected = full.iloc[sorted(set(rows))]
+    assert list(part.index) == sorted(set(rows))
+    for column in columns:
+        np.testing.assert_allclose(part[column].to_numpy(dtype=np.float64), expected[column].to_numpy(dtype=np.float64))
+    np.testing.assert_allclose(full[columns[0]].to_numpy(dtype=np.float64), df[columns[0]].to_numpy(), atol=1e-9)
+    assert list(read(path, [METAINFO], [5, 6])[METAINFO]) == list(df[METAINFO].iloc[5:7])
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'simruns', 2)
+    monkeypatch.setattr(config, 'raw_data_set_name', 'raw')
+    terminals = ['Bus 0', 'Bus 1', 'Bus 2']
+    os.makedirs(tmp_path / 'results' / 'grid1')
+    runs = {}
+    for run, (steps, positive) in enumerate([(200, ['Bus 1']), (130, ['Bus 0', 'Bus 2'])]):
+        runs['run%d.csv' % run] = raw_results(steps, terminals, positive, seed=run)
+        runs['run%d.csv' % run].to_csv(str(tmp_path / 'results' / 'grid1' / ('run%d.csv' % run)), sep=';')
+    manifest = build_raw_store(str(tmp_path / 'store'), str(tmp_path / 'results'))
+    return manifest, runs
+
+
+def test_window_index(store):
+    '''
+    Tests if the index holds a window every stride steps of every terminal of every run with the label of the terminal,
+    and if the windows sliced from the store are the voltages of the raw results
+    '''
+    manifest, runs = store
+    assert {run['file']: run['labels'] for run in manifest['runs']} == {'run0.csv': [0, 1, 0], 'run1.csv': [1, 0, 1]}
+
+    index = window_index(manifest, 48, stride=40)
+    windows_per_run = [len(range(0, run['length'] - 48 + 1, 40)) for run in manifest['runs']]
+    assert len(index) == 3 * sum(windows_per_run)
+    windows = VirtualWindowDataset(manifest, index, 48).windows(np.arange(len(index)))
+    for (run, terminal, offset, label), window in zip(index, windows):
+        entry = manifest['runs'][run]
+        assert offset % 40 == 0 and offset + 48 <= entry['length']
+        assert label == entry['labels'][terminal]
+        voltages = runs[entry['file']][(entry['terminals'][terminal], 'ElmTerm', 'm:u')].to_numpy()
+        np.testing.assert_allclose(window, voltages[offset:offset + 48], rtol=1e-6)
+
+    assert len(window_index(manifest, 48)) == 3 * sum(run['length'] // 48 for run in manifest['runs'])
+    assert len(window_index(manifest, 201)) == 0
+
+
+def test_drawn_and_split(store):
+    '''
+    Tests if windows are drawn with the share of positive samples and split into disjoint training and test windows
+    '''
+    manifest, runs = store
+    index = window_index(manifest, 24, stride=8, number_of_samples=40, share_of_positive_samples=0.25, seed=1)
+    assert len(index) == 40 and index[:, 3].sum() == 10
+    assert len(np.unique(index, axis=0)) == 40
+
+    train, test = split_index(index, 0.2)
+    assert len(test) == 8 and len(train) == 32
+    assert len(np.unique(np.concatenate([train, test]), axis=0)) == 40
+    assert split_index(index, 10)[1].shape == (10, 4)
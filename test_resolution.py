@@ -0,0 +1,52 @@
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+from resolution import downsample, resolution_pyramid, input_channels, ResolutionLoader, resolution_loader
+
+
+def test_downsample():
+    '''
+    Tests if every period is reduced to its mean, min and max, dropping the incomplete period at the end, for samples
+    with and without a feature axis
+    '''
+    x = torch.tensor([[1., 5., 3., 2., 8., 6., 7.], [0., -2., 2., 4., 4., 4., 9.]])
+
+    expected = torch.tensor([[[3., 1., 5.], [16 / 3, 2., 8.]], [[0., -2., 2.], [4., 4., 4.]]])
+    assert torch.allclose(downsample(x, 3), expected)
+    assert torch.allclose(downsample(x[:, :, None], 3), expected)
+    assert downsample(x, 1) is x
+    assert downsample(x, 8).shape == (2, 0, 3)
+
+
+def test_pyramid_and_channels():
+    '''
+    Tests if the pyramid holds the samples at every resolution with the number of channels fed to the models
+    '''
+    x = torch.randn(4, 96, 1)
+    pyramid = resolution_pyramid(x, factors=(1, 2, 4))
+
+    for factor, level in pyramid.items():
+        assert level.shape == ((4, 96, 1) if factor == 1 else (4, 96 // factor, input_channels(factor)))
+    assert torch.allclose(pyramid[4][:, :, 0], x[:, :, 0].reshape(4, 24, 4).mean(dim=-1))
+
+
+def test_resolution_loader():
+    '''
+    Tests if the loader downsamples the preprocessed and the raw samples of every batch, keeps the labels and cuts the
+    lengths of padded batches to the complete periods
+    '''
+    data, raw, labels = torch.randn(10, 96, 1), torch.randn(10, 96, 1), torch.arange(10.)
+    lengths = torch.tensor([96, 95, 48, 47, 4, 3, 96, 96, 10, 1])
+    loader = DataLoader(TensorDataset(data, labels, raw, lengths), batch_size=4)
+
+    batches = list(ResolutionLoader(loader, 4))
+    assert len(batches) == len(loader) == 3
+    for (x, y, x_raw, batch_lengths), start in zip(batches, range(0, 10, 4)):
+        assert torch.equal(x, downsample(data[start:start + 4], 4))
+        assert torch.equal(x_raw, downsample(raw[start:start + 4], 4))
+        assert torch.equal(y, labels[start:start + 4])
+        assert torch.equal(batch_lengths, lengths[start:start + 4] // 4)
+
+    assert resolution_loader(loader, {'resolution': 1}) is loader
+    assert resolution_loader(loader, {}) is loader
+    assert len(next(iter(resolution_loader(DataLoader(TensorDataset(data, labels, raw)), {'resolution': 2})))) == 3
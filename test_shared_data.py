@@ -0,0 +1,86 @@
+import os
+import sys
+import subprocess
+from multiprocessing import shared_memory
+
+import h5py
+import numpy as np
+import pytest
+import torch
+
+from shared_data import SharedTensors, SharedTensorLoader, block_name, ABANDONED
+from util import DatasetWriter
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    rng = np.random.default_rng(0)
+    file = str(tmp_path / 'train.h5')
+    writer = DatasetWriter(file, 'train')
+    writer.append((1 + 0.01 * rng.standard_normal((50, 96))).astype(np.float32), rng.integers(0, 2, 50))
+    writer.close()
+    with h5py.File(file, 'r') as hdf:
+        return file, torch.from_numpy(hdf['x_train'][:]), torch.from_numpy(hdf['y_train'][:].astype(np.int64))
+
+
+def test_loader(dataset):
+    '''
+    Tests if the loader yields the samples and labels of the file in batches, in order or shuffled per epoch
+    '''
+    file, x, y = dataset
+    loader = SharedTensorLoader(file, 'train', batch_size=16, seed=0)
+    try:
+        batches = list(loader)
+        assert len(loader) == len(batches) == 4
+        assert torch.equal(torch.cat([batch[0] for batch in batches]), x)
+        assert torch.equal(torch.cat([batch[1] for batch in batches]), y)
+        assert torch.equal(batches[0][2], batches[0][0])
+
+        loader.shuffle = True
+        first, second = [torch.cat([batch[0] for batch in loader]) for epoch in range(2)]
+        assert not torch.equal(first, second)
+        assert torch.equal(first[first[:, 0].argsort()], x[x[:, 0].argsort()])
+    finally:
+        loader.shared.unlink()
+
+
+def test_attach(dataset):
+    '''
+    Tests if another process attaches to the block filled by this one instead of loading the file again
+    '''
+    file, x, y = dataset
+    shared = SharedTensors(file, 'train')
+    try:
+        code = ("import sys; from shared_data import SharedTensors; shared = SharedTensors(sys.argv[1], 'train'); "
+                "print(float(shared.tensors['x'].sum()), int(shared.tensors['y'].sum()))")
+        out = subprocess.run([sys.executable, '-c', code, file], capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        assert 'attached from shared memory' in out.stdout
+        attached = out.stdout.strip().splitlines()[-1].split()
+        assert float(attached[0]) == pytest.approx(float(x.sum()), abs=1e-3) and int(attached[1]) == int(y.sum())
+    finally:
+        shared.unlink()
+
+
+@pytest.mark.parametrize('creator', ['ended', 'abandoned'])
+def test_unfilled_block_created_again(dataset, creator):
+    '''
+    Tests if a block left unfilled by a process that ended, or abandoned by its creator, is created again and filled
+    '''
+    file, x, y = dataset
+    if creator == 'ended':
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        pid = process.pid
+    else:
+        pid = ABANDONED
+    block = shared_memory.SharedMemory(name=block_name(file, False), create=True, size=1 << 16)
+    np.ndarray((2,), dtype=np.int64, buffer=block.buf)[1] = pid
+    block.close()
+
+    shared = SharedTensors(file, 'train', timeout=10)
+    try:
+        assert torch.equal(shared.tensors['x'], x)
+        assert torch.equal(shared.tensors['y'], y)
+    finally:
+        shared.unlink()
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+import torch
+
+from streaming import HiddenStateStore
+
+
+def store(capacity=3):
+    return HiddenStateStore({'hidden': ((2, 4), torch.float32), 'steps': ((), torch.long)}, capacity)
+
+
+def test_least_recently_used_meters_evicted():
+    '''
+    Tests if the least recently used meter is evicted when all rows are taken and if the new meter starts with zeroed
+    states in its row
+    '''
+    states = store()
+    rows = states.rows(['a', 'b', 'c'])
+    states.scatter(rows, {'hidden': torch.ones(3, 2, 4), 'steps': torch.tensor([1, 2, 3])})
+    states.rows(['a'])                                  # b is the least recently used meter now
+
+    row = states.rows(['d'])
+    assert 'b' not in states and all(meter in states for meter in ['a', 'c', 'd'])
+    assert states.evictions == 1 and len(states) == 3
+    assert torch.all(states.gather(row)['hidden'] == 0) and states.gather(row)['steps'].item() == 0
+    assert states.gather(states.rows(['a'], register=False))['steps'].item() == 1
+
+    with pytest.raises(KeyError):
+        states.rows(['b'], register=False)
+    with pytest.raises(ValueError):
+        states.rows(['e', 'f', 'g', 'h'])             # more meters than rows
+
+
+def test_duplicate_meters_rejected():
+    '''
+    Tests if a meter given twice in one call is refused
+    '''
+    with pytest.raises(ValueError):
+        store().rows(['a', 'b', 'a'])
+
+
+def test_snapshot_round_trip(tmp_path):
+    '''
+    Tests if the states, the meters (in the order of their use) and the evictions of a snapshot are restored, and if
+    only the most recently used meters are restored into a smaller store
+    '''
+    states = store(4)
+    rows = states.rows(['a', ('grid', 7), 'c'])
+    states.scatter(rows, {'hidden': torch.randn(3, 2, 4), 'steps': torch.tensor([5, 6, 7])})
+    states.rows(['a'])
+    file = str(tmp_path / 'states')
+    states.save(file)
+
+    restored = store(4)
+    assert restored.restore(file + '.npy') == 3
+    assert list(restored.meters) == list(states.meters) == [('grid', 7), 'c', 'a']
+    for meter in list(states.meters):
+        original = states.gather(states.rows([meter], register=False))
+        copy = restored.gather(restored.rows([meter], register=False))
+        assert torch.equal(original['hidden'], copy['hidden']) and torch.equal(original['steps'], copy['steps'])
+
+    smaller = store(2)
+    assert smaller.restore(file) == 2
+    assert list(smaller.meters) == ['c', 'a']
+
+    other = HiddenStateStore({'hidden': ((1, 4), torch.float32)}, 4)
+    assert other.restore(file) is None
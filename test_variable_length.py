@@ -0,0 +1,55 @@
+import numpy as np
+import torch
+
+from HDF5Dataset import LengthBucketSampler, pad_collate, last_valid_outputs
+
+
+def samples_of_different_lengths(lengths, seed=0):
+    rng = np.random.default_rng(seed)
+    return [(rng.standard_normal(length).astype(np.float32), np.array([i % 2]),
+             rng.standard_normal(length).astype(np.float32)) for i, length in enumerate(lengths)]
+
+
+def test_padded_outputs_match_single_samples():
+    '''
+    Tests if the outputs of a padded batch (pad_collate, forward_packed) are the same as the ones of every sample run
+    on its own, up to its length, and if the last valid outputs are taken at the end of every sample
+    '''
+    from RNN import RNN
+    torch.manual_seed(0)
+    model = RNN(1, 2, 8, 2)
+    model.eval()
+    batch = samples_of_different_lengths([5, 12, 9, 1, 12])
+
+    data, labels, data_raw, lengths = pad_collate(batch)
+    assert data.shape == (5, 12) and data_raw.shape == (5, 12) and labels.shape == (5, 1)
+    assert lengths.tolist() == [5, 12, 9, 1, 12]
+
+    with torch.no_grad():
+        output, _ = model(data, lengths)
+        last = last_valid_outputs(output, lengths)
+        for i, (datum, label, datum_raw) in enumerate(batch):
+            single, _ = model(torch.as_tensor(datum).view(1, -1), torch.tensor([len(datum)]))
+            assert torch.allclose(output[i, :len(datum)], single[0], atol=1e-6)
+            assert torch.allclose(last[i], single[0, -1], atol=1e-6)
+            assert torch.all(data[i, len(datum):] == 0)
+
+
+def test_length_buckets():
+    '''
+    Tests if the sampler yields every sample once, in batches of the batch size of samples next to each other in the
+    order of their lengths
+    '''
+    rng = np.random.default_rng(1)
+    lengths = rng.choice([96, 192, 672], 100)
+    sorted_lengths = np.sort(lengths)
+
+    for shuffle in [True, False]:
+        batches = list(LengthBucketSampler(lengths, 8, shuffle=shuffle))
+        assert len(batches) == len(LengthBucketSampler(lengths, 8)) == 13
+        assert sorted(i for batch in batches for i in batch) == list(range(100))
+        assert sorted(len(batch) for batch in batches) == [4] + [8] * 12
+        # the lengths of every batch are a run of 8 of the sorted lengths, so at most two lengths meet in a batch
+        buckets = sorted(tuple(np.sort(lengths[batch])) for batch in batches)
+        assert buckets == sorted(tuple(sorted_lengths[i:i + 8]) for i in range(0, 100, 8))
+        assert all(len(set(bucket)) <= 2 for bucket in buckets)
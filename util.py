@@ -1,92 +1,443 @@
 import os
-from RNN import RNN
-from LSTM import LSTM
-from GRU import GRU
-from Transformer import Transformer
-from RTransformer import RT
-from HDF5Dataset import HDF5Dataset
-import plotting
+import inspect
+import importlib
+from HDF5Dataset import HDF5Dataset, VariableLengthDataset, VirtualWindowDataset, LengthBucketSampler, pad_collate
 import torch
+from torch import nn
 from torch.utils import data
-from sklearn.preprocessing import MaxAbsScaler
-from sklearn.model_selection import train_test_split
 import random
 import numpy as np
-import pandas as pd
-
+import h5py
 
-import importlib
-
-from experiment_config import experiment_path, chosen_experiment
-spec = importlib.util.spec_from_file_location(chosen_experiment, experiment_path)
-config = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(config)
-learning_config = config.learning_config
+from experiment_config import config, learning_config
+from augmentation import noisy_loader
+import codec
+from codec import MODES as CODEC_MODES
+from resolution import downsample, resolution, resolution_loader, input_channels
 
 
 def model_exists(full_path):
     return os.path.exists(os.path.join(full_path, "model.pth"))
 
-def load_model(learning_config):
-    path = os.path.join(config.models_folder, learning_config['classifier'])
-    if learning_config['classifier'] == 'RNN':
-        load_saved = model_exists(path)
-        model = RNN(learning_config['RNN model settings'][0],  learning_config['RNN model settings'][1],
-                    learning_config['RNN model settings'][2], learning_config['RNN model settings'][3])
-    elif learning_config['classifier'] == 'LSTM':
-        load_saved = model_exists(path)
-        model = LSTM(learning_config['LSTM model settings'][0],  learning_config['LSTM model settings'][1],
-                     learning_config['LSTM model settings'][2], learning_config['LSTM model settings'][3])
-    elif learning_config['classifier'] == 'GRU':
-        load_saved = model_exists(path)
-        model = GRU(learning_config['GRU model settings'][0],  learning_config['GRU model settings'][1],
-                    learning_config['GRU model settings'][2], learning_config['GRU model settings'][3])
-    elif learning_config['classifier'] == 'Transformer':
-        load_saved = model_exists(path)
-        model = Transformer(learning_config['Transformer model settings'][0],  learning_config['Transformer model settings'][1], learning_config['Transformer model settings'][2], learning_config['Transformer model settings'][3], learning_config['Transformer model settings'][4], learning_config['Transformer model settings'][5])
-    elif learning_config['classifier'] == 'RTransformer':
-        load_saved = model_exists(path)
-        model = RT(learning_config['R-Transformer model settings'][0],  learning_config['R-Transformer model settings'][1], learning_config['R-Transformer model settings'][2], learning_config['R-Transformer model settings'][3], learning_config['R-Transformer model settings'][4], learning_config['R-Transformer model settings'][5], learning_config['R-Transformer model settings'][6], learning_config['R-Transformer model settings'][7], learning_config['R-Transformer model settings'][8], learning_config['R-Transformer model settings'][9])
+MODELS = {}
+
+
+def register_model(classifier, module, class_name, settings_key, hyperparameters, options=None):
+    '''
+    registers a classifier under the name used for learning_config['classifier']: the class is given by module and class
+    name so it is only imported when it is built; hyperparameters name the settings found under settings_key (either a
+    list in this order or a dict with these names); options map further keyword arguments to optional learning_config
+    keys
+    '''
+    MODELS[classifier] = {'module': module, 'class': class_name, 'settings': settings_key,
+                          'hyperparameters': list(hyperparameters), 'options': dict(options or {})}
+
+
+register_model('RNN', 'RNN', 'RNN', 'RNN model settings', ['input_size', 'output_size', 'hidden_dim', 'n_layers'])
+register_model('LSTM', 'LSTM', 'LSTM', 'LSTM model settings', ['input_size', 'output_size', 'hidden_dim', 'n_layers'])
+register_model('GRU', 'GRU', 'GRU', 'GRU model settings', ['input_size', 'output_size', 'hidden_dim', 'n_layers'])
+register_model('Transformer', 'Transformer', 'Transformer', 'Transformer model settings',
+               ['ntoken', 'ninp', 'nhead', 'nhid', 'nlayers', 'dropout'])
+register_model('RTransformer', 'RTransformer', 'RT', 'R-Transformer model settings',
+               ['input_size', 'd_model', 'output_size', 'h', 'rnn_type', 'ksize', 'n', 'n_level', 'dropout',
+                'emb_dropout'], options={'layer_norm': 'R-Transformer layer norm'})
+
+
+def model_hyperparameters(learning_config):
+    entry = MODELS[learning_config['classifier']]
+    settings = learning_config[entry['settings']]
+    if isinstance(settings, dict):
+        unknown = [name for name in settings if name not in entry['hyperparameters']]
+        if unknown:
+            print('Unknown %s ignored: %s' % (entry['settings'], ', '.join(unknown)))
+        hyperparameters = {name: value for name, value in settings.items() if name not in unknown}
     else:
+        hyperparameters = dict(zip(entry['hyperparameters'], settings))
+    channels = input_channels(resolution(learning_config))
+    if channels > 1:                    # samples at a coarser resolution come with mean, min and max channels
+        hyperparameters['ninp' if 'ninp' in entry['hyperparameters'] else 'input_size'] = channels
+    for name, key in entry['options'].items():
+        if key in learning_config:
+            hyperparameters[name] = learning_config[key]
+    return hyperparameters
+
+
+def choose_device():
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def build_model(learning_config, device=None):
+    '''
+    imports and constructs only the chosen classifier; with torch versions that support it the parameters are created
+    on the target device right away instead of being moved there afterwards
+    '''
+    if learning_config['classifier'] not in MODELS:
         print('Invalid model type entered!')
         return None
 
-    device = model.choose_device()
+    entry = MODELS[learning_config['classifier']]
+    model_class = getattr(importlib.import_module(entry['module']), entry['class'])
+    device = device if device is not None else choose_device()
+    if hasattr(torch.device, '__enter__'):                 # torch.device is a context manager from torch 2.0 on
+        with device:
+            model = model_class(**model_hyperparameters(learning_config))
+    else:
+        model = model_class(**model_hyperparameters(learning_config))
+    return model.to(device)
+
+
+def load_checkpoint(file, device):
+    # mmap keeps the tensors in the file until they are copied into the model (torch >= 2.1, zip checkpoints only)
+    if 'mmap' in inspect.signature(torch.load).parameters:
+        try:
+            return torch.load(file, map_location=device, mmap=True)
+        except RuntimeError:
+            pass                                        # legacy (non zip) checkpoint
+    return torch.load(file, map_location=device)
+
+
+def load_model(learning_config):
+    path = os.path.join(config.models_folder, learning_config['classifier'])
+    load_saved = model_exists(path)
+
+    device = choose_device()
+    model = build_model(learning_config, device)
+    if model is None:
+        return None
 
     if load_saved:
         print('Loading model ..')
 
         try:
-            checkpoint = torch.load(os.path.join(path, "model.pth"))
+            checkpoint = load_checkpoint(os.path.join(path, "model.pth"), device)
             model.load_state_dict(checkpoint['model_state_dict'])
             model.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+            if hasattr(model, 'variable_length'):
+                model.variable_length = checkpoint.get('variable_length', False)
             epoch = checkpoint['epoch']
             loss = checkpoint['loss']
-    
-            model.to(device)
+
             print('Model successfully loaded!')
             return model, epoch, loss
         except RuntimeError:
             print('Improper model loaded (different architecture), fresh model used')
-            pass
+            model = build_model(learning_config, device)
     else:
         print('No saved Model found. Fresh model used')
 
-    model.to(device)
-
     return model, None, None
 
-def export_model(model, learning_config):
-    dummy_input = torch.randn(1, 672, 1)
-    out = model(dummy_input)
+class InferenceModel(nn.Module):
+    '''
+    Wraps a classifier for export so that raw voltages go in and class probabilities come out: every sample is zero
+    meaned by itself and scaled with the max abs values fitted on the training set before it is passed to the model,
+    afterwards the output of the last time step (most informed output) is chosen and softmaxed
+    '''
+
+    def __init__(self, model, max_abs):
+        super(InferenceModel, self).__init__()
+        self.model = model
+        scale = torch.as_tensor(np.array(max_abs), dtype=torch.float32).view(1, -1, 1)
+        scale[scale == 0] = 1                   # like the MaxAbsScaler: features that are always zero are not scaled
+        self.register_buffer('scale', scale)
+
+    def forward(self, x):
+        if x.dim() == 2:
+            x = x.view(x.size(0), -1, 1)
+        x = (x - x.mean(dim=1, keepdim=True)) / self.scale
+        output = self.model(x)
+        if isinstance(output, tuple):           # recurrent models also return their hidden state
+            output = output[0]
+        return torch.softmax(output[:, -1].float(), dim=-1)
+
+def load_max_abs(type='train', file=None):
+    '''
+    max abs values of the scaler fitted on the training set; datasets saved before they were stored along with the
+    samples are refitted on the raw training samples
+    '''
+    with h5py.File(file or dataset_file(type), 'r') as hdf:
+        if 'max_abs' in hdf:
+            return hdf['max_abs'][:]
+        X_raw = codec.read_raw(hdf, 'x_raw_' + type)
+
+    X_zeromean = X_raw - X_raw.mean(axis=1, keepdims=True)
+    return np.abs(X_zeromean).max(axis=0)
+
+def export_model(model, learning_config, preprocessing=None, dynamic_sequence=None):
+    '''
+    exports the model to ONNX with a dynamic batch dimension (and optionally a dynamic sequence dimension), checks the
+    exported model against the PyTorch model with onnxruntime for several input shapes and records the input contract
+    in the metadata of the ONNX model; if the model does not hold for other shapes than the one it was traced with, it
+    is exported again with fixed sequence length and then also fixed batch size. Returns the file name, or None if
+    the exported model does not even match the model for the shape it was traced with.
+    '''
+    if preprocessing is None:
+        preprocessing = learning_config.get('export_preprocessing', False)
+    if dynamic_sequence is None:
+        dynamic_sequence = learning_config.get('export_dynamic_sequence', False)
+    if preprocessing and dynamic_sequence:
+        print('The fitted preprocessing scales every time step separately, sequence length fixed to %d' % config.sample_length)
+        dynamic_sequence = False
+    factor = resolution(learning_config)
+    if preprocessing and factor > 1:
+        print('The fitted preprocessing is done at full resolution, the model is exported without it')
+        preprocessing = False
+    steps, channels = config.sample_length // factor, input_channels(factor)
+    if scrambled_layout(dataset_file('train'), 'train'):
+        print('Warning: the training set %s was saved in the former layout, which mixes up the time steps of the '
+              'samples, so the exported model was trained on scrambled samples' % dataset_file('train'))
+    if preprocessing:
+        with h5py.File(dataset_file('train'), 'r') as hdf:
+            fitted = 'max_abs' in hdf
+        if not fitted or scrambled_layout(dataset_file('train'), 'train'):
+            # refitting them on the raw samples of such a file would not give the scaling the model was trained with
+            print('The training set %s was saved %s, the preprocessing cannot be embedded; create the dataset again or '
+                  'export without "export_preprocessing"' % (dataset_file('train'), 'in the former layout' if fitted
+                                                             else 'without the max abs values it was scaled with'))
+            return None
+
+    uncompile_model(model)
+    if hasattr(model, 'pin_device'):
+        model.pin_device(torch.device("cpu"))          # exported for onnxruntime on the CPU
+    model.eval()
+    if preprocessing:
+        model = InferenceModel(model, load_max_abs())
+        model.eval()
+        output_names = ["probabilities"]
+    else:
+        output_names = ["output"]
+
+    dummy_input = torch.randn(1, steps, channels)
     input_names = ["input"]  # + ["learned_%d" % i for i in range(3)]
-    output_names = ["output"]
     name = learning_config['dataset'] + '.onnx'
 
-    model.eval()
-    torch.onnx.export(torch.jit.trace_module(model, {'forward': dummy_input}), dummy_input, name, example_outputs=out, export_params=True, verbose=True,
-                      input_names=input_names, output_names=output_names)
+    export_settings = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        export_settings['dynamo'] = False               # dynamic_axes are a setting of the TorchScript based exporter
+
+    # (dynamic batch, dynamic sequence) from the most to the least flexible export
+    attempts = ([(True, True)] if dynamic_sequence else []) + [(True, False), (False, False)]
+    for dynamic_batch, dynamic_sequence in attempts:
+        dynamic_axes = {}
+        if dynamic_batch:
+            dynamic_axes = {"input": {0: "batch"}, output_names[0]: {0: "batch"}}
+        if dynamic_sequence:
+            dynamic_axes["input"][1] = "sequence"
+            dynamic_axes[output_names[0]][1] = "sequence"
+        with torch.no_grad():
+            torch.onnx.export(model, dummy_input, name, export_params=True, verbose=True, input_names=input_names,
+                              output_names=output_names, dynamic_axes=dynamic_axes, **export_settings)
+
+        if dynamic_sequence:
+            shapes = [(1, steps), (7, steps), (3, int(steps / 2)), (2, 2 * steps)]
+        elif dynamic_batch:
+            shapes = [(1, steps), (7, steps), (64, steps)]
+        else:
+            shapes = [(1, steps)]
+        if verify_export(name, model, shapes, channels):
+            break
+        if (dynamic_batch, dynamic_sequence) != attempts[-1]:
+            print('The exported model does not hold for all input shapes, exported again with fixed %s' % (
+                'sequence length' if dynamic_sequence else 'batch size and sequence length'))
+    else:
+        os.remove(name)
+        print('Exported model refused: it does not match the model')
+        return None
+    batch = 'batch' if dynamic_batch else '1'
+    sequence = 'sequence' if dynamic_sequence else str(steps)
+
+    import onnx
+    onnx_model = onnx.load(name)
+    onnx.helper.set_model_props(onnx_model, {
+        'dataset': learning_config['dataset'],
+        'classifier': learning_config['classifier'],
+        'input': 'input',
+        'input shape': '[%s, %s, %d]' % (batch, sequence, channels),
+        'input type': 'float32',
+        'input data': 'raw voltages' if preprocessing else 'samples zero meaned by themselves and scaled with the max abs values of the training set',
+        'step size in minutes': str(config.step_size * factor),
+        'output': output_names[0],
+        'output shape': '[%s, classes]' % batch if preprocessing else '[%s, %s, classes]' % (batch, sequence),
+        'output data': 'class probabilities' if preprocessing else 'scores of every time step (the last one is the most informed output)',
+    })
+    onnx.save(onnx_model, name)
+    print('Model exported to %s' % name)
+    return name
+
+def verify_export(name, model, shapes, channels=1):
+    '''
+    compares the outputs of an exported ONNX model to the ones of the PyTorch model for inputs of the given shapes
+    (batch, sequence length) with the given number of channels
+    '''
+    import onnxruntime
+
+    session = onnxruntime.InferenceSession(name, providers=['CPUExecutionProvider'])
+    input_name = session.get_inputs()[0].name
+    verified = True
+    for batch_size, seq_length in shapes:
+        x = torch.randn(batch_size, seq_length, channels)
+        with torch.no_grad():
+            expected = model(x)
+        if isinstance(expected, tuple):         # recurrent models also return their hidden state
+            expected = expected[0]
+        try:
+            output = session.run(None, {input_name: x.numpy()})[0]
+            np.testing.assert_allclose(output, expected.float().numpy(), rtol=1e-3, atol=1e-5)
+            print('Exported model verified for input shape %s' % str(tuple(x.shape)))
+        except Exception as e:
+            print('Exported model does not match the model for input shape %s: %s' % (str(tuple(x.shape)), e))
+            verified = False
+    return verified
+
+
+def quantize_model(model, learning_config):
+    '''
+    creates an int8 variant of the exported model (dynamically quantized or statically quantized with a slice of the
+    test set as calibration data) and compares accuracy and F-score of both variants on the test set; the quantized
+    model is refused if its F-score is lower by more than the configured threshold
+    '''
+    import onnx
+    from onnxruntime.quantization import quantize_dynamic, quantize_static, CalibrationDataReader, QuantType, QuantFormat
+
+    name = learning_config['dataset'] + '.onnx'
+    name_int8 = learning_config['dataset'] + '_int8.onnx'
+    if not os.path.isfile(name):
+        print('No exported model %s found, export the model before quantizing it' % name)
+        return None
+
+    metadata = {prop.key: prop.value for prop in onnx.load(name).metadata_props}
+    if metadata:
+        raw_input = metadata.get('input data') == 'raw voltages'
+    else:
+        raw_input = learning_config.get('export_preprocessing', False)
+
+    with h5py.File(dataset_file('test'), 'r') as hdf:
+        X = (codec.read_raw(hdf, 'x_raw_test') if raw_input else hdf['x_test'][:]).astype(np.float32)
+        y = hdf['y_test'][:, -1].astype(int)
+    X = X.reshape(len(X), -1, 1)
+    if not raw_input and resolution(learning_config) > 1:
+        X = downsample(torch.as_tensor(X), resolution(learning_config)).numpy()
+
+    calibration_samples = min(learning_config.get('quantization calibration samples', 500), len(X))
+    if learning_config.get('quantization', 'dynamic') == 'static':
+
+        class TestSetReader(CalibrationDataReader):
+            def __init__(self, X, input_name):
+                self._batches = iter([{input_name: X[i:i + 1]} for i in range(len(X))])
+
+            def get_next(self):
+                return next(self._batches, None)
+
+        input_name = onnx.load(name).graph.input[0].name
+        quantize_static(name, name_int8, TestSetReader(X[:calibration_samples], input_name),
+                        quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    else:
+        quantize_dynamic(name, name_int8, weight_type=QuantType.QInt8)
+
+    if len(X) > calibration_samples and learning_config.get('quantization', 'dynamic') == 'static':
+        X, y = X[calibration_samples:], y[calibration_samples:]        # do not score on the calibration data
+    score = model.score(y, onnx_predict(name, X))
+    score_int8 = model.score(y, onnx_predict(name_int8, X))
+
+    print("\n########## Quantization ##########")
+    print("Accuracy: {0} (float32) vs {1} (int8), delta: {2}".format(score[0], score_int8[0], score_int8[0] - score[0]))
+    print("FScore: {0} (float32) vs {1} (int8), delta: {2}".format(score[1][2], score_int8[1][2], score_int8[1][2] - score[1][2]))
+
+    if score[1][2] - score_int8[1][2] > learning_config.get('max F-score drop', 0.01):
+        os.remove(name_int8)
+        print('Quantized model refused: F-score dropped by more than {0}'.format(learning_config.get('max F-score drop', 0.01)))
+        return None
 
+    print('Quantized model saved to %s' % name_int8)
+    return name_int8
+
+class TracedForward:
+    '''
+    TorchScript fallback for compile_model: inference calls (eval mode, no gradients) run a trace of the model that is
+    made once per input shape, training keeps the eager forward since a trace would freeze dropout
+    '''
+
+    def __init__(self, model):
+        self.model = model
+        self.eager_forward = model.forward
+        self.traces = {}
+
+    def __call__(self, x, *args, **kwargs):
+        if self.model.training or torch.is_grad_enabled() or torch.jit.is_tracing() or \
+                any(arg is not None for arg in list(args) + list(kwargs.values())):
+            return self.eager_forward(x, *args, **kwargs)
+        shape = tuple(x.shape)
+        if shape not in self.traces:
+            with torch.no_grad():
+                self.traces[shape] = torch.jit.trace(self.model, x.clone(), check_trace=False)
+        return self.traces[shape](x)
+
+
+def compile_model(model, learning_config, example=None):
+    '''
+    compiles the forward pass of the model (and with it the backward pass of the training step) with torch.compile,
+    compiled artefacts are cached in the models folder between runs; if torch.compile is not available or fails on the
+    example input, inference falls back to TorchScript traces
+    '''
+    mode = learning_config.get("compile", 'None')
+    if mode == 'None':
+        return model
+    if example is None:
+        factor = resolution(learning_config)
+        example = torch.randn(2, config.sample_length // factor, input_channels(factor))
+    example = example.to(next(model.parameters()).device)
+
+    if mode == 'torch.compile' and hasattr(torch, 'compile'):
+        os.environ['TORCHINDUCTOR_CACHE_DIR'] = learning_config.get("compile cache", os.path.join(config.models_folder, 'compile_cache'))     # persistent inductor / FX graph cache
+        try:
+            if hasattr(model, 'compile'):
+                model.compile(dynamic=None)
+            else:
+                model.forward = torch.compile(model.forward)
+            was_training = model.training
+            model.train()
+            output = model(example)
+            (output[0] if isinstance(output, tuple) else output).float().sum().backward()
+            model.zero_grad()
+            model.train(was_training)
+            print('Model compiled with torch.compile (cache: %s)' % os.environ['TORCHINDUCTOR_CACHE_DIR'])
+            return model
+        except Exception as e:
+            print('torch.compile failed (%s), falling back to TorchScript' % str(e).strip().splitlines()[0])
+            uncompile_model(model)
+
+    model.forward = TracedForward(model)
+    print('Inference of the model runs TorchScript traces')
+    return model
+
+
+def uncompile_model(model):
+    # back to the eager forward, e.g. to trace the model for the ONNX export
+    if getattr(model, '_compiled_call_impl', None) is not None:
+        model._compiled_call_impl = None
+    model.__dict__.pop('forward', None)
+    return model
+
+
+def onnx_predict(name, X, batch_size=100):
+    '''
+    predicted classes of an exported model; models exported with preprocessing output class probabilities, the others
+    the scores of every time step of which the last one is used
+    '''
+    import onnxruntime
+
+    session = onnxruntime.InferenceSession(name, providers=['CPUExecutionProvider'])
+    input_name = session.get_inputs()[0].name
+    if not isinstance(session.get_inputs()[0].shape[0], str):        # batch dimension not exported as dynamic
+        batch_size = session.get_inputs()[0].shape[0]
+
+    pred = np.empty(len(X), dtype=int)
+    for i in range(0, len(X), batch_size):
+        outputs = session.run(None, {input_name: X[i:i + batch_size]})[0]
+        if outputs.ndim == 3:
+            outputs = outputs[:, -1]
+        pred[i:i + batch_size] = np.argmax(outputs, axis=-1)
+    return pred
 
 def save_model(model, epoch, loss):
     path = os.path.join(config.models_folder, learning_config['classifier'])
@@ -100,6 +451,7 @@ def save_model(model, epoch, loss):
             'model_state_dict': model.state_dict(),
             'optimizer_state_dict': model.optimizer.state_dict(),
             'loss': loss,
+            'variable_length': getattr(model, 'variable_length', False),       # see streaming.streaming_detector
         }, os.path.join(path, 'model.pth'))
     except TypeError:
         torch.save({
@@ -107,12 +459,16 @@ def save_model(model, epoch, loss):
             'model_state_dict': model.state_dict,
             'optimizer_state_dict': model.optimizer.state_dict(),
             'loss': loss,
+            'variable_length': getattr(model, 'variable_length', False),       # see streaming.streaming_detector
         }, os.path.join(path, 'model.pth'))
 
     #torch.save(model.state_dict(), path + ".model")
     #torch.save(model.optimizer.state_dict(), path + ".optimizer")
 
 def plot_samples(X, y, X_pre=None):
+    import plotting
+    from sklearn.preprocessing import MaxAbsScaler
+    from sklearn.model_selection import train_test_split
 
     if type(X) == torch.Tensor:
         X = np.array(X)
@@ -135,14 +491,207 @@ def plot_samples(X, y, X_pre=None):
     else:
         plotting.plot_sample(np.array(X_pre[samples]), label=[y[i] for i in samples], title='Samples scaled to -1 to 1')
 
-def load_data(type):
+DATASET_FOLDERS = {}                # datasets stored elsewhere than in the results folder, e.g. in the dataset cache
+
+def dataset_folder(dataset=None):
+    dataset = dataset or learning_config['dataset']
+    return DATASET_FOLDERS.get(dataset, os.path.join(config.results_folder, dataset))
+
+def dataset_file(type, dataset=None):
+    dataset = dataset or learning_config['dataset']
+    path = os.path.join(dataset_folder(dataset), type)
+    file = dataset + '_' + type + '.hdf5'
+    return os.path.join(path, file)
+
+def scrambled_layout(file, type):
+    '''
+    True for datasets of fixed length samples saved before the dataset writer (fixed size datasets, the oldest ones also
+    without max abs values): the raw samples were reshaped instead of transposed into [samples, steps], so every row
+    holds steps of several samples, and the preprocessed samples and labels do not belong together
+    '''
+    if not os.path.exists(file):
+        return False
+    with h5py.File(file, 'r') as hdf:
+        return 'x_raw_' + type in hdf and 'offsets_' + type not in hdf and hdf['x_raw_' + type].maxshape[0] is not None
+
+def append_refused(file, type, steps=None):
+    '''
+    why samples can't be appended to a dataset file, None if they can (or there is no such file yet): files saved before
+    the dataset writer have fixed size datasets and no max abs values; with steps, files holding samples of another
+    number of steps (e.g. after the sample length was changed) are refused as well
+    '''
+    if not os.path.exists(file):
+        return None
+    with h5py.File(file, 'r') as hdf:
+        if 'y_' + type not in hdf:
+            return None
+        if 'max_abs' not in hdf:
+            return 'was saved without the max abs values it was scaled with'
+        if any(hdf[name + type].maxshape[0] is not None for name in ['x_raw_', 'x_', 'y_'] if name + type in hdf):
+            return 'was saved with datasets that cannot be resized'
+        if steps is not None and hdf['x_raw_' + type].shape[1] != steps:
+            return 'holds samples of %d steps, not of %d' % (hdf['x_raw_' + type].shape[1], steps)
+    return None
+
+class DatasetWriter:
+    '''
+    writes a dataset file in the layout read by HDF5Dataset, one sample per row: x_raw_<type> [samples, steps(,
+    features)], y_<type> [samples, 1] and the preprocessed x_<type>. Samples are appended in chunks; while they are
+    written, the max abs values of the zero meaned samples are fitted (unless max_abs is given, e.g. the ones of the
+    training set for the test set) and x_<type> is computed from them when the writer is closed. Returns the max abs
+    values on close. With a codec ('offset' or 'delta', see codec.py), x_raw_<type> is stored as int16 steps of the
+    scale along with the base values of the samples (x_raw_base_<type>).
+
+    With append, samples are added to an existing file: the samples in there are left as they are, the max abs values
+    are updated with the new samples and only where they grew, the preprocessed values of the existing samples are
+    rescaled (which reads and writes all of x_<type> once). Files that can't be appended to (see append_refused) are
+    written anew.
+    '''
+
+    def __init__(self, file, type, max_abs=None, chunk_samples=256, codec=None, scale=1e-5, append=False):
+        if codec is not None and codec not in CODEC_MODES:
+            raise ValueError('Unknown raw codec %s, choose one of %s' % (codec, ', '.join(CODEC_MODES)))
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        refused = append_refused(file, type) if append else None
+        if refused:
+            print('%s %s, it is written anew' % (file, refused))
+        append = append and not refused and os.path.exists(file)
+        self.hdf = h5py.File(file, 'a' if append else 'w')
+        self.type = type
+        self.fit = max_abs is None
+        self.max_abs = None if max_abs is None else np.asarray(max_abs, dtype=np.float32)
+        self.chunk_samples = chunk_samples
+        self.codec = codec
+        self.scale = scale
+        self.samples = 0
+        self.previous_max_abs = None
+        if append and 'y_' + type in self.hdf:
+            self.samples = len(self.hdf['y_' + type])
+            self.previous_max_abs = self.hdf['max_abs'][:]
+            if self.fit:
+                self.max_abs = self.previous_max_abs
+            attrs = self.hdf['x_raw_' + type].attrs                # samples are appended as the existing ones are stored
+            self.codec, self.scale = attrs.get('codec'), attrs.get('scale', scale)
+        self.start = self.samples
+
+    def append(self, x_raw, y):
+        x_raw = np.asarray(x_raw, dtype=np.float32)
+        y = np.asarray(y).reshape(-1, 1)
+        stored = [('x_raw_', x_raw), ('y_', y)]
+        if self.codec:
+            q, base = codec.encode(x_raw, self.scale, self.codec)
+            x_raw = codec.decode(q, base, self.scale, self.codec)        # max abs values of the values read later on
+            stored = [('x_raw_', q), ('x_raw_base_', base), ('y_', y)]
+        if 'y_' + self.type in self.hdf and self.hdf['x_' + self.type].shape[1:] != x_raw.shape[1:]:
+            raise ValueError('Samples of shape %s cannot be appended to %s, it holds samples of shape %s' % (
+                x_raw.shape[1:], self.hdf.filename, self.hdf['x_' + self.type].shape[1:]))
+        if 'y_' + self.type not in self.hdf:
+            chunks = (min(len(x_raw), self.chunk_samples),) + x_raw.shape[1:]
+            for name, data in stored + [('x_', x_raw)]:
+                self.hdf.create_dataset(name + self.type, shape=(0,) + data.shape[1:], maxshape=(None,) + data.shape[1:],
+                                        dtype=np.float32 if name == 'x_' else data.dtype,
+                                        chunks=chunks if name in ['x_', 'x_raw_'] else True, compression='gzip')
+            if self.codec:
+                self.hdf['x_raw_' + self.type].attrs.update({'codec': self.codec, 'scale': self.scale,
+                                                             'base': 'x_raw_base_' + self.type})
+        if self.fit:
+            max_abs = np.abs(x_raw - x_raw.mean(axis=1, keepdims=True)).max(axis=0)
+            self.max_abs = max_abs if self.max_abs is None else np.maximum(self.max_abs, max_abs)
+        start, self.samples = self.samples, self.samples + len(x_raw)
+        for name, data in stored:
+            self.hdf[name + self.type].resize(self.samples, axis=0)
+            self.hdf[name + self.type][start:] = data
+
+    def close(self):
+        if self.max_abs is None:                                    # nothing written
+            self.hdf.close()
+            return None
+        x = self.hdf['x_' + self.type]
+        scale = np.where(self.max_abs == 0, 1, self.max_abs)       # steps that are always zero are not scaled
+        x.resize(self.samples, axis=0)
+        if self.previous_max_abs is not None and not np.array_equal(self.previous_max_abs, self.max_abs):
+            rescale = np.where(self.previous_max_abs == 0, 1, self.previous_max_abs) / scale
+            for start in range(0, self.start, self.chunk_samples * 16):
+                end = min(start + self.chunk_samples * 16, self.start)
+                x[start:end] = x[start:end] * rescale
+        for start in range(self.start, self.samples, self.chunk_samples * 16):
+            chunk = codec.read_raw(self.hdf, 'x_raw_' + self.type, slice(start, start + self.chunk_samples * 16))
+            x[start:start + len(chunk)] = (chunk - chunk.mean(axis=1, keepdims=True)) / scale
+        if 'max_abs' in self.hdf:
+            del self.hdf['max_abs']
+        self.hdf.create_dataset('max_abs', data=self.max_abs.astype(np.float32))
+        self.hdf.close()
+        return self.max_abs
+
+def dataset_writer(type, max_abs=None, file=None, append=False):
+    '''
+    writer of the dataset of the learning config, storing the raw samples with the codec chosen in the learning config
+    '''
+    return DatasetWriter(file or dataset_file(type), type, max_abs=max_abs, codec=learning_config.get("raw codec"),
+                         scale=learning_config.get("raw codec scale", 1e-5), append=append)
+
+def dataset_manifest_file():
+    return os.path.join(dataset_folder(), learning_config['dataset'] + '_manifest.json')
+
+def new_dataset_manifest():
+    return {'dataset': learning_config['dataset'], 'sample length': config.sample_length, 'runs': [], 'combinations': {},
+            'samples': 0}
+
+def load_dataset_manifest():
+    '''
+    raw result files the dataset of the learning config was created from (grid and file), the combinations of terminals
+    with devices and malfunctions per grid already in it and its number of samples; a new manifest if there is no
+    dataset yet, None if there is one that can't be appended to (saved without a manifest, so it is unknown which raw
+    results are in it, saved in a layout that can't be appended to or with another sample length, see append_refused)
+    '''
+    import json
+    files = {type: dataset_file(type) for type in ['train', 'test'] if os.path.exists(dataset_file(type))}
+    for type, file in files.items():
+        refused = append_refused(file, type, config.sample_length)
+        if refused:
+            print('%s %s, dataset %s is created anew' % (file, refused, learning_config['dataset']))
+            return None
+    if not os.path.exists(dataset_manifest_file()):
+        if files:
+            print('Dataset %s was saved without a manifest of the raw results in it, it is created anew' %
+                  learning_config['dataset'])
+            return None
+        return new_dataset_manifest()
+    with open(dataset_manifest_file()) as f:
+        manifest = json.load(f)
+    if manifest.get('sample length', config.sample_length) != config.sample_length:
+        print('Dataset %s was created with samples of %d steps, not of %d, it is created anew' % (
+            learning_config['dataset'], manifest['sample length'], config.sample_length))
+        return None
+    return manifest
+
+def save_dataset_manifest(manifest):
+    import json
+    os.makedirs(os.path.dirname(dataset_manifest_file()), exist_ok=True)
+    with open(dataset_manifest_file(), 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+def load_data(type, file=None):
 
-    path = os.path.join(config.results_folder, learning_config['dataset'], type)
-    file = learning_config['dataset'] + '_' + type + '.hdf5'
     #dataset = HDF5Dataset(path, recursive=True, load_data=False,
                           #data_cache_size=4, transform=None)
 
-    dataset = HDF5Dataset(os.path.join(path, file), type)
+    if file is None:
+        file = dataset_file(type)
+    with h5py.File(file, 'r', libver='latest', swmr=True) as hdf:
+        variable_length = 'offsets_' + type in hdf
+        virtual_windows = 'window_index_' + type in hdf
+    if scrambled_layout(file, type):
+        print('Warning: %s was saved in the former layout, which mixes up the time steps of the samples; create the '
+              'dataset again before training on it' % file)
+    if variable_length:
+        return resolution_loader(noisy_loader(load_variable_length_data(type, file), type, file, learning_config), learning_config)
+    if virtual_windows:
+        return resolution_loader(noisy_loader(load_window_data(type, file), type, file, learning_config), learning_config)
+    if learning_config.get("in_memory_data", False):
+        return resolution_loader(noisy_loader(load_in_memory_data(type, file), type, file, learning_config), learning_config)
+
+    dataset = HDF5Dataset(file, type)
 
     #pd.read_hdf(config.results_folder + learning_config['dataset'] + '_' + 'train' + '.h5', key = 'train/data', mode='a')
     #pd.read_hdf(config.results_folder + learning_config['dataset'] + '_' + 'train' + '.h5', key = 'train/label', mode='a')
@@ -161,12 +710,217 @@ def load_data(type):
         loader_params = {'batch_size': learning_config['mini batch size'], 'shuffle': True, 'num_workers': 1}
     data_loader = data.DataLoader(dataset, **loader_params)
 
-    return data_loader
+    return resolution_loader(noisy_loader(data_loader, type, file, learning_config), learning_config)
+
+def load_in_memory_data(type, file):
+    '''
+    loader slicing batches from the whole dataset held in shared memory (see shared_data.py); the raw samples are only
+    loaded if samples are plotted
+    '''
+    from shared_data import SharedTensorLoader
+    batch_size = learning_config['mini batch size'] if type == 'train' else 100
+    return SharedTensorLoader(file, type, batch_size, shuffle=type == 'train',
+                              with_raw=bool(learning_config.get("plot samples", False)))
+
+def load_variable_length_data(type, file):
+    '''
+    loader over samples of different lengths: batches are bucketed by length, padded at the end and come with the
+    lengths of their samples (samples, labels, raw samples, lengths)
+    '''
+    dataset = VariableLengthDataset(file, type)
+    batch_size = learning_config['mini batch size'] if type == 'train' else 100
+    sampler = LengthBucketSampler(dataset.lengths, batch_size, shuffle=type == 'train')
+    return data.DataLoader(dataset, batch_sampler=sampler, collate_fn=pad_collate, num_workers=1)
+
+def near_duplicate_index():
+    '''
+    index for removing near duplicate windows if "deduplicate_windows" is set in the learning config
+    '''
+    if not learning_config.get("deduplicate_windows", False):
+        return None
+    from dedup import NearDuplicateIndex
+    return NearDuplicateIndex(learning_config.get("dedup tolerance", 0.001))
+
+def dedup_report_file():
+    return os.path.join(dataset_folder(), learning_config['dataset'] + '_dedup.json')
+
+def save_window_index(stride=None, seed=0):
+    '''
+    instead of copying samples into the dataset files, only an index of windows over the raw store (see raw_store.py)
+    is saved to them, along with the max abs values fitted on the training windows; the raw results are added to the
+    store first if they are not in there yet
+    '''
+    from raw_store import build_raw_store, window_index, split_index
+    manifest = build_raw_store()
+    near_duplicates = near_duplicate_index()
+    index = window_index(manifest, config.sample_length, stride=stride, number_of_samples=config.number_of_samples,
+                         share_of_positive_samples=config.share_of_positive_samples, seed=seed,
+                         near_duplicates=near_duplicates)
+    if near_duplicates is not None:
+        near_duplicates.print_report()
+        near_duplicates.write_report(dedup_report_file())
+    indices = dict(zip(['train', 'test'], split_index(index, config.train_test_split, seed=seed)))
+    max_abs = VirtualWindowDataset(manifest, indices['train'], config.sample_length,
+                                   constant_negatives=config.raw_data_set_name == 'dummy').fit_max_abs()
+
+    for type, index in indices.items():
+        file = dataset_file(type)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        with h5py.File(file, 'w') as hdf:
+            dset = hdf.create_dataset('window_index_' + type, data=index)
+            dset.attrs['raw store'] = manifest['folder']
+            dset.attrs['sample length'] = config.sample_length
+            hdf.create_dataset('max_abs', data=max_abs)
+        print('%d %s windows indexed in %s' % (len(index), type, file))
+    return indices
+
+def load_window_data(type, file):
+    '''
+    loader over windows sliced from the memory mapped raw store by the index saved with save_window_index
+    '''
+    from raw_store import load_manifest
+    with h5py.File(file, 'r') as hdf:
+        dset = hdf['window_index_' + type]
+        index, folder, sample_length = dset[:], dset.attrs['raw store'], int(dset.attrs['sample length'])
+        max_abs = hdf['max_abs'][:]
+    dataset = VirtualWindowDataset(load_manifest(folder), index, sample_length, max_abs=max_abs,
+                                   constant_negatives=config.raw_data_set_name == 'dummy')
+    if type == 'test':
+        loader_params = {'batch_size': len(dataset) if len(dataset) < 1000 else 100, 'shuffle': False, 'num_workers': 1}
+    else:
+        loader_params = {'batch_size': learning_config['mini batch size'], 'shuffle': True, 'num_workers': 1}
+    return data.DataLoader(dataset, **loader_params)
+
+def save_variable_length_dataset(raw_samples, labels, type, file=None, max_abs=None):
+    '''
+    writes samples of different lengths back to back with an offsets array (see HDF5Dataset.VariableLengthDataset);
+    they are preprocessed like the fixed length datasets: zero meaned by themselves and scaled with the max abs value of
+    every time step over the training samples reaching it. Returns the max abs values (pass them on for the test set).
+    '''
+    if file is None:
+        file = dataset_file(type)
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+
+    raw_samples = [np.asarray(x, dtype=np.float32).reshape(-1) for x in raw_samples]
+    zeromean = [x - x.mean() for x in raw_samples]
+    longest = max(len(x) for x in zeromean)
+    if max_abs is None:
+        max_abs = np.zeros(longest, dtype=np.float32)
+        for x in zeromean:
+            np.maximum(max_abs[:len(x)], np.abs(x), out=max_abs[:len(x)])
+    scale = np.ones(max(longest, len(max_abs)), dtype=np.float32)       # time steps not seen in training are not scaled
+    scale[:len(max_abs)] = np.where(max_abs == 0, 1, max_abs)
+    offsets = np.zeros(len(raw_samples) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(x) for x in raw_samples])
+
+    with h5py.File(file, 'w') as hdf:
+        hdf.create_dataset('x_' + type, data=np.concatenate([x / scale[:len(x)] for x in zeromean]).astype(np.float32), compression='gzip', chunks=True)
+        hdf.create_dataset('x_raw_' + type, data=np.concatenate(raw_samples), compression='gzip', chunks=True)
+        hdf.create_dataset('offsets_' + type, data=offsets)
+        hdf.create_dataset('y_' + type, data=np.asarray(labels, dtype=int).reshape(-1, 1), compression='gzip', chunks=True)
+        hdf.create_dataset('max_abs', data=np.asarray(max_abs, dtype=np.float32))
+    return max_abs
+
+def combine_datasets(datasets):
+    '''
+    combines fixed length datasets (e.g. the 1 day and the 7 day variant) into one dataset of samples of different
+    lengths saved under the name of the dataset of the learning config, so that one model can learn all horizons
+    '''
+    max_abs = None
+    for type in ['train', 'test']:
+        raw_samples, labels = [], []
+        for name in datasets:
+            file = dataset_file(type, name)
+            with h5py.File(file, 'r') as hdf:
+                raw_samples += list(codec.read_raw(hdf, 'x_raw_' + type))
+                labels += list(hdf['y_' + type][:].reshape(-1))
+        max_abs = save_variable_length_dataset(raw_samples, labels, type, max_abs=max_abs)
+        print('Dataset %s (%s) combined from %s' % (learning_config['dataset'], type, ', '.join(datasets)))
+
+REDUCTIONS = {'mean': np.mean, 'min': np.min, 'max': np.max, 'last': lambda x, axis: np.take(x, -1, axis=axis)}
+
+def derive_samples(x_raw, y, slice_length=None, stride=None, aggregate=None, how='mean'):
+    '''
+    shorter or coarser samples from a block of samples [samples, steps(, features)]: aggregate steps are reduced to one
+    (e.g. 4 quarter hours to an hour, by their mean, min, max or last value), then the samples are cut into slices of
+    slice_length steps starting every stride steps (non overlapping if None); every slice keeps the label of its sample
+    '''
+    if aggregate and aggregate > 1:
+        steps = x_raw.shape[1] // aggregate * aggregate                 # incomplete periods at the end are dropped
+        x_raw = x_raw[:, :steps].reshape((len(x_raw), steps // aggregate, aggregate) + x_raw.shape[2:])
+        x_raw = REDUCTIONS[how](x_raw, axis=2)
+    if slice_length:
+        starts = np.arange(0, x_raw.shape[1] - slice_length + 1, stride or slice_length)
+        slices = len(starts)
+        windows = x_raw[:, starts[:, None] + np.arange(slice_length)]           # [samples, slices, slice_length, ...]
+        x_raw = windows.reshape((-1, slice_length) + x_raw.shape[2:])            # [samples * slices, ...]
+        y = np.repeat(np.asarray(y).reshape(-1), slices)
+    return x_raw, y
+
+def derived_slices(steps, slice_length=None, stride=None, aggregate=None):
+    '''
+    number of samples derive_samples cuts from every sample of the given number of steps
+    '''
+    if aggregate and aggregate > 1:
+        steps = steps // aggregate
+    if not slice_length:
+        return 1
+    return max(steps - slice_length, -1) // (stride or slice_length) + 1
+
+def derive_dataset(source, slice_length=None, stride=None, aggregate=None, how='mean', number_of_samples=None, seed=0,
+                   chunk_samples=1000):
+    '''
+    derives the dataset of the learning config from an existing fixed length dataset instead of creating it from the raw
+    data again, e.g. 1 day samples cut from 7 day samples or hourly samples from 15 minute samples (see derive_samples);
+    with number_of_samples, that many of the derived training samples (and the share of the test samples of the source)
+    are drawn at random. The samples are derived and written block by block, the draw is made up front from the number
+    of samples cut from every source sample. The max abs values are fitted on the derived training samples.
+    '''
+    if how not in REDUCTIONS:
+        print('Unknown aggregation %s, choose one of %s' % (how, ', '.join(REDUCTIONS)))
+        return None
+    rng = np.random.default_rng(seed)
+    max_abs = None
+    share = None
+    for type in ['train', 'test']:
+        with h5py.File(dataset_file(type, source), 'r') as hdf:
+            if 'x_raw_' + type not in hdf or 'offsets_' + type in hdf:
+                print('Only datasets of fixed length samples can be derived from (%s)' % dataset_file(type, source))
+                return None
+            y = hdf['y_' + type]
+            slices = derived_slices(hdf['x_raw_' + type].shape[1], slice_length, stride, aggregate)
+            if slices == 0:
+                print('Samples of %d steps are too short for slices of %d steps%s' % (
+                    hdf['x_raw_' + type].shape[1], slice_length, ' after aggregating %d steps' % aggregate
+                    if aggregate and aggregate > 1 else ''))
+                return None
+            chosen = None
+            if number_of_samples is not None:
+                total = len(y) * slices
+                share = share or min(number_of_samples / max(total, 1), 1)
+                chosen = np.zeros(total, dtype=bool)
+                chosen[rng.choice(total, int(round(total * share)), replace=False)] = True
+
+            writer = dataset_writer(type, max_abs)
+            for start in range(0, len(y), chunk_samples):
+                x, labels = derive_samples(codec.read_raw(hdf, 'x_raw_' + type, slice(start, start + chunk_samples)),
+                                           y[start:start + chunk_samples], slice_length, stride, aggregate, how)
+                if chosen is not None:
+                    keep = chosen[start * slices:start * slices + len(labels)]
+                    x, labels = x[keep], labels[keep]
+                if len(labels):
+                    writer.append(x, labels)
+        max_abs = writer.close()
+        print('Dataset %s (%s, %d samples) derived from %s' % (learning_config['dataset'], type, writer.samples, source))
+    return max_abs
 
 def load_dataset(dataset=None):
     '''
         deprecated
     '''
+    from malfunctions_in_LV_grid_dataset import MlfctinLVdataset
+    from PV_noPV_dataset import PVnoPVdataset
+    from dummy_dataset import Dummydataset
 
     if not dataset:
         if learning_config['dataset'][:7] == 'PV_noPV':
@@ -194,11 +948,13 @@ def preprocess(X_train, X_test):
     return X_train, X_test
 
 def fit_scaler(X):
+    from sklearn.preprocessing import MaxAbsScaler
     X_zeromean = np.array(X - X.mean())             # deduct it's own mean from every sample
     maxabs_scaler = MaxAbsScaler().fit(X_zeromean.reshape(X_zeromean.shape[1], X_zeromean.shape[0]))                          # fit scaler as to scale training data between -1 and 1
     return maxabs_scaler
 
 def preprocessing(X, scaler):
+    import pandas as pd
     X_zeromean = np.array(X - X.mean())
     X = scaler.transform(X_zeromean.reshape(X_zeromean.shape[1], X_zeromean.shape[0]))
     return pd.DataFrame(data=X)